@@ -0,0 +1,168 @@
+import click
+import json
+import logging
+import os
+import tempfile
+import time
+from benchmarks import synthetic_logs
+from src import extract_file, database_connection
+from src.transform_ua import parse_user_agent_string, UserAgentCache
+from src.transform_ip import parse_ip, count_countries_cities
+
+# Linux files the peak RSS of the process is reset through and read from
+CLEAR_REFS_FILE = '/proc/self/clear_refs'
+STATUS_FILE = '/proc/self/status'
+
+
+def reset_peak_rss():
+    """Resets the peak resident set size of the process to its current RSS, so that the next peak read is the peak
+    of what runs in between. Only Linux allows it
+
+    Returns
+    -------
+    reset : boolean
+        True if the peak was reset
+    """
+    try:
+        with open(CLEAR_REFS_FILE, 'w') as write_file:
+            write_file.write('5')
+    except OSError:
+        return False
+
+    return True
+
+
+def peak_rss_mb():
+    """Gets the peak resident set size of the process since it was last reset
+
+    Returns
+    -------
+    peak_rss : float
+        peak RSS in MB or None if it can not be measured
+    """
+    try:
+        with open(STATUS_FILE) as read_file:
+            for line in read_file:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def time_stage(results, stage, rows, func, *args):
+    """Runs a stage of the etl and records its duration, throughput and peak RSS. The peak is reset before the stage,
+    so it is not the one of an earlier stage, and not reported where it can not be reset
+
+    Parameters
+    ----------
+    results : dict
+        stage results, updated with the new stage
+    stage : str
+        name of the stage
+    rows : int
+        number of rows processed by the stage or None for the number of rows of the dataframe it returns
+    func : callable
+        stage function
+    args : tuple
+        stage function arguments
+
+    Returns
+    -------
+    result : object
+        what the stage function returns
+    """
+    reset = reset_peak_rss()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    if rows is None:
+        rows = result.shape[0]
+    results[stage] = {'seconds': round(seconds, 4), 'rows': rows,
+                      'rows_per_sec': round(rows / seconds) if seconds > 0 else None,
+                      'peak_rss_mb': peak_rss_mb() if reset else None}
+
+    return result
+
+
+def run_benchmarks(path, db_file):
+    """Times every stage of the etl over a tsv.gz file
+
+    Parameters
+    ----------
+    path : str
+        tsv.gz file with the logs
+    db_file : str
+        database file the events are loaded into
+
+    Returns
+    -------
+    results : dict
+        duration, rows per second and peak RSS of every stage
+    """
+    results = dict()
+
+    df = time_stage(results, 'get_file', None, extract_file.get_file, path)
+    rows = df.shape[0]
+
+    # Cold cache, so the user agent strings are parsed as in a first run
+    parsed_ua_df = time_stage(results, 'parse_user_agent_string', rows, parse_user_agent_string, df, True,
+                              UserAgentCache())
+    df.drop(['user_agent_string'], axis=1, inplace=True)
+    df[['device', 'os', 'browser']] = parsed_ua_df[['device', 'os', 'browser']]
+
+    parsed_ip_df = time_stage(results, 'parse_ip', rows, parse_ip, df, True)
+    df.drop(['ip'], axis=1, inplace=True)
+    df[['country', 'city']] = parsed_ip_df[['country', 'city']]
+
+    time_stage(results, 'count_countries_cities', rows, count_countries_cities, parsed_ip_df)
+
+    conn = database_connection.create_database_connection(db_file)
+    time_stage(results, 'create_table', rows, database_connection.create_table, conn, df, 'replace')
+    conn.close()
+
+    pool = database_connection.ConnectionPool(db_file)
+    time_stage(results, 'query_table', rows, database_connection.query_table, pool.connect(), 'browser')
+    pool.close()
+
+    return results
+
+
+@click.command()
+@click.option('--rows', '-n', type=int, default=100000, help='Number of rows, duplicates included')
+@click.option('--ua-cardinality', type=int, default=1000, help='Number of distinct user agent strings')
+@click.option('--ip-cardinality', type=int, default=10000, help='Number of distinct IP rows')
+@click.option('--user-cardinality', type=int, default=20000, help='Number of distinct users')
+@click.option('--duplicate-rate', type=float, default=0.01, help='Probability of a row being a duplicate')
+@click.option('--proxy-rate', type=float, default=0.05,
+              help='Fraction of IP rows that are comma separated proxy chains, i.e. several IPs')
+@click.option('--seed', type=int, default=42, help='Seed of the random number generator')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None,
+              help='File the JSON report is written to instead of standard out')
+def main(rows, ua_cardinality, ip_cardinality, user_cardinality, duplicate_rate, proxy_rate, seed, output):
+    """Generates a synthetic logs file and reports as JSON the duration, rows per second and peak RSS of every etl
+    stage over it
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    params = {'rows': rows, 'ua_cardinality': ua_cardinality, 'ip_cardinality': ip_cardinality,
+              'user_cardinality': user_cardinality, 'duplicate_rate': duplicate_rate, 'proxy_rate': proxy_rate,
+              'seed': seed}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'logs.tsv.gz')
+        synthetic_logs.write_tsv_gz(path, rows, ua_cardinality=ua_cardinality, ip_cardinality=ip_cardinality,
+                                    user_cardinality=user_cardinality, duplicate_rate=duplicate_rate,
+                                    proxy_rate=proxy_rate, seed=seed)
+        report = {'params': params, 'stages': run_benchmarks(path, os.path.join(tmp_dir, 'events.sqlite'))}
+
+    report_json = json.dumps(report, indent=2)
+    if output is None:
+        click.echo(report_json)
+    else:
+        with open(output, 'w') as write_file:
+            write_file.write(report_json)
+
+
+if __name__ == '__main__':
+    main()
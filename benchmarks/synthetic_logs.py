@@ -0,0 +1,154 @@
+import click
+import gzip
+import hashlib
+import random
+from datetime import datetime, timedelta
+
+UA_TEMPLATES = ['Mozilla/5.0 (Windows NT 6.1; WOW64; Trident/7.0; rv:{major}.0) like Gecko',
+                'Mozilla/5.0 (Windows NT 5.1; rv:{major}.0) Gecko/20100101 Firefox/{major}.{minor}',
+                'Mozilla/5.0 (Linux; Android 4.{minor}.1; Nexus 7 Build/JOP40D) AppleWebKit/537.36 (KHTML, like Gecko) '
+                'Chrome/{major}.0.2125.{build} Safari/537.36',
+                'Mozilla/5.0 (iPhone; CPU iPhone OS 8_{minor} like Mac OS X) AppleWebKit/600.1.4 (KHTML, like Gecko) '
+                'Version/8.0 Mobile/12A{build} Safari/600.1.4',
+                'Mozilla/5.0 (iPad; CPU OS 7_{minor} like Mac OS X) AppleWebKit/537.51.2 (KHTML, like Gecko) '
+                'Version/7.0 Mobile/11D{build} Safari/9537.53',
+                'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_{minor}) AppleWebKit/537.36 (KHTML, like Gecko) '
+                'Chrome/{major}.0.1985.{build} Safari/537.36']
+START_TIMESTAMP = datetime(2014, 10, 12)
+
+
+def sha1(rng):
+    """Builds a random 40 characters hex string, like the user ids and urls of the logs
+
+    Parameters
+    ----------
+    rng : random.Random
+        random number generator
+
+    Returns
+    -------
+    hex : str
+        40 characters hex string
+    """
+    return hashlib.sha1(str(rng.random()).encode()).hexdigest()
+
+
+def build_pools(rng, ua_cardinality, ip_cardinality, user_cardinality, proxy_rate):
+    """Builds the distinct user agent strings, IPs and users the rows are drawn from
+
+    Parameters
+    ----------
+    rng : random.Random
+        random number generator
+    ua_cardinality : int
+        number of distinct user agent strings
+    ip_cardinality : int
+        number of distinct IP rows
+    user_cardinality : int
+        number of distinct users
+    proxy_rate : float
+        fraction of IP rows that are comma separated proxy chains
+
+    Returns
+    -------
+    pools : tuple
+        lists of user agent strings, IP rows and user ids
+    """
+    uas = [UA_TEMPLATES[i % len(UA_TEMPLATES)].format(major=20 + i // len(UA_TEMPLATES) % 30, minor=i % 10,
+                                                       build=i) for i in range(ua_cardinality)]
+    ips = list()
+    for _ in range(ip_cardinality):
+        ip = '.'.join(str(rng.randint(1, 223)) for _ in range(4))
+        if rng.random() < proxy_rate:
+            ip += ', ' + '.'.join(str(rng.randint(1, 223)) for _ in range(4))
+        ips.append(ip)
+    users = [sha1(rng) for _ in range(user_cardinality)]
+
+    return uas, ips, users
+
+
+def generate_rows(rows, ua_cardinality=1000, ip_cardinality=10000, user_cardinality=20000, duplicate_rate=0.01,
+                  proxy_rate=0.05, hours=24, seed=42):
+    """Deterministically generates log rows with the columns of the tsv file: date, time, user_id, url, ip and
+    user_agent_string
+
+    Parameters
+    ----------
+    rows : int
+        number of rows, duplicates included
+    ua_cardinality : int
+        number of distinct user agent strings
+    ip_cardinality : int
+        number of distinct IP rows
+    user_cardinality : int
+        number of distinct users
+    duplicate_rate : float
+        probability of a row being an exact copy of a previous one
+    proxy_rate : float
+        fraction of IP rows that are comma separated proxy chains
+    hours : int
+        number of hours the timestamps are spread over
+    seed : int
+        seed of the random number generator, the same seed always generates the same rows
+
+    Yields
+    ------
+    row : tuple
+        values of the row
+    """
+    rng = random.Random(seed)
+    uas, ips, users = build_pools(rng, ua_cardinality, ip_cardinality, user_cardinality, proxy_rate)
+    seconds = hours * 3600
+
+    previous_rows = list()
+    for _ in range(rows):
+        if previous_rows and rng.random() < duplicate_rate:
+            row = rng.choice(previous_rows)
+        else:
+            timestamp = START_TIMESTAMP + timedelta(seconds=rng.randrange(seconds))
+            row = (timestamp.strftime('%Y-%m-%d'), timestamp.strftime('%H:%M:%S'), rng.choice(users),
+                   'http://{}/{}'.format(sha1(rng), sha1(rng)), rng.choice(ips), rng.choice(uas))
+            # Bounded sample of previous rows to copy the duplicates from
+            if len(previous_rows) < 1000:
+                previous_rows.append(row)
+            else:
+                previous_rows[rng.randrange(1000)] = row
+        yield row
+
+
+def write_tsv_gz(path, rows, **kwargs):
+    """Writes generated log rows into a gzip compressed tsv file, without holding them in memory
+
+    Parameters
+    ----------
+    path : str
+        path of the file
+    rows : int
+        number of rows, duplicates included
+    kwargs : dict
+        generate_rows parameters
+    """
+    with gzip.open(path, 'wt') as write_file:
+        for row in generate_rows(rows, **kwargs):
+            write_file.write('\t'.join(row) + '\n')
+
+
+@click.command()
+@click.argument('path')
+@click.option('--rows', '-n', type=int, default=100000, help='Number of rows, duplicates included')
+@click.option('--ua-cardinality', type=int, default=1000, help='Number of distinct user agent strings')
+@click.option('--ip-cardinality', type=int, default=10000, help='Number of distinct IP rows')
+@click.option('--user-cardinality', type=int, default=20000, help='Number of distinct users')
+@click.option('--duplicate-rate', type=float, default=0.01, help='Probability of a row being a duplicate')
+@click.option('--proxy-rate', type=float, default=0.05,
+              help='Fraction of IP rows that are comma separated proxy chains, i.e. several IPs')
+@click.option('--seed', type=int, default=42, help='Seed of the random number generator')
+def main(path, rows, ua_cardinality, ip_cardinality, user_cardinality, duplicate_rate, proxy_rate, seed):
+    """Writes a synthetic webserver logs tsv.gz file to PATH
+    """
+    write_tsv_gz(path, rows, ua_cardinality=ua_cardinality, ip_cardinality=ip_cardinality,
+                 user_cardinality=user_cardinality, duplicate_rate=duplicate_rate, proxy_rate=proxy_rate, seed=seed)
+
+
+if __name__ == '__main__':
+    main()
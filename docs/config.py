@@ -1,2 +1,51 @@
 ORIG_URL = 'https://drive.google.com/file/d/1UnHcmxKcpSQIym4_gwH2gq84tvtfaZAP/view'
-DB_FILE = "data/webserver_logs.sqlite"
\ No newline at end of file
+DB_FILE = "data/webserver_logs.sqlite"
+# Number of rows per dataframe when the file is streamed in chunks
+CHUNK_SIZE = 100000
+# Parsed user agent strings kept in memory and persisted between runs
+UA_CACHE_FILE = "data/ua_cache.json"
+UA_CACHE_SIZE = 50000
+# Read-only connections kept open by the API and prepared statements cached per connection
+DB_POOL_SIZE = 8
+DB_STATEMENT_CACHE_SIZE = 64
+# Seconds a connection waits for a lock before failing
+DB_TIMEOUT = 5.0
+# Serialized /stats responses kept by the API until the data changes or they expire
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 300
+# Number of countries, cities, browsers and OS's in the top lists
+TOP_N = 5
+# Counters kept per top list when the top is computed over chunks, the top is exact while fewer distinct values occur
+HEAVY_HITTERS_CAPACITY = 10000
+# Unique users per browser and OS of the top lists: 'hll' estimates them in constant memory, 'exact' keeps
+# the hashed user ids
+DISTINCT_COUNT_MODE = 'hll'
+# HyperLogLog registers are 2 ** HLL_PRECISION bytes per browser or OS, the standard error is 1.04 / sqrt(registers)
+HLL_PRECISION = 14
+# Chunks read ahead of the transformation and transformed ahead of the database writer in chunked runs
+PIPELINE_QUEUE_SIZE = 4
+# Directory of the enriched dataframes checkpointed by content hash of their source, None to disable the checkpoints
+CHECKPOINT_DIR = 'data/checkpoints'
+# Checkpoints kept in CHECKPOINT_DIR, the least recently used ones are removed when a new one is written
+CHECKPOINT_MAX_FILES = 4
+# API server started by src/serve.py. Every worker process runs SERVE_THREADS threads, keep DB_POOL_SIZE at least as big
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 5000
+SERVE_WORKERS = 4
+SERVE_THREADS = 8
+# Queries run at the same time, and read-only connections kept, by the asyncio variant of the API
+ASYNC_QUERY_THREADS = 8
+# Rows fetched at a time when streaming a stats response, and largest page a stats request can ask for
+STREAM_BATCH_ROWS = 500
+STATS_MAX_LIMIT = 10000
+# Streamed responses bigger than this many bytes are not kept in the response cache
+RESPONSE_CACHE_MAX_BODY = 1048576
+# Store of the events loaded by the etl and queried by the API: 'sqlite' keeps them in DB_FILE, 'parquet' in Parquet
+# files of PARQUET_DIR, scanned column by column by the aggregate queries
+STORAGE_BACKEND = 'sqlite'
+PARQUET_DIR = 'data/events_parquet'
+# Days of events kept by the store, counted back from its most recent day, older days are dropped by the loads. None
+# keeps every day
+RETENTION_DAYS = None
+# Files a day partition of the parquet backend keeps from successive loads, the next load compacts its newest files
+PARTITION_MAX_FILES = 8
@@ -0,0 +1,10 @@
+#!/usr/bin/env bash
+
+pushd "${0%/*}"
+pushd ..
+
+mkdir -p reports
+python -m benchmarks.run_benchmarks --output reports/benchmark.json "$@"
+
+popd
+popd
@@ -15,4 +15,4 @@ echo "Uninstalling external libraries"
 virtualenv --clear venv
 
 echo "Adding the code"
-zip -g $ZIP_NAME src/* tests/* tests/unit/* tests/functional/* scripts/* scripts/.coveragerc reports/* docs/* data/* requirements.txt README.md .coverage
\ No newline at end of file
+zip -g $ZIP_NAME src/* benchmarks/* tests/* tests/unit/* tests/functional/* scripts/* scripts/.coveragerc reports/* docs/* data/* requirements.txt README.md .coverage
\ No newline at end of file
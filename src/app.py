@@ -1,15 +1,35 @@
-from flask import Flask, request, Response
+from flask import Flask, request, Response, current_app
 from werkzeug.exceptions import BadRequest, NotFound
 from http import HTTPStatus
+from urllib.parse import urlencode
+import itertools
 import json
 import datetime
-from src import database_connection
+import atexit
+from src import database_connection, storage
+from src.response_cache import ResponseCache, CachedResponse
 from docs import config
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def create_app():
+# Media type of the stats streamed as one JSON array per line, on request of the Accept header
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def create_app(db_file=None):
     application = Flask(__name__)
 
+    # Store of the events, with the read-only connections shared by the requests of this process closed when it exits
+    events_storage = storage.get_storage(path=db_file)
+    application.extensions['storage'] = events_storage
+    application.extensions['db_pool'] = events_storage.pool
+    atexit.register(events_storage.close)
+    # Serialized responses, valid until the etl loads new data
+    application.extensions['response_cache'] = ResponseCache()
+
     @application.route('/stats/browser', methods=['GET'])
     def stats_browser():
         """
@@ -19,6 +39,7 @@ def create_app():
             description: Fetch a breakdown summary of all browsers for a given start and end date or for the whole table.
             produces:
             - "application/json"
+            - "application/x-ndjson"
             parameters:
             - name: start_date
               description: start date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
@@ -28,6 +49,14 @@ def create_app():
               description: end date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
               required: No
               type: datetime
+            - name: limit
+              description: maximum number of values in the page, the Link header of a full page holds the url of the next page.
+              required: No
+              type: integer
+            - name: cursor
+              description: position of the page, as given by the Link header of the previous page.
+              required: No
+              type: integer
             responses:
                 200:
                     description: Browsers breakdown was successfully retrieved.
@@ -53,6 +82,7 @@ def create_app():
             description: Fetch a breakdown summary of all OS's for a given start and end date or for the whole table.
             produces:
             - "application/json"
+            - "application/x-ndjson"
             parameters:
             - name: start_date
               description: start date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
@@ -62,6 +92,14 @@ def create_app():
               description: end date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
               required: No
               type: datetime
+            - name: limit
+              description: maximum number of values in the page, the Link header of a full page holds the url of the next page.
+              required: No
+              type: integer
+            - name: cursor
+              description: position of the page, as given by the Link header of the previous page.
+              required: No
+              type: integer
             responses:
                 200:
                     description: OS's breakdown was successfully retrieved.
@@ -87,6 +125,7 @@ def create_app():
             description: Fetch a breakdown summary of all devices for a given start and end date or for the whole table.
             produces:
             - "application/json"
+            - "application/x-ndjson"
             parameters:
             - name: start_date
               description: start date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
@@ -96,6 +135,14 @@ def create_app():
               description: end date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
               required: No
               type: datetime
+            - name: limit
+              description: maximum number of values in the page, the Link header of a full page holds the url of the next page.
+              required: No
+              type: integer
+            - name: cursor
+              description: position of the page, as given by the Link header of the previous page.
+              required: No
+              type: integer
             responses:
                 200:
                     description: Devices breakdown was successfully retrieved.
@@ -112,6 +159,58 @@ def create_app():
         """
         return get_stats('device')
 
+    @application.route('/stats', methods=['GET'])
+    def stats_batch():
+        """
+        ---
+        get:
+            summary: several breakdowns at once
+            description: Fetch in a single document the breakdowns of several dimensions (browser, os, device, country,
+                and city), and of pairs of them, for a given start and end date or for the whole table, optionally
+                per hour or day.
+            produces:
+            - "application/json"
+            parameters:
+            - name: dimensions
+              description: comma separated dimensions to break the events down by, e.g. browser,os,country.
+              required: No
+              type: string
+            - name: group_by
+              description: comma separated pair of dimensions to break the events down by together, e.g. os,browser.
+                Can be repeated.
+              required: No
+              type: string
+            - name: bucket
+              description: hour or day to break down every hour or day of the timeframe separately.
+              required: No
+              type: string
+            - name: start_date
+              description: start date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
+              required: No
+              type: datetime
+            - name: end_date
+              description: end date of the given timeframe - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
+              required: No
+              type: datetime
+            responses:
+                200:
+                    description: Breakdowns were successfully retrieved.
+                    content:
+                        application/json
+                400:
+                    description: The browser (or proxy) sent a request that this server could not understand.
+                404:
+                    description: No events found.
+                500:
+                    description: Internal Server Error
+                    content:
+                        application/json
+        """
+        batch = parse_batch_args(request.args)
+        cached_response = build_batch_response(current_app.extensions['storage'],
+                                               current_app.extensions['response_cache'], *batch)
+        return json_response(cached_response)
+
     return application
 
 
@@ -146,24 +245,479 @@ def get_stats(breakdown_element):
     Raises
     ------
     BadRequest
-        If just one datetime or a different argument is indicated.
+        If just one datetime, a wrong page or a different argument is indicated.
     NotFound
         If no events found for the indicated timeframe.
     """
-    if len(request.args) == 2 and 'start_date' in request.args and 'end_date' in request.args:
-        start_date = validate_timestamp(request.args.get('start_date'))
-        end_date = validate_timestamp(request.args.get('end_date'))
-        result = database_connection.query_table(database_connection.create_database_connection(config.DB_FILE), breakdown_element, start_date, end_date)
-    elif len(request.args) == 0:
-        result = database_connection.query_table(database_connection.create_database_connection(config.DB_FILE), breakdown_element)
+    start_date, end_date, limit, offset = parse_stats_args(request.args)
+    ndjson = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+    events_storage = current_app.extensions['storage']
+    response_cache = current_app.extensions['response_cache']
+    if limit is None:
+        return stream_stats_response(events_storage, response_cache, breakdown_element, start_date, end_date, ndjson)
+
+    # Pages are at most config.STATS_MAX_LIMIT rows, they are served whole so that their rows are counted before
+    # the headers are sent
+    cached_response = build_stats_response(events_storage, response_cache, breakdown_element, start_date, end_date,
+                                           limit, offset, ndjson)
+    response = json_response(cached_response, NDJSON_MIMETYPE if ndjson else 'application/json')
+    if cached_response.rows == limit:
+        response.headers['Link'] = next_page_link(request.path, request.args, limit, offset)
+    return response
+
+
+def next_page_link(path, args, limit, offset):
+    """Builds the Link header of a full stats page pointing to the next page. The next page starts where this one
+    ends. Pages shorter than limit are the last ones and have no Link header
+
+    Parameters
+    ----------
+    path : str
+        path of the stats request
+    args : MultiDict
+        url string parameters of the stats request
+    limit : int
+        maximum number of values in the page
+    offset : int
+        number of values skipped by the previous pages
+
+    Returns
+    -------
+    link : str
+        value of the Link header
+    """
+    args = [(key, value) for key, value in args.items(multi=True) if key != 'cursor']
+    return '<{}?{}>; rel="next"'.format(path, urlencode(args + [('cursor', offset + limit)]))
+
+
+def json_response(cached_response, mimetype='application/json'):
+    """Builds the HTTP response of a serialized stats document
+
+    Parameters
+    ----------
+    cached_response : CachedResponse
+        serialized stats
+    mimetype : str
+        media type of the serialized stats
+
+    Returns
+    -------
+    response : Response
+        JSON response, 304 without body if the client already has it
+    """
+    response = Response(cached_response.body, status=HTTPStatus.OK, mimetype=mimetype)
+    if cached_response.etag is None:
+        return response
+    # Clients sending the entity tag of the current response in If-None-Match get a 304 without body
+    response.set_etag(cached_response.etag)
+    return response.make_conditional(request)
+
+
+def parse_timeframe(args):
+    """Validates the url string parameters of a stats request
+
+    Parameters
+    ----------
+    args : MultiDict
+        url string parameters
+
+    Raises
+    ------
+    BadRequest
+        If just one datetime or a different argument is indicated.
+
+    Returns
+    -------
+    timeframe : tuple
+        start and end dates or None and None for the whole table
+    """
+    if len(args) == 2 and 'start_date' in args and 'end_date' in args:
+        return validate_timestamp(args.get('start_date')), validate_timestamp(args.get('end_date'))
+    elif len(args) == 0:
+        return None, None
     else:
         print("Warning! Bad form content. Only one start_date and one end_date or none should be provided")
         raise BadRequest('Only one start_date and one end_date or none should be provided')
 
+
+def parse_stats_args(args):
+    """Validates the url string parameters of a stats request, the timeframe and the page
+
+    Parameters
+    ----------
+    args : MultiDict
+        url string parameters
+
+    Raises
+    ------
+    BadRequest
+        If just one datetime, a wrong limit or cursor, or a different argument is indicated.
+
+    Returns
+    -------
+    stats_args : tuple
+        start date, end date, limit and offset of the page, None for no limit
+    """
+    limit = parse_count(args, 'limit', 1, config.STATS_MAX_LIMIT)
+    offset = parse_count(args, 'cursor', 0)
+    timeframe_args = {key: args.get(key) for key in args if key not in ('limit', 'cursor')}
+    start_date, end_date = parse_timeframe(timeframe_args)
+
+    return start_date, end_date, limit, offset or 0
+
+
+def parse_count(args, name, minimum, maximum=None):
+    """Validates an integer url string parameter
+
+    Parameters
+    ----------
+    args : MultiDict
+        url string parameters
+    name : str
+        parameter name
+    minimum : int
+        smallest value allowed
+    maximum : int
+        largest value allowed or None
+
+    Raises
+    ------
+    BadRequest
+        If the parameter is not an integer in the allowed range.
+
+    Returns
+    -------
+    count : int
+        value of the parameter or None if it is not indicated
+    """
+    if name not in args:
+        return None
+
+    try:
+        count = int(args.get(name))
+    except ValueError:
+        count = None
+    if count is None or count < minimum or (maximum is not None and count > maximum):
+        raise BadRequest('{} must be an integer from {} to {}'.format(name, minimum,
+                                                                      maximum if maximum is not None else 'any'))
+
+    return count
+
+
+def encode_rows(batches, ndjson=False):
+    """Serializes batches of rows as they come, as a JSON array or as one JSON array per line
+
+    Parameters
+    ----------
+    batches : iterable
+        batches of rows
+    ndjson : boolean
+        True for newline delimited JSON
+
+    Yields
+    ------
+    chunk : bytes
+        serialized batch
+    """
+    if ndjson:
+        for rows in batches:
+            yield b''.join(dumps(row) + b'\n' for row in rows)
+        return
+
+    separator = b'['
+    for rows in batches:
+        yield separator + b','.join(dumps(row) for row in rows)
+        separator = b','
+    yield b'[]' if separator == b'[' else b']'
+
+
+def dumps(obj):
+    """Serializes to JSON, with orjson if installed
+
+    Parameters
+    ----------
+    obj : object
+        lists, tuples, dicts, strings and numbers
+
+    Returns
+    -------
+    body : bytes
+        UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def stream_stats_response(events_storage, response_cache, breakdown_element, start_date=None, end_date=None,
+                          ndjson=False):
+    """Builds the HTTP response of all the stats of a breakdown, from the response cache while the data has not
+    changed. Stats fetched in a single batch are served whole with an entity tag, larger ones are streamed from the
+    cursor batch by batch, and cached once sent unless bigger than config.RESPONSE_CACHE_MAX_BODY
+
+    Parameters
+    ----------
+    events_storage : Storage
+        store of the events
+    response_cache : ResponseCache
+        cache of serialized responses
+    breakdown_element : str
+        string indicating the desired element breakdown
+    start_date : str
+        start date of the timeframe or None for the whole table
+    end_date : str
+        end date of the timeframe or None for the whole table
+    ndjson : boolean
+        True for newline delimited JSON
+
+    Raises
+    ------
+    NotFound
+        If no events found for the indicated timeframe.
+
+    Returns
+    -------
+    response : Response
+        JSON response, 304 without body if the client already has it
+    """
+    # The same key as the stats without limit of build_stats_response, which have the same body
+    key = (breakdown_element, start_date, end_date, None, 0, ndjson)
+    mimetype = NDJSON_MIMETYPE if ndjson else 'application/json'
+
+    conn = events_storage.connect()
+    data_version = events_storage.get_data_version(conn)
+    cached_response = response_cache.get(key, data_version) if data_version is not None else None
+    if cached_response is not None:
+        conn.close()
+        return json_response(cached_response, mimetype)
+
+    batches = events_storage.iter_query_table(conn, breakdown_element, start_date, end_date, None, 0,
+                                              config.STREAM_BATCH_ROWS)
+    first_rows = next(batches, None)
+    if first_rows is None:
+        raise NotFound("No events found for indicated timeframe")
+
+    if len(first_rows) < config.STREAM_BATCH_ROWS:
+        # The cursor is exhausted, the rows are all there already
+        body = b''.join(encode_rows([first_rows], ndjson))
+        if data_version is None:
+            return json_response(CachedResponse(None, None, body, None, len(first_rows)), mimetype)
+        return json_response(response_cache.set(key, data_version, body, len(first_rows)), mimetype)
+
+    def generate():
+        chunks = list() if data_version is not None else None
+        size = 0
+        try:
+            for chunk in encode_rows(itertools.chain([first_rows], batches), ndjson):
+                if chunks is not None:
+                    size += len(chunk)
+                    chunks.append(chunk)
+                    if size > config.RESPONSE_CACHE_MAX_BODY:
+                        chunks = None
+                yield chunk
+            if chunks is not None:
+                response_cache.set(key, data_version, b''.join(chunks))
+        finally:
+            # Gives the connection back also when the client goes away halfway
+            batches.close()
+
+    return Response(generate(), status=HTTPStatus.OK, mimetype=mimetype)
+
+
+def build_stats_response(events_storage, response_cache, breakdown_element, start_date=None, end_date=None, limit=None,
+                         offset=0, ndjson=False):
+    """Gets the serialized stats of a breakdown, from the response cache while the data has not changed
+
+    Parameters
+    ----------
+    events_storage : Storage
+        store of the events
+    response_cache : ResponseCache
+        cache of serialized responses
+    breakdown_element : str
+        string indicating the desired element breakdown
+    start_date : str
+        start date of the timeframe or None for the whole table
+    end_date : str
+        end date of the timeframe or None for the whole table
+    limit : int
+        maximum number of values in the page or None for all of them
+    offset : int
+        number of values skipped by the previous pages
+    ndjson : boolean
+        True for newline delimited JSON
+
+    Raises
+    ------
+    NotFound
+        If no events found for the indicated timeframe.
+
+    Returns
+    -------
+    cached_response : CachedResponse
+        serialized stats and their number of rows, without entity tag if the data version is unknown
+    """
+    def query(conn):
+        rows = events_storage.query_table(conn, breakdown_element, start_date, end_date, limit, offset)
+        if rows is None:
+            return None if offset == 0 else (b'' if ndjson else b'[]', 0)
+        return b''.join(encode_rows([rows], ndjson)), len(rows)
+
+    return cached_query(events_storage, response_cache, (breakdown_element, start_date, end_date, limit, offset, ndjson),
+                        query)
+
+
+def parse_batch_args(args):
+    """Validates the url string parameters of a batch stats request
+
+    Parameters
+    ----------
+    args : MultiDict
+        url string parameters
+
+    Raises
+    ------
+    BadRequest
+        If an unknown argument, dimension or bucket, or just one datetime, is indicated.
+
+    Returns
+    -------
+    batch : tuple
+        dimensions, pairs of dimensions, bucket, start date and end date
+    """
+    unknown = set(args.keys()) - {'dimensions', 'group_by', 'bucket', 'start_date', 'end_date'}
+    if unknown:
+        raise BadRequest('Unknown arguments: {}'.format(', '.join(sorted(unknown))))
+
+    dimensions = tuple(split_dimensions(args.get('dimensions', '')))
+    pairs = tuple(tuple(split_dimensions(pair)) for pair in args.getlist('group_by'))
+    if any(len(pair) != 2 or pair[0] == pair[1] for pair in pairs):
+        raise BadRequest('group_by must be a pair of different dimensions, e.g. os,browser')
+    if not dimensions and not pairs:
+        raise BadRequest('At least one dimension or group_by pair should be provided')
+
+    bucket = args.get('bucket')
+    if bucket is not None and bucket not in database_connection.TIME_BUCKETS:
+        raise BadRequest('bucket must be one of {}'.format(', '.join(database_connection.TIME_BUCKETS)))
+
+    timeframe_args = {key: args.get(key) for key in ('start_date', 'end_date') if key in args}
+    start_date, end_date = parse_timeframe(timeframe_args)
+
+    return dimensions, pairs, bucket, start_date, end_date
+
+
+def split_dimensions(value):
+    """Splits comma separated dimensions, checking every one can be broken down by
+
+    Parameters
+    ----------
+    value : str
+        comma separated dimensions
+
+    Raises
+    ------
+    BadRequest
+        If a dimension is unknown.
+
+    Returns
+    -------
+    dimensions : list
+        dimensions
+    """
+    dimensions = [dimension.strip() for dimension in value.split(',') if dimension.strip()]
+    unknown = [dimension for dimension in dimensions if dimension not in database_connection.STATS_DIMENSIONS]
+    if unknown:
+        raise BadRequest('Unknown dimensions: {}, must be some of {}'.format(
+            ', '.join(unknown), ', '.join(database_connection.STATS_DIMENSIONS)))
+
+    return dimensions
+
+
+def build_batch_response(events_storage, response_cache, dimensions, pairs, bucket=None, start_date=None, end_date=None):
+    """Gets the serialized breakdowns of a batch request, computed from a single scan of the events, from the response
+    cache while the data has not changed
+
+    Parameters
+    ----------
+    events_storage : Storage
+        store of the events
+    response_cache : ResponseCache
+        cache of serialized responses
+    dimensions : tuple
+        dimensions to break the events down by
+    pairs : tuple
+        pairs of dimensions to break the events down by together
+    bucket : str
+        hour, day or None
+    start_date : str
+        start date of the timeframe or None for the whole table
+    end_date : str
+        end date of the timeframe or None for the whole table
+
+    Raises
+    ------
+    NotFound
+        If no events found for the indicated timeframe.
+
+    Returns
+    -------
+    cached_response : CachedResponse
+        serialized document with the timeframe, the bucket and the breakdowns
+    """
+    breakdowns = [[dimension] for dimension in dimensions] + [list(pair) for pair in pairs]
+    columns = list(dict.fromkeys(column for breakdown in breakdowns for column in breakdown))
+
+    def query(conn):
+        counts = events_storage.query_batch(conn, columns, bucket, start_date, end_date)
+        if counts is None:
+            return None
+        return dumps({'start_date': start_date, 'end_date': end_date, 'bucket': bucket,
+                      'breakdowns': database_connection.batch_breakdowns(counts, breakdowns, bucket is not None)}), None
+
+    return cached_query(events_storage, response_cache, ('batch', dimensions, pairs, bucket, start_date, end_date), query)
+
+
+def cached_query(events_storage, response_cache, key, query):
+    """Runs a stats query, unless the response of the same request is cached and the data has not changed since
+
+    Parameters
+    ----------
+    events_storage : Storage
+        store of the events
+    response_cache : ResponseCache
+        cache of serialized responses
+    key : tuple
+        request key
+    query : function
+        function of a connection, which it closes, returning the serialized result and its number of rows, None for
+        a document, or None if no events found
+
+    Raises
+    ------
+    NotFound
+        If no events found for the indicated timeframe.
+
+    Returns
+    -------
+    cached_response : CachedResponse
+        serialized result, without entity tag if the data version is unknown
+    """
+    conn = events_storage.connect()
+    data_version = events_storage.get_data_version(conn)
+
+    cached_response = response_cache.get(key, data_version) if data_version is not None else None
+    if cached_response is not None:
+        conn.close()
+        return cached_response
+
+    result = query(conn)
     if result is None:
         raise NotFound("No events found for indicated timeframe")
-    else:
-        return Response(json.dumps(result), status=HTTPStatus.OK, mimetype='application/json')
+
+    body, rows = result
+    if data_version is None:
+        return CachedResponse(None, None, body, None, rows)
+    return response_cache.set(key, data_version, body, rows)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.exceptions import HTTPException, NotFound, MethodNotAllowed
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from src import app, storage
+from src.response_cache import ResponseCache
+from docs import config
+
+# Paths of the stats endpoints and the breakdown each one serves, the same contract as the Flask application
+STATS_PATHS = {'/stats/browser': 'browser', '/stats/os': 'os', '/stats/device': 'device'}
+BATCH_PATH = '/stats'
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: while a call for a key is in flight, later callers of the same key wait
+    for its result instead of making their own call. Must be used from a single event loop
+    """
+
+    def __init__(self):
+        self._calls = dict()
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, func):
+        """Calls func, unless a call for key is already in flight, and returns its result
+
+        Parameters
+        ----------
+        key : hashable
+            key identifying identical calls
+        func : function
+            function without arguments returning an awaitable
+
+        Returns
+        -------
+        result : object
+            result of the call in flight, or exception raised by it
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        # A caller cancelled while waiting does not cancel the call the others are waiting for
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+
+class AsyncStatsApp:
+    """ASGI variant of the stats API for many concurrent clients. Requests wait on the event loop instead of blocking
+    a thread, the queries run in a bounded pool of threads sharing as many read-only connections, and identical
+    queries in flight at the same time are run once
+
+    Parameters
+    ----------
+    db_file : str
+        database file or Parquet directory of the configured storage backend, its default location by default
+    threads : int
+        maximum number of queries run at the same time
+    """
+
+    def __init__(self, db_file=None, threads=config.ASYNC_QUERY_THREADS):
+        self.storage = storage.get_storage(path=db_file, pool_size=threads)
+        self.db_pool = self.storage.pool
+        self.response_cache = ResponseCache()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='stats-query')
+        self.single_flight = SingleFlight()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            status, headers, body = await self.handle(scope)
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+            await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        """Opens the connections when the server starts and closes them when it stops
+
+        Parameters
+        ----------
+        receive : function
+            ASGI receive channel
+        send : function
+            ASGI send channel
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                opened = await asyncio.get_running_loop().run_in_executor(self.executor, self.storage.warm)
+                logging.info('{} database connections opened.'.format(opened))
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope):
+        """Serves a stats request
+
+        Parameters
+        ----------
+        scope : dict
+            ASGI connection scope
+
+        Returns
+        -------
+        response : tuple
+            status, headers and body
+        """
+        try:
+            if scope['path'] != BATCH_PATH and scope['path'] not in STATS_PATHS:
+                raise NotFound()
+            if scope['method'] not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(['GET', 'HEAD'])
+
+            ndjson = False
+            limit = None
+            args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+            if scope['path'] == BATCH_PATH:
+                cached_response = await self.get_batch(*app.parse_batch_args(args))
+            else:
+                accept = MIMEAccept(parse_accept_header(get_header(scope, 'accept') or '*/*'))
+                ndjson = accept.best_match(['application/json', app.NDJSON_MIMETYPE]) == app.NDJSON_MIMETYPE
+                start_date, end_date, limit, offset = app.parse_stats_args(args)
+                cached_response = await self.get_stats(STATS_PATHS[scope['path']], start_date, end_date, limit,
+                                                       offset, ndjson)
+        except HTTPException as e:
+            return e.code, e.get_headers(), e.get_body().encode()
+
+        headers = [('Content-Type', app.NDJSON_MIMETYPE if ndjson else 'application/json')]
+        if limit is not None and cached_response.rows == limit:
+            headers.append(('Link', app.next_page_link(scope['path'], args, limit, offset)))
+        if cached_response.etag is not None:
+            headers.append(('ETag', quote_etag(cached_response.etag)))
+            if_none_match = get_header(scope, 'if-none-match')
+            if if_none_match is not None and parse_etags(if_none_match).contains(cached_response.etag):
+                return HTTPStatus.NOT_MODIFIED, headers, b''
+
+        headers.append(('Content-Length', str(len(cached_response.body))))
+        return HTTPStatus.OK, headers, cached_response.body if scope['method'] == 'GET' else b''
+
+    async def get_stats(self, breakdown_element, start_date=None, end_date=None, limit=None, offset=0, ndjson=False):
+        """Gets the serialized stats of a breakdown in the query threads, once for all identical requests in flight.
+        Unlike the Flask application they are not streamed, the stats are sent whole once serialized
+
+        Parameters
+        ----------
+        breakdown_element : str
+            string indicating the desired element breakdown
+        start_date : str
+            start date of the timeframe or None for the whole table
+        end_date : str
+            end date of the timeframe or None for the whole table
+        limit : int
+            maximum number of values in the page or None for all of them
+        offset : int
+            number of values skipped by the previous pages
+        ndjson : boolean
+            True for newline delimited JSON
+
+        Returns
+        -------
+        cached_response : CachedResponse
+            serialized stats
+        """
+        loop = asyncio.get_running_loop()
+        query = partial(app.build_stats_response, self.storage, self.response_cache, breakdown_element, start_date,
+                        end_date, limit, offset, ndjson)
+        return await self.single_flight.do((breakdown_element, start_date, end_date, limit, offset, ndjson),
+                                           lambda: loop.run_in_executor(self.executor, query))
+
+    async def get_batch(self, dimensions, pairs, bucket=None, start_date=None, end_date=None):
+        """Gets the serialized breakdowns of a batch request in the query threads, once for all identical requests in
+        flight
+
+        Parameters
+        ----------
+        dimensions : tuple
+            dimensions to break the events down by
+        pairs : tuple
+            pairs of dimensions to break the events down by together
+        bucket : str
+            hour, day or None
+        start_date : str
+            start date of the timeframe or None for the whole table
+        end_date : str
+            end date of the timeframe or None for the whole table
+
+        Returns
+        -------
+        cached_response : CachedResponse
+            serialized document with the timeframe, the bucket and the breakdowns
+        """
+        loop = asyncio.get_running_loop()
+        query = partial(app.build_batch_response, self.storage, self.response_cache, dimensions, pairs, bucket,
+                        start_date, end_date)
+        return await self.single_flight.do(('batch', dimensions, pairs, bucket, start_date, end_date),
+                                           lambda: loop.run_in_executor(self.executor, query))
+
+    def close(self):
+        """Waits for the queries running and closes the connections
+        """
+        self.executor.shutdown(wait=True)
+        self.storage.close()
+
+
+def get_header(scope, name):
+    """Gets a request header
+
+    Parameters
+    ----------
+    scope : dict
+        ASGI connection scope
+    name : str
+        lower case header name
+
+    Returns
+    -------
+    value : str
+        header value or None
+    """
+    for key, value in scope.get('headers', []):
+        if key.decode('latin-1').lower() == name:
+            return value.decode('latin-1')
+
+    return None
+
+
+def create_async_app(db_file=None):
+    """Creates the ASGI variant of the stats API
+
+    Parameters
+    ----------
+    db_file : str
+        database file or Parquet directory of the configured storage backend, its default location by default
+
+    Returns
+    -------
+    application : AsyncStatsApp
+        ASGI application
+    """
+    return AsyncStatsApp(db_file)
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+from docs import config
+from src import extract_file
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Bumped whenever the enriched columns change, so that checkpoints written by previous versions are not read back
+CHECKPOINT_VERSION = 1
+# Bytes hashed at a time when hashing local files
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def is_enabled():
+    """Tells whether the enriched dataframes are checkpointed, i.e. a checkpoint directory is set and pyarrow is
+    installed
+
+    Returns
+    -------
+    enabled : boolean
+        True if the checkpoints are enabled
+    """
+    return config.CHECKPOINT_DIR is not None and feather is not None
+
+
+def source_digest(source=None, content=None):
+    """Hashes the content of a source, i.e. of every file of a local source in order or of the downloaded file
+
+    Parameters
+    ----------
+    source : str
+        local file, directory or glob pattern, or - for stdin. None for the file downloaded from the Google drive
+    content : bytes
+        content of the downloaded file
+
+    Returns
+    -------
+    digest : str
+        hexadecimal digest of the content or None if it cannot be hashed before being read, i.e. stdin
+    """
+    digest = hashlib.blake2b(str(CHECKPOINT_VERSION).encode(), digest_size=20)
+    if source is None:
+        if content is None:
+            return None
+        digest.update(str(len(content)).encode())
+        digest.update(content)
+        return digest.hexdigest()
+
+    if source == extract_file.STDIN_SOURCE:
+        return None
+
+    paths = extract_file.list_source_paths(source)
+    if not paths:
+        return None
+    for path in paths:
+        # The size delimits the files so that moving bytes from one file to the next changes the digest
+        digest.update(str(os.path.getsize(path)).encode())
+        with extract_file.open_mmap(path) as file_obj:
+            for block in iter(lambda: file_obj.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+def checkpoint_path(digest):
+    """Builds the path of the checkpoint of a source
+
+    Parameters
+    ----------
+    digest : str
+        digest of the source content
+
+    Returns
+    -------
+    path : str
+        path of the feather file
+    """
+    return os.path.join(config.CHECKPOINT_DIR, '{}.feather'.format(digest))
+
+
+def load_checkpoint(digest):
+    """Reads the enriched dataframe checkpointed for a source, memory mapping the feather file
+
+    Parameters
+    ----------
+    digest : str
+        digest of the source content or None
+
+    Returns
+    -------
+    df : pandas dataframe
+        enriched dataframe or None if the source has not been checkpointed
+    """
+    if digest is None or not is_enabled():
+        return None
+
+    path = checkpoint_path(digest)
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        df = feather.read_table(path, memory_map=True).to_pandas()
+    except Exception as e:
+        logging.error('Error reading checkpoint {}: {}'.format(path, e))
+        return None
+
+    try:
+        # The modification time tells the least recently used checkpoints, the first removed
+        os.utime(path)
+    except OSError:
+        pass
+    logging.info('Enriched file read from checkpoint {}.'.format(path))
+    return df
+
+
+def save_checkpoint(df, digest):
+    """Writes the enriched dataframe of a source as an uncompressed feather file, so that it can be memory mapped
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        enriched dataframe
+    digest : str
+        digest of the source content or None
+    """
+    if digest is None or not is_enabled():
+        return
+
+    path = checkpoint_path(digest)
+    os.makedirs(config.CHECKPOINT_DIR, exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+        # Replaces any previous checkpoint at once so concurrent runs never read it half written
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error('Error writing checkpoint {}: {}'.format(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    logging.info('Enriched file checkpointed to {}.'.format(path))
+    evict_checkpoints(config.CHECKPOINT_MAX_FILES)
+
+
+def evict_checkpoints(max_files):
+    """Removes the least recently written or read checkpoints beyond the newest max_files, so that the checkpoint
+    directory does not grow with every new source
+
+    Parameters
+    ----------
+    max_files : int
+        number of checkpoints kept or None to keep them all
+
+    Returns
+    -------
+    removed : list
+        paths of the removed checkpoints
+    """
+    if max_files is None or not os.path.isdir(config.CHECKPOINT_DIR):
+        return []
+
+    checkpoints = sorted(((entry.stat().st_mtime, entry.path) for entry in os.scandir(config.CHECKPOINT_DIR)
+                          if entry.is_file() and entry.name.endswith('.feather')), reverse=True)
+    removed = list()
+    for _, path in checkpoints[max_files:]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            # Another run might have removed it or be reading it on a platform that forbids removing it
+            logging.warning('Error removing checkpoint {}: {}'.format(path, e))
+            continue
+        removed.append(path)
+        logging.info('Checkpoint {} removed.'.format(path))
+
+    return removed
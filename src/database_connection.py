@@ -1,7 +1,70 @@
 from docs import config
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from urllib.request import pathname2url
+import pandas as pd
 import sqlite3
+import logging
+import os
+import queue
 from werkzeug.exceptions import InternalServerError
 
+EVENTS_LOG_COLUMNS = ['raw_event', 'timestamp', 'user_id', 'url', 'device', 'os', 'browser', 'country', 'city']
+# raw_event is the 64-bit hash of the event columns. Timestamps are stored as 'YYYY-MM-DD HH:MM:SS' text, which sorts
+# and compares chronologically
+EVENTS_LOG_SCHEMA = ("CREATE TABLE IF NOT EXISTS events_log (raw_event INTEGER NOT NULL UNIQUE,timestamp TEXT,user_id TEXT,"
+                     "url TEXT,device TEXT,os TEXT,browser TEXT,country TEXT,city TEXT)")
+# Columns the events can be broken down by. Adding one here creates its index and rollup table on the next load and
+# its query statements below
+BREAKDOWNS = ['browser', 'os', 'device']
+# Covering indexes of the breakdown queries, so date filtered breakdowns are index range scans
+EVENTS_LOG_INDEXES = ["CREATE INDEX IF NOT EXISTS events_log_timestamp_{metric} ON events_log (timestamp, {metric})"
+                      .format(metric=metric) for metric in BREAKDOWNS]
+# Hourly counts per breakdown value, kept up to date on every load
+ROLLUP_TABLE = "events_log_hourly_{metric}"
+ROLLUP_SCHEMA = ("CREATE TABLE IF NOT EXISTS events_log_hourly_{metric} (hour TEXT NOT NULL,{metric} TEXT NOT NULL,"
+                 "events INTEGER NOT NULL,PRIMARY KEY (hour, {metric})) WITHOUT ROWID")
+# Rows of the source table grouped by hour and breakdown value, added up into the rollup table
+ROLLUP_UPSERT = ("INSERT INTO events_log_hourly_{metric} (hour, {metric}, events) "
+                 "SELECT substr(timestamp, 1, 13) || ':00:00', IFNULL({metric}, ''), COUNT(*) FROM {source} "
+                 "WHERE timestamp IS NOT NULL GROUP BY 1, 2 "
+                 "ON CONFLICT (hour, {metric}) DO UPDATE SET events = events + excluded.events")
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+# Events, and hourly rollup rows, of a range of days, deleted through the timestamp indexes and the rollup keys
+DAYS_DELETES = ["DELETE FROM events_log WHERE timestamp >= ? AND timestamp < ?"] + [
+    "DELETE FROM events_log_hourly_{metric} WHERE hour >= ? AND hour < ?".format(metric=metric)
+    for metric in BREAKDOWNS]
+# Columns the batch stats can be broken down by, in a scan of events_log, and their time buckets
+STATS_DIMENSIONS = BREAKDOWNS + ['country', 'city']
+TIME_BUCKETS = {'hour': "substr(timestamp, 1, 13) || ':00:00'", 'day': "substr(timestamp, 1, 10)"}
+# Percentage of the events of every breakdown value out of the events counted by the subqueries
+BREAKDOWN_QUERY = ("SELECT {metric}, ROUND(SUM(events)/CAST(SUM(SUM(events)) OVER () AS float) * 100.0, 2) || '%' "
+                   "AS percentage FROM ({counts}) GROUP BY {metric} ORDER BY SUM(events) DESC, {metric} "
+                   "LIMIT ? OFFSET ?")
+# Two decimals the percentages are rounded to, and significant digits SQLite's ROUND keeps of a value before rounding
+PERCENTAGE_QUANTUM = Decimal('0.01')
+PERCENTAGE_DIGITS = 15
+ROLLUP_COUNTS = "SELECT {metric}, events FROM events_log_hourly_{metric}"
+ROLLUP_HOURS_COUNTS = ROLLUP_COUNTS + " WHERE hour >= ? AND hour < ?"
+RAW_COUNTS = ("SELECT IFNULL({metric}, '') AS {metric}, COUNT(*) AS events FROM events_log "
+              "WHERE timestamp {operator} ? AND timestamp < ? GROUP BY 1")
+# Fixed statements of every breakdown, the timeframe and the page are bound as parameters so that every statement is
+# prepared once per connection and reused from its statement cache whatever the dates:
+# - all: whole table, from the rollup
+# - edges: timeframe within an hour, from events_log
+# - hours: rollup rows of the hours fully inside the timeframe plus events_log rows of the partial hours at its edges
+BREAKDOWN_STATEMENTS = {
+    metric: {
+        'all': BREAKDOWN_QUERY.format(metric=metric, counts=ROLLUP_COUNTS.format(metric=metric)),
+        'edges': BREAKDOWN_QUERY.format(metric=metric, counts=RAW_COUNTS.format(metric=metric, operator='>')),
+        'hours': BREAKDOWN_QUERY.format(metric=metric, counts=' UNION ALL '.join([
+            ROLLUP_HOURS_COUNTS.format(metric=metric),
+            RAW_COUNTS.format(metric=metric, operator='>'),
+            RAW_COUNTS.format(metric=metric, operator='>=')]))}
+    for metric in BREAKDOWNS}
+LOAD_PRAGMAS = ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL", "PRAGMA temp_store=MEMORY",
+                "PRAGMA cache_size=-65536"]
+
 
 def create_database_connection(db_file):
     """Creates a database connection to the SQLite database specified by db_file
@@ -31,8 +94,163 @@ def create_database_connection(db_file):
     return conn
 
 
-def create_table(conn, df):
-    """Creates events_log table
+def create_read_only_connection(db_file):
+    """Creates a read-only connection to the SQLite database specified by db_file. It can be shared between threads,
+    as long as only one uses it at a time, and keeps its prepared statements cached to reuse them across queries
+
+    Parameters
+    ----------
+    db_file : str
+        database file
+
+    Raises
+    ------
+    sqlite3.Error
+        Error while connecting to the db.
+
+    Returns
+    -------
+    conn : object
+        connection object
+    """
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_file)))
+    return sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=config.DB_TIMEOUT,
+                           cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+
+
+class PooledConnection:
+    """Connection checked out from a ConnectionPool. Behaves like the connection object, except that closing it
+    returns the connection to the pool
+
+    Parameters
+    ----------
+    pool : ConnectionPool
+        pool the connection belongs to
+    conn : object
+        connection object
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    """Pool of read-only connections to the SQLite database. Connections are opened on demand and kept open for the
+    next requests, so the connection setup and the schema parsing are paid once per connection instead of once per
+    request. With the database in WAL mode, these readers do not block the etl writer
+
+    Parameters
+    ----------
+    db_file : str
+        database file
+    size : int
+        maximum number of idle connections kept open
+    """
+
+    def __init__(self, db_file, size=config.DB_POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self):
+        """Checks out an idle connection or opens a new one if there is none
+
+        Raises
+        ------
+        sqlite3.Error
+            Error while connecting to the db.
+
+        Returns
+        -------
+        conn : PooledConnection
+            connection object or None
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = create_read_only_connection(self.db_file)
+            except sqlite3.Error as e:
+                print({'error': str(e)})
+                return None
+
+        return PooledConnection(self, conn)
+
+    def warm(self, count=None):
+        """Opens idle connections ahead of the first requests, e.g. once per server worker, so those requests do not
+        pay the connection setup
+
+        Parameters
+        ----------
+        count : int
+            number of connections to open, the size of the pool by default
+
+        Returns
+        -------
+        opened : int
+            number of idle connections opened
+        """
+        opened = 0
+        for _ in range(min(count or self.size, self.size - self._idle.qsize())):
+            try:
+                conn = create_read_only_connection(self.db_file)
+                # Parses the schema now instead of on the first query
+                conn.execute('SELECT name FROM sqlite_master LIMIT 1').fetchall()
+            except sqlite3.Error as e:
+                print({'error': str(e)})
+                break
+            self.release(conn)
+            opened += 1
+
+        return opened
+
+    def release(self, conn):
+        """Returns a connection to the pool, closing it if the pool is already full
+
+        Parameters
+        ----------
+        conn : object
+            connection object
+        """
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        """Closes every idle connection of the pool
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def tune_connection(conn):
+    """Sets the pragmas used while loading the events_log table: write-ahead log, so readers are not blocked by the
+    load, fewer fsyncs and in-memory temporary storage
+
+    Parameters
+    ----------
+    conn : object
+        connection object
+    """
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+
+
+def create_table(conn, df, if_exists="append"):
+    """Creates events_log table if it does not exist and loads the new events of df into it
 
     Parameters
     ----------
@@ -40,65 +258,258 @@ def create_table(conn, df):
         connection object
     df : dataframe
         Pandas dataframe to load the table
+    if_exists : str
+        "append" to insert only the df events that are not loaded yet, "replace_days" to reload the days of df with
+        its events, keeping the other days, or "replace" to reload the table with df
 
     Raises
     ------
     sqlite3.Error
         Error while creating the table.
+
+    Returns
+    -------
+    inserted : int
+        number of new events inserted
     """
     try:
+        tune_connection(conn)
         cur = conn.cursor()
 
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='events_log'")
+        # Single transaction for the whole load, rolled back if any insert fails
+        with conn:
+            cur.execute("BEGIN")
+            if if_exists == "replace":
+                cur.execute("DROP TABLE IF EXISTS events_log")
+                for metric in BREAKDOWNS:
+                    cur.execute("DROP TABLE IF EXISTS " + ROLLUP_TABLE.format(metric=metric))
+
+            cur.execute(EVENTS_LOG_SCHEMA)
+            create_rollup_tables(cur)
+
+            # The df events are staged first so that only the ones not loaded yet are inserted and added to the rollups
+            cur.execute(EVENTS_LOG_SCHEMA.replace("TABLE IF NOT EXISTS events_log", "TEMP TABLE events_log_staging"))
+            cur.executemany(
+                "INSERT OR IGNORE INTO events_log_staging ({columns}) VALUES ({placeholders})".format(
+                    columns=','.join(EVENTS_LOG_COLUMNS), placeholders=','.join('?' * len(EVENTS_LOG_COLUMNS))),
+                events_log_rows(df))
+            deleted = 0
+            if if_exists == "replace_days":
+                cur.execute("SELECT DISTINCT substr(timestamp, 1, 10) FROM events_log_staging "
+                            "WHERE timestamp IS NOT NULL")
+                for (day,) in cur.fetchall():
+                    deleted += delete_days(cur, day, next_day(day))
+
+            # Events already loaded are skipped through the raw_event uniqueness constraint
+            cur.execute("DELETE FROM events_log_staging WHERE raw_event IN (SELECT raw_event FROM main.events_log)")
+
+            cur.execute("INSERT INTO events_log ({columns}) SELECT {columns} FROM events_log_staging".format(
+                columns=','.join(EVENTS_LOG_COLUMNS)))
+            inserted = cur.rowcount
+            for metric in BREAKDOWNS:
+                cur.execute(ROLLUP_UPSERT.format(metric=metric, source="events_log_staging"))
+            cur.execute("DROP TABLE events_log_staging")
+
+            # Created after the rows on a new table, which is faster than updating them on every insert
+            for index in EVENTS_LOG_INDEXES:
+                cur.execute(index)
+
+            deleted += drop_expired_days(cur, config.RETENTION_DAYS)
+
+            if inserted or deleted or if_exists == "replace":
+                bump_data_version(cur)
+
+        conn.execute("PRAGMA optimize")
+        logging.info('{} new events loaded into events_log.'.format(inserted))
+        return inserted
+    except sqlite3.Error as e:
+        print({'error': str(e)})
+
+
+def create_rollup_tables(cur):
+    """Creates the hourly rollup table of every breakdown if it does not exist, filling it with the events already
+    loaded, e.g. by a version without rollups
+
+    Parameters
+    ----------
+    cur : object
+        cursor object
+    """
+    for metric in BREAKDOWNS:
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (ROLLUP_TABLE.format(metric=metric),))
         if cur.fetchone() is None:
-            # Creates table
-            cur.execute(
-                "CREATE TABLE IF NOT EXISTS events_log (raw_event TEXT NOT NULL UNIQUE,timestamps DATETIME,user_id TEXT,url TEXT,device TEXT,os TEXT,browser TEXT,country TEXT,city TEXT)")
+            cur.execute(ROLLUP_SCHEMA.format(metric=metric))
+            cur.execute(ROLLUP_UPSERT.format(metric=metric, source="events_log"))
+
+
+def next_day(day):
+    """Gets the day after a day
+
+    Parameters
+    ----------
+    day : str
+        'YYYY-MM-DD' day
+
+    Returns
+    -------
+    day : str
+        'YYYY-MM-DD' following day
+    """
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def delete_days(cur, first_day, end_day):
+    """Deletes the events of a range of days and their hourly rollup rows, only the rows of those days are touched
+
+    Parameters
+    ----------
+    cur : object
+        cursor object
+    first_day : str
+        'YYYY-MM-DD' first day deleted, or '' for every day before end_day
+    end_day : str
+        'YYYY-MM-DD' day following the last day deleted
+
+    Returns
+    -------
+    deleted : int
+        number of events deleted
+    """
+    cur.execute(DAYS_DELETES[0], (first_day, end_day))
+    deleted = cur.rowcount
+    for statement in DAYS_DELETES[1:]:
+        cur.execute(statement, (first_day, end_day))
+
+    return deleted
+
+
+def drop_expired_days(cur, retention_days):
+    """Deletes the events of the days older than the retention, counted back from the most recent day loaded
+
+    Parameters
+    ----------
+    cur : object
+        cursor object
+    retention_days : int
+        number of days kept or None to keep every day
+
+    Returns
+    -------
+    deleted : int
+        number of events deleted
+    """
+    if retention_days is None:
+        return 0
+
+    cur.execute("SELECT MAX(timestamp) FROM events_log")
+    last_timestamp = cur.fetchone()[0]
+    if last_timestamp is None:
+        return 0
+
+    first_day = datetime.strptime(last_timestamp[:10], '%Y-%m-%d') - timedelta(days=retention_days - 1)
+    deleted = delete_days(cur, '', first_day.strftime('%Y-%m-%d'))
+    if deleted:
+        logging.info('{} events older than {} days dropped.'.format(deleted, retention_days))
+
+    return deleted
+
+
+def bump_data_version(cur):
+    """Increments the version of the loaded data, stored as the database user_version, so cached query results built
+    from previous versions are invalidated
+
+    Parameters
+    ----------
+    cur : object
+        cursor object
+    """
+    cur.execute("PRAGMA user_version")
+    cur.execute("PRAGMA user_version = {}".format(cur.fetchone()[0] + 1))
+
+
+def get_data_version(conn):
+    """Gets the version of the loaded data
+
+    Parameters
+    ----------
+    conn : object
+        connection object or None
+
+    Raises
+    ------
+    sqlite3.Error
+        Error while reading the version.
 
-        df.to_sql("events_log", conn, if_exists="replace")
+    Returns
+    -------
+    data_version : int
+        version of the data or None if it can not be read
+    """
+    if conn is None:
+        return None
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
     except sqlite3.Error as e:
         print({'error': str(e)})
+        return None
+
+
+def events_log_rows(df):
+    """Lazily converts df into events_log rows, with timestamps formatted as SQLite datetime strings
+
+    Parameters
+    ----------
+    df : dataframe
+        Pandas dataframe to load the table
+
+    Returns
+    -------
+    rows : iterator
+        tuples with the values of EVENTS_LOG_COLUMNS
+    """
+    df = df[EVENTS_LOG_COLUMNS]
+    if pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df = df.assign(timestamp=df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+    return df.itertuples(index=False, name=None)
 
 
-def query_table(conn, breakdown, start_date=None, end_date=None):
+def query_table(conn, breakdown, start_date=None, end_date=None, limit=None, offset=0):
     """Queries events_log table and gets the breakdown by browser, os or device for a given timeframe or for all data without filtering
 
     Parameters
     ----------
     breakdown : str
-        browser, os or device to get the breakdown by
+        one of BREAKDOWNS, e.g. browser, os or device, to get the breakdown by
     start_date : datetime
         start date of the given timeframe or None - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
     end_date : datetime
         start date of the given timeframe or None - use ISO 8601 format, e.g. 2014-10-12T17:01:01Z.
+    limit : int
+        maximum number of breakdown values or None for all of them
+    offset : int
+        number of breakdown values skipped, e.g. by the previous pages
 
     Raises
     ------
     sqlite3.Error
         Error while connecting to the db.
+    ValueError
+        If the breakdown is not one of BREAKDOWNS.
 
     Returns
     -------
     query_result : str
         result of the query
     """
+    if conn is None:
+        raise InternalServerError('Connecting to data base failed.')
+
     try:
         cur = conn.cursor()
 
-        if start_date is not None and end_date is not None:
-            cur.execute(
-                "SELECT {metric}, ROUND({metric}_count/(SELECT CAST(COUNT(*) AS float) FROM events_log WHERE timestamp > '{start_date}' AND timestamp < '{end_date}') * 100.0, 2) || '%' AS percentage "
-                "FROM (SELECT {metric}, COUNT(*) AS {metric}_count FROM events_log WHERE timestamp > '{start_date}' AND timestamp < '{end_date}' GROUP BY {metric} ORDER BY {metric}_count DESC)".format(
-                    metric=breakdown, start_date=start_date, end_date=end_date))
-            query_result = cur.fetchall()
-            conn.close()
-
-        else:
-            cur.execute(
-                "SELECT {metric}, ROUND({metric}_count/(SELECT CAST(COUNT(*) AS float) FROM events_log) * 100.0, 2) || '%' AS percentage FROM (SELECT {metric}, COUNT(*) AS {metric}_count FROM events_log GROUP BY {metric} ORDER BY {metric}_count DESC)".format(
-                    metric=breakdown))
-            query_result = cur.fetchall()
-            conn.close()
+        cur.execute(*breakdown_statement(breakdown, start_date, end_date, limit, offset))
+        query_result = cur.fetchall()
 
         if not query_result:
             return None
@@ -108,19 +519,276 @@ def query_table(conn, breakdown, start_date=None, end_date=None):
     except sqlite3.Error as e:
         print({'error': str(e)})
         raise InternalServerError('Querying data base failed.')
+    finally:
+        conn.close()
+
 
+def iter_query_table(conn, breakdown, start_date=None, end_date=None, limit=None, offset=0,
+                     batch_rows=config.STREAM_BATCH_ROWS):
+    """Queries the breakdown like query_table but yields the rows in batches as they are fetched from the cursor,
+    so that large breakdowns can be streamed without holding them whole in memory. The connection is closed once the
+    rows are exhausted or the generator is closed
 
-def main(df):
+    Parameters
+    ----------
+    conn : object
+        connection object
+    breakdown : str
+        one of BREAKDOWNS
+    start_date : str
+        start date of the given timeframe or None
+    end_date : str
+        end date of the given timeframe or None
+    limit : int
+        maximum number of breakdown values or None for all of them
+    offset : int
+        number of breakdown values skipped, e.g. by the previous pages
+    batch_rows : int
+        number of rows fetched at a time
+
+    Raises
+    ------
+    InternalServerError
+        If the connection failed or the query failed.
+    ValueError
+        If the breakdown is not one of BREAKDOWNS.
+
+    Yields
+    ------
+    rows : list
+        batch of breakdown value and percentage rows
+    """
+    if conn is None:
+        raise InternalServerError('Connecting to data base failed.')
+
+    try:
+        cur = conn.cursor()
+        cur.execute(*breakdown_statement(breakdown, start_date, end_date, limit, offset))
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                return
+            yield rows
+
+    except sqlite3.Error as e:
+        print({'error': str(e)})
+        raise InternalServerError('Querying data base failed.')
+    finally:
+        conn.close()
+
+
+def breakdown_statement(breakdown, start_date=None, end_date=None, limit=None, offset=0):
+    """Picks the statement that counts the events of every breakdown value in a timeframe and binds the timeframe to
+    its parameters. Whole hours of the timeframe are read from the rollups and only the partial hours at its edges from
+    events_log
+
+    Parameters
+    ----------
+    breakdown : str
+        one of BREAKDOWNS
+    start_date : str
+        start date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    end_date : str
+        end date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    limit : int
+        maximum number of breakdown values or None for all of them
+    offset : int
+        number of breakdown values skipped
+
+    Raises
+    ------
+    ValueError
+        If the breakdown is not one of BREAKDOWNS.
+
+    Returns
+    -------
+    statement : tuple
+        sql statement and its parameters
+    """
+    if breakdown not in BREAKDOWN_STATEMENTS:
+        raise ValueError('Unknown breakdown {}, must be one of {}'.format(breakdown, BREAKDOWNS))
+
+    # A negative limit means no limit to SQLite
+    page = (-1 if limit is None else limit, offset)
+    statements = BREAKDOWN_STATEMENTS[breakdown]
+    if start_date is None or end_date is None:
+        return statements['all'], page
+
+    # An hour is fully inside the timeframe if it starts after start_date and ends before or at end_date
+    first_hour = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S') + timedelta(hours=1)
+    first_hour = first_hour.strftime(HOUR_FORMAT)
+    end_hour = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S').strftime(HOUR_FORMAT)
+    if first_hour >= end_hour:
+        return statements['edges'], (start_date, end_date) + page
+
+    return statements['hours'], (first_hour, end_hour, start_date, first_hour, end_hour, end_date) + page
+
+
+def format_percentage(events, total):
+    """Formats the percentage of the events out of the total exactly as BREAKDOWN_QUERY does. SQLite's ROUND rounds
+    half up the value written with PERCENTAGE_DIGITS significant digits, e.g. 1 of 32 events is 3.13%, while Python's
+    round rounds the binary value, 3.12%
+
+    Parameters
+    ----------
+    events : int
+        events of a value
+    total : int
+        events of every value
+
+    Returns
+    -------
+    percentage : str
+        percentage with up to two decimals followed by %, e.g. '33.33%'
+    """
+    percentage = Decimal('{:.{}g}'.format(events / float(total) * 100.0, PERCENTAGE_DIGITS))
+    return '{}%'.format(float(percentage.quantize(PERCENTAGE_QUANTUM, rounding=ROUND_HALF_UP)))
+
+
+def query_batch(conn, columns, bucket=None, start_date=None, end_date=None):
+    """Counts the events of every combination of values of several columns, and of time bucket if indicated, in a
+    single scan of events_log, from which any breakdown by those columns can be aggregated
+
+    Parameters
+    ----------
+    conn : object
+        connection object
+    columns : list
+        columns of STATS_DIMENSIONS to count the events by
+    bucket : str
+        one of TIME_BUCKETS or None
+    start_date : str
+        start date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    end_date : str
+        end date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+
+    Raises
+    ------
+    InternalServerError
+        If the connection failed or the query failed.
+    ValueError
+        If a column is not one of STATS_DIMENSIONS or the bucket not one of TIME_BUCKETS.
+
+    Returns
+    -------
+    counts : pandas dataframe
+        the bucket column, if indicated, the columns and the events column or None if no events found
+    """
+    if conn is None:
+        raise InternalServerError('Connecting to data base failed.')
+
+    try:
+        unknown = [column for column in columns if column not in STATS_DIMENSIONS]
+        if unknown or not columns:
+            raise ValueError('Unknown columns {}, must be some of {}'.format(unknown, STATS_DIMENSIONS))
+        if bucket is not None and bucket not in TIME_BUCKETS:
+            raise ValueError('Unknown bucket {}, must be one of {}'.format(bucket, list(TIME_BUCKETS)))
+
+        selected = ["IFNULL({column}, '') AS {column}".format(column=column) for column in columns]
+        if bucket is not None:
+            selected.insert(0, "{} AS bucket".format(TIME_BUCKETS[bucket]))
+        statement = "SELECT {}, COUNT(*) AS events FROM events_log".format(', '.join(selected))
+        params = ()
+        if start_date is not None and end_date is not None:
+            statement += " WHERE timestamp > ? AND timestamp < ?"
+            params = (start_date, end_date)
+        statement += " GROUP BY {}".format(', '.join(str(i + 1) for i in range(len(selected))))
+
+        cur = conn.cursor()
+        cur.execute(statement, params)
+        rows = cur.fetchall()
+        if not rows:
+            return None
+
+        return pd.DataFrame(rows, columns=[d[0] for d in cur.description])
+
+    except sqlite3.Error as e:
+        print({'error': str(e)})
+        raise InternalServerError('Querying data base failed.')
+    finally:
+        conn.close()
+
+
+def batch_breakdowns(counts, breakdowns, bucket=False):
+    """Aggregates the counts of query_batch into several breakdowns, each one the percentage of the events of every
+    combination of values of its columns, sorted by events
+
+    Parameters
+    ----------
+    counts : pandas dataframe
+        counts returned by query_batch
+    breakdowns : list
+        lists of columns, one per breakdown, e.g. [['browser'], ['os', 'browser']]
+    bucket : boolean
+        Boolean flag used to break down every time bucket of the counts separately
+
+    Returns
+    -------
+    breakdowns : dict
+        values and percentage lists of every breakdown, keyed by its comma separated columns, and by bucket if
+        indicated
+    """
+    result = dict()
+    for columns in breakdowns:
+        name = ','.join(columns)
+        if bucket:
+            result[name] = {key: percentages(bucket_counts, columns)
+                            for key, bucket_counts in counts.groupby('bucket', sort=True)}
+        else:
+            result[name] = percentages(counts, columns)
+
+    return result
+
+
+def percentages(counts, columns):
+    """Computes the percentage of the events of every combination of values of some columns
+
+    Parameters
+    ----------
+    counts : pandas dataframe
+        counts with the columns and an events column
+    columns : list
+        columns to break the events down by
+
+    Returns
+    -------
+    percentages : list
+        values followed by the percentage, e.g. ['iOS', 'Mobile Safari', '66.67%'], sorted by events and then by
+        values like BREAKDOWN_QUERY
+    """
+    # Grouping sorts the values, which the stable sort keeps among equal events
+    events = counts.groupby(columns, sort=True)['events'].sum().sort_values(ascending=False, kind='stable')
+    total = events.sum()
+    return [list(values if isinstance(values, tuple) else (values,)) + [format_percentage(count, total)]
+            for values, count in events.items()]
+
+
+def main(df, if_exists="append", db_file=None):
     """Calls create_table function if connection to database has been successful
 
+    Parameters
+    ----------
+    df : dataframe
+        Pandas dataframe to load the table
+    if_exists : str
+        "append" to insert only the df events that are not loaded yet, "replace_days" to reload the days of df with
+        its events or "replace" to reload the table with df
+    db_file : str
+        database file, config.DB_FILE by default
+
+    Returns
+    -------
+    inserted : int
+        number of new events inserted or None if the load failed
     """
     # creates a database connection
-    conn = create_database_connection(config.DB_FILE)
+    conn = create_database_connection(db_file or config.DB_FILE)
 
     # creates events_log table
     if conn is not None:
-        create_table(conn, df)
+        inserted = create_table(conn, df, if_exists)
         conn.close()
+        return inserted
     else:
         print("Error! cannot create the database connection.")
 
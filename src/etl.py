@@ -1,9 +1,15 @@
 import pandas as pd
-from pandarallel import pandarallel
-from src.transform_ip import parse_ip
-from src.transform_ua import parse_user_agent_string
-from src import extract_file, database_connection, app
+from src.transform_ip import parse_ip, count_values, count_countries_cities, get_geo_reader
+from src.transform_ua import parse_user_agent_string, count_users_browsers_os, get_ua_cache
+from src.sketches import SpaceSaving, DistinctCounts
+from src import extract_file, storage, checkpoint
+from src.pipeline import prefetch, Writer
+from docs import config
 import click
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+from collections import deque
 from datetime import datetime
 import logging
 
@@ -16,70 +22,398 @@ pd.options.mode.chained_assignment = None
 
 @click.command()
 @click.option('--stdout', '-s', is_flag=True, help='Print the Top 5 Countries, Cities, Browsers, OS’s to standard out')
-@click.option('--api', '-a', is_flag=True, help='Prepare the data to be consumed by the API')
-def main(stdout, api):
+@click.option('--top', '-n', type=click.IntRange(min=1), default=config.TOP_N, show_default=True,
+              help='Number of Countries, Cities, Browsers, OS’s printed by --stdout')
+@click.option('--api', '-a', is_flag=True,
+              help='Load the data consumed by the API, served separately by src/serve.py')
+@click.option('--chunksize', '-c', type=click.IntRange(min=1), default=None,
+              help='Stream the file in chunks of this many rows instead of loading it whole into memory')
+@click.option('--input', '-i', 'source', default=None,
+              help='Local file, directory or glob pattern to read the logs from, or - for stdin. '
+                   'Defaults to downloading the file from the Google drive')
+@click.option('--replace', '-r', is_flag=True,
+              help='Reload the API data from scratch instead of appending only the new events')
+@click.option('--replace-days', is_flag=True,
+              help='Reload only the days of the input events, e.g. to reprocess a day, keeping the other days')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=None,
+              help='Transform the chunks in this many worker processes. Streams the file in chunks of '
+                   '--chunksize rows, {} by default'.format(config.CHUNK_SIZE))
+def main(stdout, top, api, chunksize, source, replace, workers, replace_days):
     """Handles the control flow of the etl through cli arguments. Adds to the main dataframe the parsed fields:
     country, city, browser, os and device
     """
-    # Pandas parallelization initialization
-    pandarallel.initialize()
+    if replace and replace_days:
+        raise click.UsageError('--replace and --replace-days cannot be used together')
+
+    if not stdout and not api:
+        return
+
+    if workers is not None and chunksize is None:
+        chunksize = config.CHUNK_SIZE
+
+    if chunksize is not None:
+        run_chunks(chunksize, source, stdout, api, top, replace, workers, replace_days)
+        return
+
+    startTime = datetime.now()
+
+    # The file is extracted and enriched once, whatever the number of outputs it feeds
+    df = get_enriched_file(source)
+    if df is None:
+        return
+    logging.info('File extracted and enriched.')
 
     if stdout:
-        startTime = datetime.now()
+        print_top_lists(top, *top_lists(df, top))
 
-        df = extract_file.get_file()
-        if df is not None:
-            logging.info('File extracted and loaded into a dataframe.')
+    if api:
+        logging.info('Preparing the data to be consumed by the API ...')
 
-            parsed_ua_df, top_browsers_sorted_lst, top_os_sorted_lst = parse_user_agent_string(df)
-            logging.info('Top 5 browsers and OS calculated.')
+        print('Total number of lines in the file: ', df.shape[0])
+        df.drop_duplicates(subset='raw_event', keep='last', inplace=True)
+        print('Total number of lines in the file after removing duplicates: ', df.shape[0])
 
-            df.drop(['user_agent_string'], axis=1, inplace=True)
-            df[['device', 'os', 'browser']] = parsed_ua_df[['device', 'os', 'browser']]
+        storage.main(df, 'replace' if replace else 'replace_days' if replace_days else 'append')
 
-            parsed_ip_df, top_countries_sorted_lst, top_cities_sorted_lst = parse_ip(df)
-            logging.info('Top 5 countries and cities calculated.')
+    print('\n', datetime.now() - startTime)
 
-            df.drop(['ip'], axis=1, inplace=True)
-            df[['country', 'city']] = parsed_ip_df[['country', 'city']]
 
-            click.echo('\nTop 5 browsers based on num of unique users:\n')
-            click.echo('\n'.join([i[0] for i in top_browsers_sorted_lst]))
-            click.echo('\nTop 5 OS based on num of unique users:\n')
-            click.echo('\n'.join([i[0] for i in top_os_sorted_lst]))
-            click.echo('\nTop 5 countries based on num of events:\n')
-            click.echo('\n'.join([i[1] for i in top_countries_sorted_lst]))
-            click.echo('\nTop 5 cities based on num of events:\n')
-            click.echo('\n'.join([i[1] for i in top_cities_sorted_lst]))
+def get_enriched_file(source=None):
+    """Extracts the whole file and adds to it the parsed fields: country, city, browser, os and device. The enriched
+    dataframe is checkpointed by content hash of the source, so later runs over the same content, whether --stdout or
+    --api, read the checkpoint instead of parsing the file again. A downloaded file is still downloaded to be hashed.
 
-            print('\n', datetime.now() - startTime)
-    if api:
-        startTime = datetime.now()
+    Parameters
+    ----------
+    source : str
+        local source of the file or None to download it from the Google drive
 
-        logging.info('Preparing the data to be consumed by the API ...')
+    Returns
+    -------
+    df : pandas dataframe
+        enriched dataframe or None if the file could not be extracted
+    """
+    content = None
+    if source is None and checkpoint.is_enabled():
+        content = extract_file.download_content()
+        if content is None:
+            return None
+
+    digest = checkpoint.source_digest(source, content) if checkpoint.is_enabled() else None
+    df = checkpoint.load_checkpoint(digest)
+    if df is not None:
+        return df
+
+    df = extract_file.get_file(source) if content is None else extract_file.get_file(source, content)
+    if df is None:
+        return None
+
+    df = transform_chunk(df)
+    checkpoint.save_checkpoint(df, digest)
+
+    return df
+
+
+def top_lists(df, n=config.TOP_N):
+    """Calculates the Top n Countries, Cities, Browsers, OS’s of an enriched dataframe. Browsers and OS's are ranked
+    by number of unique users, counted with the same distinct counters as the chunked top lists
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        enriched dataframe
+    n : int
+        number of elements of the top lists
+
+    Returns
+    -------
+    top_lists : tuple
+        top browsers, OS's, countries and cities lists
+    """
+    top_browsers_sorted_lst, top_os_sorted_lst = count_users_browsers_os(df, n)
+    logging.info('Top {} browsers and OS calculated.'.format(n))
+
+    top_countries_sorted_lst, top_cities_sorted_lst = count_countries_cities(df, n)
+    logging.info('Top {} countries and cities calculated.'.format(n))
+
+    return top_browsers_sorted_lst, top_os_sorted_lst, top_countries_sorted_lst, top_cities_sorted_lst
+
+
+def transform_chunk(df):
+    """Adds to a chunk of the main dataframe the parsed fields: country, city, browser, os and device
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        chunk of the extracted file
+
+    Returns
+    -------
+    df : pandas dataframe
+        chunk with the parsed fields instead of the user_agent_string and ip columns
+    """
+    parsed_ua_df = parse_user_agent_string(df, True)
+    df.drop(['user_agent_string'], axis=1, inplace=True)
+    df[['device', 'os', 'browser']] = parsed_ua_df[['device', 'os', 'browser']]
+
+    parsed_ip_df = parse_ip(df, True)
+    df.drop(['ip'], axis=1, inplace=True)
+    df[['country', 'city']] = parsed_ip_df[['country', 'city']]
+
+    return df
+
+
+def print_top_lists(n, top_browsers_sorted_lst, top_os_sorted_lst, top_countries_sorted_lst, top_cities_sorted_lst):
+    """Prints the Top n Countries, Cities, Browsers, OS’s to standard out
+
+    Parameters
+    ----------
+    n : int
+        number of elements of the top lists
+    top_browsers_sorted_lst : list
+        [browser, users] lists
+    top_os_sorted_lst : list
+        [os, users] lists
+    top_countries_sorted_lst : list
+        (events, country) tuples
+    top_cities_sorted_lst : list
+        (events, city) tuples
+    """
+    click.echo('\nTop {} browsers based on num of unique users:\n'.format(n))
+    click.echo('\n'.join([i[0] for i in top_browsers_sorted_lst]))
+    click.echo('\nTop {} OS based on num of unique users:\n'.format(n))
+    click.echo('\n'.join([i[0] for i in top_os_sorted_lst]))
+    click.echo('\nTop {} countries based on num of events:\n'.format(n))
+    click.echo('\n'.join([i[1] for i in top_countries_sorted_lst]))
+    click.echo('\nTop {} cities based on num of events:\n'.format(n))
+    click.echo('\n'.join([i[1] for i in top_cities_sorted_lst]))
+
+
+class TopListsSummary:
+    """Bounded summary of the chunks transformed so far, from which the Top n Countries, Cities, Browsers, OS’s are
+    printed. Countries and cities are counted with Space-Saving summaries, and the unique users of every browser and
+    OS with the distinct counters set in config.DISTINCT_COUNT_MODE. Summaries of different workers can be merged
+    """
 
-        df = extract_file.get_file()
-        if df is not None:
-            logging.info('File extracted.')
+    def __init__(self):
+        self.lines = 0
+        self.countries = SpaceSaving(config.HEAVY_HITTERS_CAPACITY)
+        self.cities = SpaceSaving(config.HEAVY_HITTERS_CAPACITY)
+        self.browsers = DistinctCounts(config.DISTINCT_COUNT_MODE, config.HLL_PRECISION)
+        self.oses = DistinctCounts(config.DISTINCT_COUNT_MODE, config.HLL_PRECISION)
 
-            parsed_ua_df = parse_user_agent_string(df, True)
-            df.drop(['user_agent_string'], axis=1, inplace=True)
-            df[['device', 'os', 'browser']] = parsed_ua_df[['device', 'os', 'browser']]
+    def update(self, df):
+        """Adds a transformed chunk
 
-            parsed_ip_df = parse_ip(df, True)
+        Parameters
+        ----------
+        df : pandas dataframe
+            chunk with the parsed fields
+        """
+        self.lines += df.shape[0]
+        self.countries.update(count_values(df, 'country'))
+        self.cities.update(count_values(df, 'city'))
+        self.browsers.update(df['browser'], df['user_id'])
+        self.oses.update(df['os'], df['user_id'])
 
-            df.drop(['ip'], axis=1, inplace=True)
-            df[['country', 'city']] = parsed_ip_df[['country', 'city']]
+    def merge(self, other):
+        """Adds the chunks summarized by another summary
 
-            print('Total number of lines in the file: ', df.shape[0])
-            df.drop_duplicates(keep='last', inplace=True)
-            print('Total number of lines in the file after removing duplicates: ', df.shape[0])
+        Parameters
+        ----------
+        other : TopListsSummary
+            summary to merge into this one
+        """
+        self.lines += other.lines
+        self.countries.merge(other.countries)
+        self.cities.merge(other.cities)
+        self.browsers.merge(other.browsers)
+        self.oses.merge(other.oses)
 
-            database_connection.main(df)
 
-            print('\n', datetime.now() - startTime)
+def run_chunks(chunksize, source=None, stdout=True, api=False, n=config.TOP_N, replace=False, workers=None,
+               replace_days=False):
+    """Streams the file chunk by chunk and feeds every transformed chunk to the requested outputs: the Top n
+    Countries, Cities, Browsers, OS’s printed to standard out and the database consumed by the API. Every chunk is
+    extracted and transformed once, whatever the number of outputs.
 
-            app.create_app().run()
+    Extracting, transforming and loading run as overlapping stages connected by bounded queues: the next chunks are
+    read in a background thread and the transformed ones are loaded, in order, by a single writer thread, so the run
+    takes about as long as its slowest stage. The top lists are folded into a bounded summary chunk by chunk, so the
+    memory does not grow with the size of the file. With workers, the chunks are transformed, and summarized, in
+    worker processes.
+
+    Parameters
+    ----------
+    chunksize : int
+        number of rows per chunk
+    source : str
+        local source of the file or None to download it from the Google drive
+    stdout : boolean
+        Boolean flag used to print the top lists to standard out
+    api : boolean
+        Boolean flag used to load the chunks into the database
+    n : int
+        number of elements of the top lists
+    replace : boolean
+        Boolean flag used to reload the table from scratch instead of appending only the new events
+    workers : int
+        number of worker processes or None to transform the chunks in this process
+    replace_days : boolean
+        Boolean flag used to reload only the days of the events, keeping the other days
+    """
+    startTime = datetime.now()
+
+    if workers is None:
+        chunks = prefetch(extract_file.get_file_chunks(chunksize, source), config.PIPELINE_QUEUE_SIZE)
+        results = (process_chunk(transform_chunk(df), stdout, api) for df in chunks)
+    else:
+        raw_chunks = prefetch(extract_file.get_raw_file_chunks(chunksize, source), config.PIPELINE_QUEUE_SIZE)
+        results = map_chunks(partial(process_raw_chunk, summarize=stdout, keep=api), raw_chunks, workers)
+
+    summary = TopListsSummary()
+    total_lines = 0
+    replaced_days = set()
+
+    def load(df):
+        nonlocal total_lines
+        df.drop_duplicates(subset='raw_event', keep='last', inplace=True)
+        if replace_days:
+            # A day spread over several chunks is replaced by its first chunk and appended to by the following ones
+            days = storage.event_days(df)
+            new_days = ~days.isin(replaced_days)
+            for if_exists, events in [('replace_days', df[new_days]), ('append', df[~new_days])]:
+                if not events.empty:
+                    storage.main(events, if_exists)
+            replaced_days.update(days[new_days].dropna())
+        else:
+            # When replacing, only the first chunk replaces the previous table and the following ones are appended
+            storage.main(df, 'replace' if replace and total_lines == 0 else 'append')
+        total_lines += df.shape[0]
+        logging.info('{} lines loaded.'.format(total_lines))
+
+    with Writer(load, config.PIPELINE_QUEUE_SIZE) as writer:
+        for chunk_summary, df in results:
+            if stdout:
+                summary.merge(chunk_summary)
+                logging.info('Chunk of {} lines transformed.'.format(chunk_summary.lines))
+            if api:
+                writer.put(df)
+
+    if stdout and summary.lines > 0:
+        print_top_lists(n, summary.browsers.top(n), summary.oses.top(n), summary.countries.top(n),
+                        summary.cities.top(n))
+
+    if summary.lines == 0 and total_lines == 0:
+        return
+
+    print('\n', datetime.now() - startTime)
+
+
+def init_worker(ua_cache_file=None):
+    """Opens the user agent cache and the geolite2 database reader once per worker process
+
+    Parameters
+    ----------
+    ua_cache_file : str
+        file the user agent cache is persisted to, the parent's one since spawned workers import config anew
+    """
+    if ua_cache_file is not None:
+        config.UA_CACHE_FILE = ua_cache_file
+    get_ua_cache()
+    get_geo_reader()
+
+
+def transform_raw_chunk(df):
+    """Prepares the events of a raw chunk and adds them the parsed fields, see transform_chunk
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        raw chunk of the extracted file
+
+    Returns
+    -------
+    df : pandas dataframe
+        chunk with the parsed fields, whose low cardinality columns are categories cheap to send between processes
+    """
+    return transform_chunk(extract_file.prepare_events(df))
+
+
+def process_raw_chunk(df, summarize=True, keep=False):
+    """Transforms a raw chunk and prepares it for the requested outputs, see process_chunk
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        raw chunk of the extracted file
+    summarize : boolean
+        Boolean flag used to summarize the chunk for the top lists
+    keep : boolean
+        Boolean flag used to return the transformed chunk, e.g. to load it into the database
+
+    Returns
+    -------
+    result : tuple
+        summary of the chunk or None and transformed chunk or None
+    """
+    return process_chunk(transform_raw_chunk(df), summarize, keep)
+
+
+def process_chunk(df, summarize=True, keep=False):
+    """Prepares a transformed chunk for the requested outputs. Only what the outputs need is returned, so that worker
+    processes send back a compact summary when the chunk itself is not needed
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        chunk with the parsed fields
+    summarize : boolean
+        Boolean flag used to summarize the chunk for the top lists
+    keep : boolean
+        Boolean flag used to return the transformed chunk, e.g. to load it into the database
+
+    Returns
+    -------
+    result : tuple
+        summary of the chunk or None and transformed chunk or None
+    """
+    summary = None
+    if summarize:
+        summary = TopListsSummary()
+        summary.update(df)
+
+    return summary, df if keep else None
+
+
+def map_chunks(func, chunks, workers):
+    """Applies func to every chunk in a pool of worker processes and yields the results in the order of the chunks.
+    At most two chunks per worker are in flight, so the chunks are not read faster than they are processed.
+
+    Parameters
+    ----------
+    func : function
+        module level function applied to every chunk
+    chunks : iterator
+        chunks to process
+    workers : int
+        number of worker processes
+
+    Yields
+    ------
+    result : object
+        result of func for every chunk
+    """
+    # Workers are spawned rather than forked, since the pipeline threads might hold locks when forking
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(config.UA_CACHE_FILE,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 if __name__ == '__main__':
@@ -1,13 +1,52 @@
 import pandas as pd
 import requests
 from io import BytesIO
+from contextlib import contextmanager
 import gzip
+import glob
+import mmap
+import os
+import sys
 import logging
 from docs import config
 
+COLUMNS = ['date', 'time', 'user_id', 'url', 'ip', 'user_agent_string']
+try:
+    import pyarrow  # noqa: F401
+    # Arrow strings are stored in contiguous buffers instead of one Python object per row
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:
+    STRING_DTYPE = str
+# High cardinality columns as compact strings and low cardinality ones as categories, i.e. integer codes. Date and
+# time stay str since they are concatenated into the timestamp
+COLUMN_DTYPES = {'date': str, 'time': str, 'user_id': STRING_DTYPE, 'url': STRING_DTYPE, 'ip': 'category',
+                 'user_agent_string': 'category'}
+GZIP_MAGIC = b'\x1f\x8b'
+STDIN_SOURCE = '-'
 
-def get_file():
-    """Grabs the file from the Google drive and loads it into a pandas dataframe. Parses date and time column into timestamp column
+
+def get_download_url():
+    """Builds the direct download url of the file shared in the Google drive
+
+    Returns
+    -------
+    dwn_url : str
+        direct download url
+    """
+    file_id = config.ORIG_URL.split('/')[-2]
+    return 'https://drive.google.com/uc?export=download&id=' + file_id
+
+
+def get_file(source=None, content=None):
+    """Grabs the file from the Google drive, or from a local source if indicated, and loads it into a pandas dataframe.
+    Parses date and time column into timestamp column
+
+    Parameters
+    ----------
+    source : str
+        local file, directory or glob pattern, or - for stdin. None to download the file from the Google drive
+    content : bytes
+        content of the file already downloaded from the Google drive, read instead of downloading it again
 
     Returns
     -------
@@ -15,30 +54,374 @@ def get_file():
         dataframe that contains all file rows without duplicates
     """
     logging.info('Extracting file ...')
-    file_id = config.ORIG_URL.split('/')[-2]
-    dwn_url = 'https://drive.google.com/uc?export=download&id=' + file_id
+    if source is None and content is not None:
+        df = open_gzip_read_tsv(BytesIO(content))
+    elif source is None:
+        df = download_file()
+    else:
+        df = read_local_files(source)
 
-    response = requests.get(dwn_url)
-    if response.status_code != 200:
-        logging.error('Error downloading file: {} {}'.format(response.status_code, response.content))
+    if df is None:
         return None
     else:
-        df = open_gzip_read_tsv(BytesIO(response.content))
-
         logging.info('Total number of lines in the file: {}'.format(df.shape[0]))
-        df.drop_duplicates(keep='last', inplace=True)
+        df = prepare_events(df)
         logging.info('Total number of lines in the file after removing duplicates: {}'.format(df.shape[0]))
-        # Added for events_log table PK
-        df['raw_event'] = df[['date', 'time', 'user_id', 'url', 'ip', 'user_agent_string']].apply(lambda x: ''.join(x),
-                                                                                                  axis=1)
-        df['date'] = df['date'] + ' ' + df['time']
-        df.rename(columns={'date': 'timestamp'}, inplace=True)
-        df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S')
-        df.drop(['time'], axis=1, inplace=True)
 
         return df
 
 
+def get_file_chunks(chunksize=config.CHUNK_SIZE, source=None):
+    """Streams the file from the Google drive, or from a local source if indicated, decompressing it on the fly, and
+    yields it as pandas dataframes of at most chunksize rows. Only one chunk is held in memory at a time, whatever the
+    size of the file.
+
+    Parameters
+    ----------
+    chunksize : int
+        number of rows per yielded dataframe
+    source : str
+        local file, directory or glob pattern, or - for stdin. None to download the file from the Google drive
+
+    Yields
+    ------
+    df : pandas dataframe
+        dataframe that contains the chunk rows without duplicates
+    """
+    for df in get_raw_file_chunks(chunksize, source):
+        yield prepare_events(df)
+
+
+def get_raw_file_chunks(chunksize=config.CHUNK_SIZE, source=None):
+    """Streams the file like get_file_chunks but yields the chunks as they are read, leaving the event keys and
+    timestamps to be prepared by whoever transforms them, e.g. a worker process
+
+    Parameters
+    ----------
+    chunksize : int
+        number of rows per yielded dataframe
+    source : str
+        local file, directory or glob pattern, or - for stdin. None to download the file from the Google drive
+
+    Yields
+    ------
+    df : pandas dataframe
+        dataframe that contains the raw chunk rows
+    """
+    logging.info('Extracting file in chunks of {} rows ...'.format(chunksize))
+    if source is None:
+        yield from download_file_chunks(chunksize)
+    else:
+        yield from read_local_file_chunks(source, chunksize)
+
+
+def download_file():
+    """Downloads the file from the Google drive and loads it into a pandas dataframe
+
+    Returns
+    -------
+    df : pandas dataframe
+        dataframe with the content of the file or None if the download failed
+    """
+    content = download_content()
+    if content is None:
+        return None
+    else:
+        return open_gzip_read_tsv(BytesIO(content))
+
+
+def download_content():
+    """Downloads the compressed file from the Google drive
+
+    Returns
+    -------
+    content : bytes
+        content of the file or None if the download failed
+    """
+    response = requests.get(get_download_url())
+    if response.status_code != 200:
+        logging.error('Error downloading file: {} {}'.format(response.status_code, response.content))
+        return None
+    else:
+        return response.content
+
+
+def download_file_chunks(chunksize):
+    """Streams the file from the Google drive and yields it as pandas dataframes of at most chunksize rows
+
+    Parameters
+    ----------
+    chunksize : int
+        number of rows per yielded dataframe
+
+    Yields
+    ------
+    df : pandas dataframe
+        chunk of the file content
+    """
+    with requests.get(get_download_url(), stream=True) as response:
+        if response.status_code != 200:
+            logging.error('Error downloading file: {} {}'.format(response.status_code, response.content))
+            return
+
+        # Undo any transport encoding so the gzip reader gets the file bytes
+        response.raw.decode_content = True
+        for df in open_gzip_read_tsv_chunks(response.raw, chunksize):
+            yield df
+
+
+def read_local_files(source):
+    """Reads every file of a local source into a single pandas dataframe
+
+    Parameters
+    ----------
+    source : str
+        local file, directory or glob pattern, or - for stdin
+
+    Returns
+    -------
+    df : pandas dataframe
+        dataframe with the content of all files or None if no file was read
+    """
+    dfs = [df for df in (read_tsv(file_obj) for file_obj in open_source(source)) if df is not None]
+    if not dfs:
+        return None
+    else:
+        return concat_files(dfs)
+
+
+def concat_files(dfs):
+    """Concatenates the dataframes of several files. The categorical columns of every file are given the categories
+    of all files first, since columns with different categories are concatenated as object columns
+
+    Parameters
+    ----------
+    dfs : list
+        pandas dataframes of the files
+
+    Returns
+    -------
+    df : pandas dataframe
+        dataframe with the content of all files
+    """
+    for column in [column for column, dtype in COLUMN_DTYPES.items() if dtype == 'category']:
+        categories = dfs[0][column].cat.categories
+        for df in dfs[1:]:
+            categories = categories.union(df[column].cat.categories, sort=False)
+        for df in dfs:
+            df[column] = df[column].cat.set_categories(categories)
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def read_local_file_chunks(source, chunksize):
+    """Reads the files of a local source one after the other and yields them as pandas dataframes of at most chunksize
+    rows
+
+    Parameters
+    ----------
+    source : str
+        local file, directory or glob pattern, or - for stdin
+    chunksize : int
+        number of rows per yielded dataframe
+
+    Yields
+    ------
+    df : pandas dataframe
+        chunk of the files content
+    """
+    for file_obj in open_source(source):
+        for df in read_tsv_chunks(file_obj, chunksize):
+            yield df
+
+
+def list_source_paths(source):
+    """Expands a local source into the sorted list of files it refers to
+
+    Parameters
+    ----------
+    source : str
+        local file, directory or glob pattern
+
+    Returns
+    -------
+    paths : list
+        paths of the files of the source
+    """
+    if os.path.isfile(source):
+        return [source]
+    elif os.path.isdir(source):
+        source = os.path.join(source, '*')
+
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+
+
+def open_source(source):
+    """Opens one after the other the files of a local source. Every file is closed before the next one is opened
+
+    Parameters
+    ----------
+    source : str
+        local file, directory or glob pattern, or - for stdin
+
+    Yields
+    ------
+    file_obj : file-like object
+        binary stream with the content of the file
+    """
+    if source == STDIN_SOURCE:
+        yield sys.stdin.buffer
+        return
+
+    paths = list_source_paths(source)
+    if not paths:
+        logging.error('No input files found for: {}'.format(source))
+
+    for path in paths:
+        logging.info('Reading {} ...'.format(path))
+        with open_mmap(path) as file_obj:
+            yield file_obj
+
+
+@contextmanager
+def open_mmap(path):
+    """Opens a local file memory-mapped, so reads are served straight from the OS page cache, which is shared across
+    runs. Falls back to a regular file when the file can not be mapped, e.g. if it is empty
+
+    Parameters
+    ----------
+    path : str
+        path of the file
+
+    Yields
+    ------
+    file_obj : file-like object
+        read-only mmap of the file or the file itself
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            mapped_file = None
+
+        if mapped_file is None:
+            yield f
+        else:
+            with mapped_file:
+                yield mapped_file
+
+
+def is_gzip(file_obj):
+    """Checks the gzip magic number at the start of a binary stream without consuming it
+
+    Parameters
+    ----------
+    file_obj : file-like object
+        binary stream positioned at its start
+
+    Returns
+    -------
+    is_gzip : boolean
+        True if the stream is gzip compressed
+    """
+    if hasattr(file_obj, 'peek'):
+        magic = file_obj.peek(2)[:2]
+    else:
+        magic = file_obj.read(2)
+        file_obj.seek(0)
+
+    return magic == GZIP_MAGIC
+
+
+def read_tsv(file_obj):
+    """Reads a gzip or plain tsv binary stream into a pandas dataframe
+
+    Parameters
+    ----------
+    file_obj : file-like object
+        binary stream with the content of the file
+
+    Returns
+    -------
+    df : pandas dataframe
+        dataframe with the content of the tsv file
+    """
+    if is_gzip(file_obj):
+        return open_gzip_read_tsv(file_obj)
+
+    try:
+        return pd.read_csv(file_obj, sep='\t', names=COLUMNS, dtype=COLUMN_DTYPES)
+    except pd.errors.EmptyDataError:
+        logging.warning('Skipping empty file.')
+
+
+def read_tsv_chunks(file_obj, chunksize):
+    """Reads a gzip or plain tsv binary stream into pandas dataframes of at most chunksize rows
+
+    Parameters
+    ----------
+    file_obj : file-like object
+        binary stream with the content of the file
+    chunksize : int
+        number of rows per yielded dataframe
+
+    Yields
+    ------
+    df : pandas dataframe
+        chunk of the tsv file content
+    """
+    if is_gzip(file_obj):
+        for df in open_gzip_read_tsv_chunks(file_obj, chunksize):
+            yield df
+    else:
+        try:
+            for df in pd.read_csv(file_obj, sep='\t', names=COLUMNS, dtype=COLUMN_DTYPES, chunksize=chunksize):
+                yield df
+        except pd.errors.EmptyDataError:
+            logging.warning('Skipping empty file.')
+
+
+def prepare_events(df):
+    """Adds the raw_event key column, drops the duplicated events and parses date and time columns into timestamp column
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe with the columns of the tsv file
+
+    Returns
+    -------
+    df : pandas dataframe
+        dataframe without duplicates, with raw_event and timestamp columns instead of date and time columns
+    """
+    # Added for events_log table PK
+    df['raw_event'] = event_keys(df)
+    df.drop_duplicates(subset='raw_event', keep='last', inplace=True)
+    df['date'] = df['date'] + ' ' + df['time']
+    df.rename(columns={'date': 'timestamp'}, inplace=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S')
+    df.drop(['time'], axis=1, inplace=True)
+
+    return df
+
+
+def event_keys(df):
+    """Hashes, column-wise, the values of every event into a 64-bit key. Identical events get the same key, and the
+    odds of two different events colliding stay negligible below billions of events
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        dataframe with the columns of the tsv file
+
+    Returns
+    -------
+    keys : numpy array
+        signed 64-bit key of every event, so it can be stored as a SQLite INTEGER
+    """
+    return pd.util.hash_pandas_object(df[COLUMNS], index=False).values.view('int64')
+
+
 def open_gzip_read_tsv(bytes_io):
     """Opens gzip file and creates pandas dataframe
 
@@ -59,8 +442,37 @@ def open_gzip_read_tsv(bytes_io):
     """
     try:
         with gzip.open(bytes_io, 'rt') as read_file:
-            df = pd.read_csv(read_file, sep='\t', names=['date', 'time', 'user_id', 'url', 'ip', 'user_agent_string'],
-                             low_memory=False)
+            df = pd.read_csv(read_file, sep='\t', names=COLUMNS, dtype=COLUMN_DTYPES)
             return df
     except IOError as e:
         print("Error reading file: {}".format(e))
+
+
+def open_gzip_read_tsv_chunks(file_obj, chunksize):
+    """Opens gzip file object and lazily reads it into pandas dataframes of at most chunksize rows
+
+    Parameters
+    ----------
+    file_obj : file-like object
+        binary stream with the gzip content, e.g. the raw body of a streamed response
+    chunksize : int
+        number of rows per yielded dataframe
+
+    Raises
+    ------
+    IOError
+        Error while reading the file.
+
+    Yields
+    ------
+    df : pandas dataframe
+        chunk of the tsv file content
+    """
+    try:
+        with gzip.open(file_obj, 'rt') as read_file:
+            # Explicit dtypes so that all chunks share the same ones, except the categories of the ip and user agent
+            # columns, which are those found in every chunk
+            for df in pd.read_csv(read_file, sep='\t', names=COLUMNS, dtype=COLUMN_DTYPES, chunksize=chunksize):
+                yield df
+    except IOError as e:
+        print("Error reading file: {}".format(e))
@@ -0,0 +1,633 @@
+from docs import config
+from src.database_connection import BREAKDOWNS, EVENTS_LOG_COLUMNS, STATS_DIMENSIONS, TIME_BUCKETS, format_percentage
+from datetime import date, timedelta
+import pandas as pd
+import itertools
+import json
+import logging
+import os
+from werkzeug.exceptions import InternalServerError
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Version of the data and files of every partition of the store, replaced at once by every load so readers always
+# see a consistent set
+MANIFEST_FILE = '_manifest.json'
+# The events are partitioned by day, the day of the events without timestamp being NULL_PARTITION
+PART_FILE = 'day={day}/part-{version:08d}.parquet'
+NULL_PARTITION = 'none'
+# Timestamps are stored as 'YYYY-MM-DD HH:MM:SS' strings, like in SQLite, which sort and compare chronologically
+EVENTS_SCHEMA = None if pa is None else pa.schema(
+    [('raw_event', pa.int64())] + [(column, pa.string()) for column in EVENTS_LOG_COLUMNS[1:]])
+# The day is not stored in the files, it is the partition of every file, which the day filters prune by
+DATASET_SCHEMA = None if pa is None else EVENTS_SCHEMA.append(pa.field('day', pa.string()))
+# Rows per row group of the files, whose timestamp statistics let the filters skip the row groups outside a timeframe
+ROW_GROUP_SIZE = 1 << 16
+# Characters of the timestamp kept by every time bucket, completed by the suffix
+BUCKET_PREFIXES = {'hour': (13, ':00:00'), 'day': (10, '')}
+
+
+class Snapshot:
+    """Files of the store at a data version, the Parquet counterpart of a connection. Files are never modified once
+    written, so the queries of a snapshot stay consistent while the etl loads new data
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    data_version : int
+        version of the data
+    partitions : dict
+        Parquet files of every day of the version
+    """
+
+    def __init__(self, directory, data_version, partitions):
+        self.directory = directory
+        self.data_version = data_version
+        self.partitions = partitions
+        self.dataset = partitions_dataset(directory, partitions)
+
+    @property
+    def files(self):
+        return [file for files in self.partitions.values() for file in files]
+
+    def close(self):
+        # Nothing to release, snapshots are shared by the queries of the same version
+        pass
+
+
+class SnapshotPool:
+    """Hands out the snapshot of the current data version, reusing it while the version does not change so that the
+    Parquet file footers are read once per version instead of once per query
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    size : int
+        kept for parity with ConnectionPool, a single snapshot is shared by every query
+    """
+
+    def __init__(self, directory, size=config.DB_POOL_SIZE):
+        self.directory = directory
+        self.size = size
+        self._snapshot = None
+
+    def connect(self):
+        """Gets the snapshot of the current data version
+
+        Returns
+        -------
+        snapshot : Snapshot
+            snapshot or None if the store can not be read
+        """
+        manifest = read_manifest(self.directory)
+        if manifest is None or pa is None:
+            return None
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.data_version != manifest['version']:
+            try:
+                snapshot = Snapshot(self.directory, manifest['version'], manifest['partitions'])
+            except (OSError, pa.ArrowException) as e:
+                print({'error': str(e)})
+                return None
+            self._snapshot = snapshot
+
+        return snapshot
+
+    def warm(self, count=None):
+        """Reads the snapshot of the current data version ahead of the first queries
+
+        Parameters
+        ----------
+        count : int
+            ignored, a single snapshot is shared by every query
+
+        Returns
+        -------
+        opened : int
+            1 if the snapshot was read, 0 if the store can not be read
+        """
+        return int(self.connect() is not None)
+
+    def close(self):
+        """Forgets the snapshot
+        """
+        self._snapshot = None
+
+
+def read_manifest(directory):
+    """Reads the version and the files of the store
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+
+    Returns
+    -------
+    manifest : dict
+        version, files of every partition and files no longer used, or None if nothing has been loaded yet
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as file_obj:
+            return json.load(file_obj)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(directory, manifest):
+    """Replaces the manifest of the store at once, so readers never see it half written
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    manifest : dict
+        version, files of every partition and files no longer used
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as file_obj:
+        json.dump(manifest, file_obj)
+    os.replace(tmp_path, path)
+
+
+def events_table(df):
+    """Converts the enriched events into an Arrow table of the store schema, sorted by timestamp so that the row group
+    statistics let the timeframe filters skip whole row groups
+
+    Parameters
+    ----------
+    df : dataframe
+        enriched events
+
+    Returns
+    -------
+    table : pyarrow Table
+        events with the columns of EVENTS_SCHEMA
+    """
+    df = df[EVENTS_LOG_COLUMNS].drop_duplicates(subset='raw_event', keep='first')
+    if pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df = df.assign(timestamp=df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+    table = pa.Table.from_pandas(df, schema=EVENTS_SCHEMA, preserve_index=False)
+    return table.sort_by([('timestamp', 'ascending')])
+
+
+def partitions_dataset(directory, partitions):
+    """Builds the dataset of the files of some partitions, every file tagged with its day so that the filters on the
+    day skip the files of the other days without opening them
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    partitions : dict
+        Parquet files of every day
+
+    Returns
+    -------
+    dataset : pyarrow Dataset
+        dataset with the columns of DATASET_SCHEMA
+    """
+    paths, expressions = list(), list()
+    for day, files in partitions.items():
+        expression = ds.field('day').is_null() if day == NULL_PARTITION else ds.field('day') == day
+        paths.extend(os.path.join(directory, file) for file in files)
+        expressions.extend([expression] * len(files))
+
+    return ds.FileSystemDataset.from_paths(paths, schema=DATASET_SCHEMA, format=ds.ParquetFileFormat(),
+                                           filesystem=pa.fs.LocalFileSystem(), partitions=expressions)
+
+
+def partition_days(timestamps):
+    """Gets the partition of every event
+
+    Parameters
+    ----------
+    timestamps : pyarrow Array
+        'YYYY-MM-DD HH:MM:SS' timestamps
+
+    Returns
+    -------
+    days : pyarrow Array
+        'YYYY-MM-DD' day or NULL_PARTITION of every event
+    """
+    return pc.fill_null(pc.utf8_slice_codeunits(timestamps, 0, 10), NULL_PARTITION)
+
+
+def expired_days(partitions, retention_days):
+    """Picks the days older than the retention, counted back from the most recent day of the store
+
+    Parameters
+    ----------
+    partitions : dict
+        Parquet files of every day
+    retention_days : int
+        number of days kept or None to keep every day
+
+    Returns
+    -------
+    days : list
+        days to drop
+    """
+    days = [day for day in partitions if day != NULL_PARTITION]
+    if retention_days is None or not days:
+        return []
+
+    first_day = (date.fromisoformat(max(days)) - timedelta(days=retention_days - 1)).isoformat()
+    return sorted(day for day in days if day < first_day)
+
+
+def overlapping_files(directory, files, first, last):
+    """Picks the files that might hold events between two timestamps, by the timestamp statistics of their row groups
+    read from the file footers
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    files : list
+        Parquet files of a partition
+    first : str
+        first timestamp
+    last : str
+        last timestamp
+
+    Returns
+    -------
+    files : list
+        files with row groups between first and last
+    """
+    overlapping = list()
+    for file in files:
+        metadata = pq.read_metadata(os.path.join(directory, file))
+        column = metadata.schema.names.index('timestamp')
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(column).statistics
+            if statistics is None or not statistics.has_min_max or (
+                    statistics.min <= last and statistics.max >= first):
+                overlapping.append(file)
+                break
+
+    return overlapping
+
+
+def compacted_files(directory, files, new_rows):
+    """Picks the newest files of a partition merged with its new events once it has config.PARTITION_MAX_FILES files.
+    Files are merged from the newest back while they are not larger than the rows merged so far, and at least until
+    the partition is left with no more than the maximum, so the events are rewritten a logarithmic number of times
+    instead of the whole day at every compaction
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    files : list
+        Parquet files of the partition, from the oldest
+    new_rows : int
+        number of new events of the partition
+
+    Returns
+    -------
+    files : list
+        newest files to merge
+    """
+    if len(files) < config.PARTITION_MAX_FILES:
+        return []
+
+    merged_rows = new_rows
+    count = 0
+    for file in reversed(files):
+        rows = pq.read_metadata(os.path.join(directory, file)).num_rows
+        if rows > merged_rows and len(files) - count < config.PARTITION_MAX_FILES:
+            break
+        merged_rows += rows
+        count += 1
+
+    return files[len(files) - count:]
+
+
+def load_events(directory, df, if_exists='append'):
+    """Writes the new events of df into the day partitions of the store, straight from the dataframe columns. Only
+    the partitions of the days of df are written, the events loaded are looked up in the files overlapping the
+    timeframe of df only, the newest files of a partition are compacted once it has config.PARTITION_MAX_FILES files,
+    and the days older than config.RETENTION_DAYS are dropped
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    df : dataframe
+        enriched events
+    if_exists : str
+        "append" to add only the df events that are not loaded yet, "replace_days" to reload the days of df with its
+        events, keeping the other days, or "replace" to reload the store with df
+
+    Returns
+    -------
+    inserted : int
+        number of new events loaded or None if the load failed
+    """
+    if pa is None:
+        print("Error! pyarrow is required by the parquet storage backend.")
+        return None
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        manifest = read_manifest(directory) or {'version': 0, 'partitions': {}, 'obsolete': []}
+        version = manifest['version'] + 1
+        partitions = dict(manifest['partitions']) if if_exists != 'replace' else {}
+
+        table = events_table(df)
+        days = partition_days(table['timestamp'])
+        inserted = 0
+        for day in sorted(pc.unique(days).to_pylist()):
+            day_table = table.filter(pc.equal(days, day))
+            new_rows = day_table.num_rows
+            files = partitions.get(day, [])
+            if if_exists == 'replace_days' and day != NULL_PARTITION:
+                files = []
+            elif files:
+                # Events already loaded are skipped by their raw_event key, looked up in their own day only and, since
+                # duplicated events share their timestamp, in the row groups of the timeframe of the new events only
+                lookup_files, lookup_filter = files, None
+                if day != NULL_PARTITION:
+                    timeframe = pc.min_max(day_table['timestamp'])
+                    first, last = timeframe['min'].as_py(), timeframe['max'].as_py()
+                    lookup_files = overlapping_files(directory, files, first, last)
+                    lookup_filter = (ds.field('timestamp') >= first) & (ds.field('timestamp') <= last)
+                if lookup_files:
+                    loaded = partitions_dataset(directory, {day: lookup_files}).to_table(columns=['raw_event'],
+                                                                                        filter=lookup_filter)
+                    day_table = day_table.filter(pc.invert(pc.is_in(day_table['raw_event'],
+                                                                    value_set=loaded['raw_event'])))
+                new_rows = day_table.num_rows
+                if not new_rows:
+                    continue
+            merged_files = compacted_files(directory, files, new_rows)
+            if merged_files:
+                day_table = pa.concat_tables([partitions_dataset(directory, {day: merged_files}).to_table(
+                    columns=EVENTS_SCHEMA.names), day_table]).sort_by([('timestamp', 'ascending')])
+                files = files[:len(files) - len(merged_files)]
+
+            file = PART_FILE.format(day=day, version=version)
+            os.makedirs(os.path.dirname(os.path.join(directory, file)), exist_ok=True)
+            pq.write_table(day_table, os.path.join(directory, file), row_group_size=ROW_GROUP_SIZE)
+            partitions[day] = files + [file]
+            inserted += new_rows
+
+        for day in expired_days(partitions, config.RETENTION_DAYS):
+            del partitions[day]
+
+        previous_files = {file for files in manifest['partitions'].values() for file in files}
+        obsolete = sorted(previous_files - {file for files in partitions.values() for file in files})
+        if not obsolete and not inserted and if_exists == 'append':
+            logging.info('0 new events loaded into {}.'.format(directory))
+            return 0
+
+        write_manifest(directory, {'version': version, 'partitions': partitions, 'obsolete': obsolete})
+        # The files left over by the previous load are removed only now, so that queries still running on its
+        # snapshot could finish
+        remove_files(directory, manifest['obsolete'])
+    except (OSError, pa.ArrowException) as e:
+        print({'error': str(e)})
+        return None
+
+    logging.info('{} new events loaded into {}.'.format(inserted, directory))
+    return inserted
+
+
+def remove_files(directory, files):
+    """Removes files of the store, and their partition directories once empty
+
+    Parameters
+    ----------
+    directory : str
+        directory of the store
+    files : list
+        files to remove
+    """
+    for file in files:
+        path = os.path.join(directory, file)
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+
+def get_data_version(snapshot):
+    """Gets the version of the loaded data
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        snapshot or None
+
+    Returns
+    -------
+    data_version : int
+        version of the data or None if it can not be read
+    """
+    return None if snapshot is None else snapshot.data_version
+
+
+def timeframe_filter(start_date=None, end_date=None):
+    """Builds the filter of the events strictly inside a timeframe. It prunes the partitions to the days overlapping
+    the timeframe before the timestamps are compared
+
+    Parameters
+    ----------
+    start_date : str
+        start date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    end_date : str
+        end date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+
+    Returns
+    -------
+    expression : pyarrow Expression
+        filter of the events or None for every event
+    """
+    if start_date is None or end_date is None:
+        return None
+    days = (ds.field('day') >= start_date[:10]) & (ds.field('day') <= end_date[:10])
+    return days & (ds.field('timestamp') > start_date) & (ds.field('timestamp') < end_date)
+
+
+def count_events(snapshot, columns, expression=None):
+    """Counts the events of every combination of values of some columns, null values counted as ''
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        snapshot to scan
+    columns : list
+        columns to group the events by
+    expression : pyarrow Expression
+        filter of the events or None
+
+    Returns
+    -------
+    counts : pyarrow Table
+        the columns and the events column
+    """
+    table = snapshot.dataset.to_table(columns=columns, filter=expression)
+    table = pa.table({column: pc.fill_null(table[column], '') for column in columns})
+    counts = table.group_by(columns).aggregate([([], 'count_all')])
+
+    return counts.select(columns + ['count_all']).rename_columns(columns + ['events'])
+
+
+def query_table(snapshot, breakdown, start_date=None, end_date=None, limit=None, offset=0):
+    """Gets the percentage of the events of every value of a breakdown, for a given timeframe or for all the events,
+    with the same results as database_connection.query_table
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        snapshot to scan
+    breakdown : str
+        one of BREAKDOWNS, e.g. browser, os or device, to get the breakdown by
+    start_date : str
+        start date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    end_date : str
+        end date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    limit : int
+        maximum number of breakdown values or None for all of them
+    offset : int
+        number of breakdown values skipped, e.g. by the previous pages
+
+    Raises
+    ------
+    InternalServerError
+        If the snapshot can not be read or the query failed.
+    ValueError
+        If the breakdown is not one of BREAKDOWNS.
+
+    Returns
+    -------
+    query_result : list
+        value and percentage rows sorted by events or None if no events found
+    """
+    if snapshot is None:
+        raise InternalServerError('Connecting to data base failed.')
+    if breakdown not in BREAKDOWNS:
+        raise ValueError('Unknown breakdown {}, must be one of {}'.format(breakdown, BREAKDOWNS))
+
+    try:
+        expression = timeframe_filter(start_date, end_date)
+        if expression is None:
+            # Like the rollups, the whole table counts only the events with a timestamp
+            expression = ds.field('timestamp').is_valid()
+        counts = count_events(snapshot, [breakdown], expression)
+    except (OSError, pa.ArrowException) as e:
+        print({'error': str(e)})
+        raise InternalServerError('Querying data base failed.')
+
+    total = pc.sum(counts['events']).as_py()
+    counts = counts.sort_by([('events', 'descending'), (breakdown, 'ascending')])
+    counts = counts.slice(offset, limit)
+    if not counts.num_rows:
+        return None
+
+    return [(value, format_percentage(events, total))
+            for value, events in zip(counts[breakdown].to_pylist(), counts['events'].to_pylist())]
+
+
+def iter_query_table(snapshot, breakdown, start_date=None, end_date=None, limit=None, offset=0,
+                     batch_rows=config.STREAM_BATCH_ROWS):
+    """Yields the rows of query_table in batches, like database_connection.iter_query_table
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        snapshot to scan
+    breakdown : str
+        one of BREAKDOWNS
+    start_date : str
+        start date of the given timeframe or None
+    end_date : str
+        end date of the given timeframe or None
+    limit : int
+        maximum number of breakdown values or None for all of them
+    offset : int
+        number of breakdown values skipped, e.g. by the previous pages
+    batch_rows : int
+        number of rows yielded at a time
+
+    Yields
+    ------
+    rows : list
+        batch of breakdown value and percentage rows
+    """
+    rows = iter(query_table(snapshot, breakdown, start_date, end_date, limit, offset) or [])
+    for batch in iter(lambda: list(itertools.islice(rows, batch_rows)), []):
+        yield batch
+
+
+def query_batch(snapshot, columns, bucket=None, start_date=None, end_date=None):
+    """Counts the events of every combination of values of several columns, and of time bucket if indicated, in a
+    single scan, with the same results as database_connection.query_batch
+
+    Parameters
+    ----------
+    snapshot : Snapshot
+        snapshot to scan
+    columns : list
+        columns of STATS_DIMENSIONS to count the events by
+    bucket : str
+        one of TIME_BUCKETS or None
+    start_date : str
+        start date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+    end_date : str
+        end date of the given timeframe or None - 'YYYY-MM-DD HH:MM:SS', excluded from the timeframe
+
+    Raises
+    ------
+    InternalServerError
+        If the snapshot can not be read or the query failed.
+    ValueError
+        If a column is not one of STATS_DIMENSIONS or the bucket not one of TIME_BUCKETS.
+
+    Returns
+    -------
+    counts : pandas dataframe
+        the bucket column, if indicated, the columns and the events column or None if no events found
+    """
+    if snapshot is None:
+        raise InternalServerError('Connecting to data base failed.')
+
+    unknown = [column for column in columns if column not in STATS_DIMENSIONS]
+    if unknown or not columns:
+        raise ValueError('Unknown columns {}, must be some of {}'.format(unknown, STATS_DIMENSIONS))
+    if bucket is not None and bucket not in TIME_BUCKETS:
+        raise ValueError('Unknown bucket {}, must be one of {}'.format(bucket, list(TIME_BUCKETS)))
+
+    try:
+        table = snapshot.dataset.to_table(columns=['timestamp'] + columns,
+                                          filter=timeframe_filter(start_date, end_date))
+        keys = {column: pc.fill_null(table[column], '') for column in columns}
+        if bucket is not None:
+            length, suffix = BUCKET_PREFIXES[bucket]
+            keys = dict(bucket=pc.binary_join_element_wise(
+                pc.utf8_slice_codeunits(table['timestamp'], 0, length), suffix, ''), **keys)
+        counts = pa.table(keys).group_by(list(keys)).aggregate([([], 'count_all')])
+    except (OSError, pa.ArrowException) as e:
+        print({'error': str(e)})
+        raise InternalServerError('Querying data base failed.')
+
+    if not counts.num_rows:
+        return None
+
+    return counts.select(list(keys) + ['count_all']).rename_columns(list(keys) + ['events']).to_pandas()
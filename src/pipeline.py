@@ -0,0 +1,127 @@
+import queue
+import threading
+
+# Marks the end of the items put into a stage queue
+_DONE = object()
+
+
+class _Failure:
+    """Wraps the exception raised by a stage so it can be re-raised by the thread consuming its queue"""
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def prefetch(items, maxsize):
+    """Iterates items in a background thread, at most maxsize items ahead of the consumer, so that producing the next
+    items, e.g. downloading and decompressing the next chunks, overlaps with processing the current one. The producer
+    blocks while the queue is full, and stops when the consumer stops iterating.
+
+    Parameters
+    ----------
+    items : iterable
+        items to produce in the background
+    maxsize : int
+        maximum number of items produced and not consumed yet
+
+    Yields
+    ------
+    item : object
+        every item, in order. An exception raised by the producer is re-raised once the previous items are consumed
+    """
+    items_queue = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items_queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+class Writer:
+    """Single background thread applying write to the items put into a bounded queue, e.g. loading the transformed
+    chunks into the database while the next ones are transformed. put blocks while the queue is full, so the stages
+    feeding the writer never get more than maxsize items ahead of it.
+
+    Parameters
+    ----------
+    write : function
+        function applied to every item, in order, always from the same thread
+    maxsize : int
+        maximum number of items put and not written yet
+    """
+
+    def __init__(self, write, maxsize):
+        self.write = write
+        self._queue = queue.Queue(maxsize)
+        self._failure = None
+        self._thread = threading.Thread(target=self._consume, name='writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if self._failure is None:
+                try:
+                    self.write(item)
+                except BaseException as e:
+                    self._failure = e
+
+    def _raise_failure(self):
+        if self._failure is not None:
+            raise self._failure
+
+    def put(self, item):
+        """Queues an item to be written, waiting while the queue is full
+
+        Parameters
+        ----------
+        item : object
+            item to write
+        """
+        self._raise_failure()
+        self._queue.put(item)
+
+    def close(self):
+        """Waits until every queued item is written and stops the thread. Re-raises the exception raised by write, if
+        any
+        """
+        if self._thread.is_alive():
+            self._queue.put(_DONE)
+            self._thread.join()
+        self._raise_failure()
@@ -0,0 +1,91 @@
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+import time
+from docs import config
+
+# The number of rows is kept for the stats pages, whose next page is linked only when they are full
+CachedResponse = namedtuple('CachedResponse', ['data_version', 'expires', 'body', 'etag', 'rows'], defaults=[None])
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of serialized responses. Every response is stored with the data version it was built
+    from and is only served while that version is still the current one and its time to live has not expired
+
+    Parameters
+    ----------
+    maxsize : int
+        maximum number of responses kept, the least recently used are evicted first
+    ttl : float
+        seconds a response is served from the cache
+    """
+
+    def __init__(self, maxsize=config.RESPONSE_CACHE_SIZE, ttl=config.RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, key, data_version):
+        """Gets the cached response of a key if it was built from data_version and has not expired
+
+        Parameters
+        ----------
+        key : tuple
+            request key, e.g. breakdown, start date and end date
+        data_version : int
+            current version of the data
+
+        Returns
+        -------
+        cached_response : CachedResponse
+            cached response or None
+        """
+        with self._lock:
+            cached_response = self._responses.get(key)
+            if cached_response is None:
+                return None
+            if cached_response.data_version != data_version or cached_response.expires < time.monotonic():
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+
+            return cached_response
+
+    def set(self, key, data_version, body, rows=None):
+        """Caches the serialized response of a key
+
+        Parameters
+        ----------
+        key : tuple
+            request key, e.g. breakdown, start date and end date
+        data_version : int
+            version of the data the response was built from
+        body : bytes
+            serialized response
+        rows : int
+            number of rows of the response, e.g. of a stats page, or None
+
+        Returns
+        -------
+        cached_response : CachedResponse
+            cached response with its entity tag
+        """
+        etag = '{}-{}'.format(data_version, hashlib.md5(body).hexdigest())
+        cached_response = CachedResponse(data_version, time.monotonic() + self.ttl, body, etag, rows)
+        with self._lock:
+            self._responses[key] = cached_response
+            self._responses.move_to_end(key)
+            if len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+
+        return cached_response
+
+    def clear(self):
+        """Removes every cached response
+        """
+        with self._lock:
+            self._responses.clear()
@@ -0,0 +1,171 @@
+import click
+import importlib.util
+import logging
+from src import app, async_app
+from docs import config
+
+logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Production servers in order of preference, the werkzeug development server is the last resort
+SERVERS = ['gunicorn', 'waitress', 'werkzeug']
+
+
+@click.command()
+@click.option('--host', default=config.SERVE_HOST, show_default=True, help='Interface to listen on')
+@click.option('--port', '-p', type=int, default=config.SERVE_PORT, show_default=True, help='Port to listen on')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=config.SERVE_WORKERS, show_default=True,
+              help='Number of worker processes, gunicorn only')
+@click.option('--threads', '-t', type=click.IntRange(min=1), default=config.SERVE_THREADS, show_default=True,
+              help='Number of threads serving requests in every worker')
+@click.option('--server', type=click.Choice(SERVERS), default=None,
+              help='WSGI server, the first one installed of {} by default'.format(', '.join(SERVERS)))
+@click.option('--db-file', default=None,
+              help='Database file, or Parquet directory, loaded by the etl, {} or {} by default depending on the '
+                   'storage backend'.format(config.DB_FILE, config.PARQUET_DIR))
+@click.option('--async', 'async_mode', is_flag=True,
+              help='Serve the asyncio variant of the API on uvicorn, in a single process running up to '
+                   '{} queries at a time'.format(config.ASYNC_QUERY_THREADS))
+def main(host, port, workers, threads, server, db_file, async_mode):
+    """Serves the API on a multi-threaded WSGI server, independently of the etl, which can refresh the database
+    meanwhile
+    """
+    if async_mode:
+        logging.info('Serving the asyncio API on http://{}:{} with uvicorn ...'.format(host, port))
+        run_uvicorn(async_app.create_async_app(db_file), host, port)
+        return
+
+    server = server or get_server()
+    application = app.create_app(db_file)
+
+    logging.info('Serving the API on http://{}:{} with {} ...'.format(host, port, server))
+    if server == 'gunicorn':
+        run_gunicorn(application, host, port, workers, threads)
+    elif server == 'waitress':
+        run_waitress(application, host, port, threads)
+    else:
+        run_werkzeug(application, host, port)
+
+
+def get_server():
+    """Gets the first WSGI server installed
+
+    Returns
+    -------
+    server : str
+        name of the server
+    """
+    for server in SERVERS[:-1]:
+        if importlib.util.find_spec(server) is not None:
+            return server
+
+    return SERVERS[-1]
+
+
+def warm_up(application):
+    """Opens the database connections of a process before it serves its first request
+
+    Parameters
+    ----------
+    application : Flask
+        API application
+    """
+    opened = application.extensions['storage'].warm()
+    logging.info('{} database connections opened.'.format(opened))
+
+
+def run_gunicorn(application, host, port, workers, threads):
+    """Serves the application with gunicorn. The application is created once, before forking the workers, and every
+    worker opens its own database connections once forked, since SQLite connections must not be shared across a fork
+
+    Parameters
+    ----------
+    application : Flask
+        API application
+    host : str
+        interface to listen on
+    port : int
+        port to listen on
+    workers : int
+        number of worker processes
+    threads : int
+        number of threads per worker
+    """
+    from gunicorn.app.base import BaseApplication
+
+    options = {'bind': '{}:{}'.format(host, port),
+               'workers': workers,
+               'threads': threads,
+               'worker_class': 'gthread',
+               'preload_app': True,
+               'post_fork': lambda server, worker: warm_up(application)}
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    Server().run()
+
+
+def run_waitress(application, host, port, threads):
+    """Serves the application with waitress, in a single process
+
+    Parameters
+    ----------
+    application : Flask
+        API application
+    host : str
+        interface to listen on
+    port : int
+        port to listen on
+    threads : int
+        number of threads
+    """
+    from waitress import serve
+
+    warm_up(application)
+    serve(application, host=host, port=port, threads=threads)
+
+
+def run_werkzeug(application, host, port):
+    """Serves the application with the werkzeug development server, threaded
+
+    Parameters
+    ----------
+    application : Flask
+        API application
+    host : str
+        interface to listen on
+    port : int
+        port to listen on
+    """
+    from werkzeug.serving import run_simple
+
+    logging.warning('Serving with the werkzeug development server, install gunicorn or waitress in production.')
+    warm_up(application)
+    run_simple(host, port, application, threaded=True)
+
+
+def run_uvicorn(application, host, port):
+    """Serves an ASGI application with uvicorn. A single event loop waits on all the clients, so one process is enough
+
+    Parameters
+    ----------
+    application : AsyncStatsApp
+        ASGI application
+    host : str
+        interface to listen on
+    port : int
+        port to listen on
+    """
+    import uvicorn
+
+    uvicorn.run(application, host=host, port=port, lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
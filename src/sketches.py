@@ -0,0 +1,293 @@
+import heapq
+import numpy as np
+import pandas as pd
+
+DISTINCT_COUNT_MODES = ('hll', 'exact')
+
+
+class SpaceSaving:
+    """Space-Saving summary of the most frequent items of a stream, in bounded memory. At most capacity counters are
+    kept; an item that is not tracked can have occurred at most min count times, so the counts are overestimates by
+    at most their error and every item with more than total / capacity occurrences is tracked. Summaries of different
+    chunks or workers can be merged
+
+    Parameters
+    ----------
+    capacity : int
+        maximum number of counters kept
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = dict()
+        self.errors = dict()
+
+    def __len__(self):
+        return len(self.counters)
+
+    def min_count(self):
+        """Gets the maximum number of occurrences of an item that is not tracked
+
+        Returns
+        -------
+        min_count : int
+            smallest counter if the summary is full, 0 otherwise
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(self.counters.values())
+
+    def update(self, counts):
+        """Adds the occurrences of a chunk of the stream
+
+        Parameters
+        ----------
+        counts : dict-like
+            exact number of occurrences of every item of the chunk, e.g. a value_counts series
+        """
+        self._merge({item: int(count) for item, count in counts.items()}, dict(), 0)
+
+    def merge(self, other):
+        """Adds the occurrences summarized by another summary, e.g. of another worker
+
+        Parameters
+        ----------
+        other : SpaceSaving
+            summary to merge into this one
+        """
+        self._merge(other.counters, other.errors, other.min_count())
+
+    def _merge(self, counts, errors, min_count):
+        own_min_count = self.min_count()
+        merged_counters = dict()
+        merged_errors = dict()
+        for item in set(self.counters) | set(counts):
+            merged_counters[item] = self.counters.get(item, own_min_count) + counts.get(item, min_count)
+            merged_errors[item] = self.errors.get(item, own_min_count) + errors.get(item, min_count)
+
+        if len(merged_counters) > self.capacity:
+            kept = heapq.nlargest(self.capacity, merged_counters.items(), key=lambda kv: (kv[1], kv[0]))
+            merged_counters = dict(kept)
+            merged_errors = {item: merged_errors[item] for item in merged_counters}
+
+        self.counters = merged_counters
+        self.errors = merged_errors
+
+    def top(self, n):
+        """Gets the n most frequent items, ties broken by item in descending order
+
+        Parameters
+        ----------
+        n : int
+            number of items
+
+        Returns
+        -------
+        top_lst : list
+            (count, item) tuples sorted by count
+        """
+        return heapq.nlargest(n, ((count, item) for item, count in self.counters.items()))
+
+
+class HyperLogLog:
+    """HyperLogLog estimate of the number of distinct items of a stream, in constant memory. Sketches of different
+    chunks or workers can be merged
+
+    Parameters
+    ----------
+    precision : int
+        the sketch keeps 2 ** precision registers
+    """
+
+    def __init__(self, precision):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, hashes):
+        """Adds a chunk of hashed items
+
+        Parameters
+        ----------
+        hashes : numpy array
+            uint64 hashes of the items
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.intp)
+        remainder = hashes & np.uint64((1 << width) - 1)
+        rank = (width + 1 - bit_length(remainder)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """Adds the items summarized by another sketch of the same precision
+
+        Parameters
+        ----------
+        other : HyperLogLog
+            sketch to merge into this one
+        """
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """Estimates the number of distinct items
+
+        Returns
+        -------
+        count : int
+            estimated number of distinct items
+        """
+        m = self.registers.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and empty:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / empty)
+        return int(round(estimate))
+
+
+class ExactDistinct:
+    """Exact number of distinct items of a stream, keeping the hash of every item"""
+
+    def __init__(self):
+        self.hashes = set()
+
+    def update(self, hashes):
+        """Adds a chunk of hashed items
+
+        Parameters
+        ----------
+        hashes : numpy array
+            uint64 hashes of the items
+        """
+        self.hashes.update(np.unique(hashes).tolist())
+
+    def merge(self, other):
+        """Adds the items of another counter
+
+        Parameters
+        ----------
+        other : ExactDistinct
+            counter to merge into this one
+        """
+        self.hashes |= other.hashes
+
+    def count(self):
+        """Gets the number of distinct items
+
+        Returns
+        -------
+        count : int
+            number of distinct items
+        """
+        return len(self.hashes)
+
+
+class DistinctCounts:
+    """Number of distinct users per value of a column, e.g. unique users per browser, updated chunk by chunk
+
+    Parameters
+    ----------
+    mode : str
+        'hll' to estimate the counts with a HyperLogLog sketch per value or 'exact' to keep the hashed user ids
+    precision : int
+        precision of the HyperLogLog sketches
+    """
+
+    def __init__(self, mode, precision):
+        if mode not in DISTINCT_COUNT_MODES:
+            raise ValueError('Distinct count mode must be one of {}, got {}'.format(DISTINCT_COUNT_MODES, mode))
+        self.mode = mode
+        self.precision = precision
+        self.counters = dict()
+
+    def _counter(self, value):
+        if value not in self.counters:
+            self.counters[value] = HyperLogLog(self.precision) if self.mode == 'hll' else ExactDistinct()
+        return self.counters[value]
+
+    def update(self, values, users):
+        """Adds the users of every value of a chunk
+
+        Parameters
+        ----------
+        values : pandas series
+            counted column, e.g. the browser of every event
+        users : pandas series
+            user of every event
+        """
+        codes, uniques = pd.factorize(values)
+        hashes = hash_values(users)
+        valid = codes >= 0
+        codes, hashes = codes[valid], hashes[valid]
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        for i, value in enumerate(uniques):
+            if bounds[i] < bounds[i + 1]:
+                self._counter(value).update(hashes[order[bounds[i]:bounds[i + 1]]])
+
+    def merge(self, other):
+        """Adds the users counted by another instance, e.g. of another worker
+
+        Parameters
+        ----------
+        other : DistinctCounts
+            counts to merge into these ones
+        """
+        for value, counter in other.counters.items():
+            self._counter(value).merge(counter)
+
+    def top(self, n):
+        """Gets the n values with the most distinct users
+
+        Parameters
+        ----------
+        n : int
+            number of values
+
+        Returns
+        -------
+        top_lst : list
+            [value, users] lists sorted by users
+        """
+        counts = ((counter.count(), value) for value, counter in self.counters.items())
+        return [[value, count] for count, value in heapq.nlargest(n, counts) if count > 0]
+
+
+def hash_values(values):
+    """Hashes every value of a series to 64 bits
+
+    Parameters
+    ----------
+    values : pandas series
+        values to hash
+
+    Returns
+    -------
+    hashes : numpy array
+        uint64 hash of every value
+    """
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).values
+
+
+def bit_length(values):
+    """Vectorized int.bit_length of unsigned 64-bit integers
+
+    Parameters
+    ----------
+    values : numpy array
+        uint64 values
+
+    Returns
+    -------
+    lengths : numpy array
+        number of bits needed to represent every value, 0 for 0
+    """
+    values = values.copy()
+    lengths = np.zeros(values.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= np.uint64(1 << shift)
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    lengths += (values > 0)
+    return lengths
@@ -0,0 +1,245 @@
+from docs import config
+import abc
+import pandas as pd
+from src import database_connection, parquet_store
+
+# Backends the events can be stored in, selected by config.STORAGE_BACKEND
+STORAGE_BACKENDS = ('sqlite', 'parquet')
+
+
+class Storage(abc.ABC):
+    """Store of the events loaded by the etl and queried by the API. Queries run on a connection checked out with
+    connect, which they close, and return the same results whatever the backend. Backends implement every abstract
+    method, an incomplete one cannot be instantiated
+
+    Parameters
+    ----------
+    path : str
+        location of the store
+    pool_size : int
+        maximum number of idle connections kept open
+    """
+
+    def __init__(self, path, pool_size=config.DB_POOL_SIZE):
+        self.path = path
+        self.pool = self.create_pool(pool_size)
+
+    @abc.abstractmethod
+    def create_pool(self, size):
+        """Creates the pool the connections are checked out from
+
+        Parameters
+        ----------
+        size : int
+            maximum number of idle connections kept open
+
+        Returns
+        -------
+        pool : object
+            pool with connect, warm and close methods
+        """
+
+    def connect(self):
+        """Checks out a connection
+
+        Returns
+        -------
+        conn : object
+            connection object or None if the store can not be read
+        """
+        return self.pool.connect()
+
+    def warm(self, count=None):
+        """Opens connections ahead of the first queries
+
+        Parameters
+        ----------
+        count : int
+            number of connections to open, the size of the pool by default
+
+        Returns
+        -------
+        opened : int
+            number of connections opened
+        """
+        return self.pool.warm(count)
+
+    def close(self):
+        """Closes every idle connection
+        """
+        self.pool.close()
+
+    @abc.abstractmethod
+    def load(self, df, if_exists='append'):
+        """Loads the new events of df
+
+        Parameters
+        ----------
+        df : dataframe
+            enriched events
+        if_exists : str
+            "append" to add only the df events that are not loaded yet, "replace_days" to reload the days of df
+            with its events or "replace" to reload the store with df
+
+        Returns
+        -------
+        inserted : int
+            number of new events loaded
+        """
+
+    @abc.abstractmethod
+    def get_data_version(self, conn):
+        """Gets the version of the loaded data, bumped by every load adding events
+
+        Parameters
+        ----------
+        conn : object
+            connection object or None
+
+        Returns
+        -------
+        data_version : int
+            version of the data or None if it can not be read
+        """
+
+    @abc.abstractmethod
+    def query_table(self, conn, breakdown, start_date=None, end_date=None, limit=None, offset=0):
+        """Gets the percentage of the events of every value of a breakdown, see database_connection.query_table
+
+        Returns
+        -------
+        query_result : list
+            value and percentage rows sorted by events or None if no events found
+        """
+
+    @abc.abstractmethod
+    def iter_query_table(self, conn, breakdown, start_date=None, end_date=None, limit=None, offset=0,
+                         batch_rows=config.STREAM_BATCH_ROWS):
+        """Yields the rows of query_table in batches, see database_connection.iter_query_table
+
+        Yields
+        ------
+        rows : list
+            batch of breakdown value and percentage rows
+        """
+
+    @abc.abstractmethod
+    def query_batch(self, conn, columns, bucket=None, start_date=None, end_date=None):
+        """Counts the events of every combination of values of several columns, see database_connection.query_batch
+
+        Returns
+        -------
+        counts : pandas dataframe
+            the bucket column, if indicated, the columns and the events column or None if no events found
+        """
+
+
+class SQLiteStorage(Storage):
+    """Events stored in a SQLite database, with hourly rollups of the breakdowns
+    """
+
+    def create_pool(self, size):
+        return database_connection.ConnectionPool(self.path, size)
+
+    def load(self, df, if_exists='append'):
+        return database_connection.main(df, if_exists, self.path)
+
+    def get_data_version(self, conn):
+        return database_connection.get_data_version(conn)
+
+    def query_table(self, conn, breakdown, start_date=None, end_date=None, limit=None, offset=0):
+        return database_connection.query_table(conn, breakdown, start_date, end_date, limit, offset)
+
+    def iter_query_table(self, conn, breakdown, start_date=None, end_date=None, limit=None, offset=0,
+                         batch_rows=config.STREAM_BATCH_ROWS):
+        return database_connection.iter_query_table(conn, breakdown, start_date, end_date, limit, offset, batch_rows)
+
+    def query_batch(self, conn, columns, bucket=None, start_date=None, end_date=None):
+        return database_connection.query_batch(conn, columns, bucket, start_date, end_date)
+
+
+class ParquetStorage(Storage):
+    """Events stored column-wise in Parquet files, which the queries scan and aggregate vectorized with pyarrow
+    """
+
+    def create_pool(self, size):
+        return parquet_store.SnapshotPool(self.path, size)
+
+    def load(self, df, if_exists='append'):
+        return parquet_store.load_events(self.path, df, if_exists)
+
+    def get_data_version(self, conn):
+        return parquet_store.get_data_version(conn)
+
+    def query_table(self, conn, breakdown, start_date=None, end_date=None, limit=None, offset=0):
+        return parquet_store.query_table(conn, breakdown, start_date, end_date, limit, offset)
+
+    def iter_query_table(self, conn, breakdown, start_date=None, end_date=None, limit=None, offset=0,
+                         batch_rows=config.STREAM_BATCH_ROWS):
+        return parquet_store.iter_query_table(conn, breakdown, start_date, end_date, limit, offset, batch_rows)
+
+    def query_batch(self, conn, columns, bucket=None, start_date=None, end_date=None):
+        return parquet_store.query_batch(conn, columns, bucket, start_date, end_date)
+
+
+def get_storage(backend=None, path=None, pool_size=config.DB_POOL_SIZE):
+    """Creates the store of the events
+
+    Parameters
+    ----------
+    backend : str
+        one of STORAGE_BACKENDS, config.STORAGE_BACKEND by default
+    path : str
+        database file or Parquet directory, config.DB_FILE or config.PARQUET_DIR by default
+    pool_size : int
+        maximum number of idle connections kept open
+
+    Raises
+    ------
+    ValueError
+        If the backend is not one of STORAGE_BACKENDS.
+
+    Returns
+    -------
+    storage : Storage
+        store of the events
+    """
+    backend = backend or config.STORAGE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteStorage(path or config.DB_FILE, pool_size)
+    if backend == 'parquet':
+        return ParquetStorage(path or config.PARQUET_DIR, pool_size)
+
+    raise ValueError('Unknown storage backend {}, must be one of {}'.format(backend, STORAGE_BACKENDS))
+
+
+def main(df, if_exists="append"):
+    """Loads the new events of df into the configured store
+
+    Parameters
+    ----------
+    df : dataframe
+        Pandas dataframe to load
+    if_exists : str
+        "append" to add only the df events that are not loaded yet, "replace_days" to reload the days of df with
+        its events or "replace" to reload the store with df
+    """
+    get_storage().load(df, if_exists)
+
+
+def event_days(df):
+    """Gets the day of every event, the partition it is stored in
+
+    Parameters
+    ----------
+    df : dataframe
+        enriched events
+
+    Returns
+    -------
+    days : pandas series
+        'YYYY-MM-DD' day of every event, null for the events without timestamp
+    """
+    if pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        return df['timestamp'].dt.strftime('%Y-%m-%d')
+    return df['timestamp'].str[:10]
@@ -1,69 +1,32 @@
 from geolite2 import geolite2
+from src.transform_ua import to_categorical
+from docs import config
+import pandas as pd
 import numpy as np
+import heapq
 import logging
 
+_geo_reader = None
 
-def parse_ip_to_country_city(ip):
-    """Applies geolite2 parse function to each IP row and gets the city and country for every IP in that row.
 
-    Parameters
-    ----------
-    ip : str
-        IP or IPs separated by comma
-
-    Raises
-    ------
-    ValueError
-        If faulty IP value.
-    KeyError
-        If faulty key value.
+def get_geo_reader():
+    """Gets the geolite2 database reader of the process, opening it the first time
 
     Returns
     -------
-    row : str
-        Parsed IP row into countries/cities or None
+    geo : object
+        geolite2 database reader
     """
-    geo = geolite2.reader()
-
-    if ',' in str(ip):
-        countries_lst = list()
-        cities_lst = list()
-        for i in ip.split(','):
-            try:
-                x = geo.get(i.strip())
-            except ValueError:
-                return ''
-            try:
-                if x is not None:
-                    if x.get('country', 0) != 0 and x.get('city', 0) != 0:
-                        countries_lst.append(x['country']['names']['en'])
-                        cities_lst.append(x['city']['names']['en'])
-                    elif x.get('country', 0) != 0 and x.get('city', 0) == 0:
-                        countries_lst.append(x['country']['names']['en'])
-                    elif x.get('city', 0) != 0 and x.get('country', 0) == 0:
-                        cities_lst.append(x['city']['names']['en'])
-            except KeyError:
-                return ''
-        return '{}/{}'.format(','.join(countries_lst), ','.join(cities_lst))
-    else:
-        try:
-            x = geo.get(str(ip))
-        except ValueError:
-            return ''
-        try:
-            if x is not None:
-                if x.get('country', 0) != 0 and x.get('city', 0) != 0:
-                    return '{}/{}'.format(x['country']['names']['en'], x['city']['names']['en'])
-                elif x.get('city', 0) == 0:
-                    return '{}'.format(x['country']['names']['en'])
-                elif x.get('country', 0) == 0:
-                    return '/{}'.format(x['city']['names']['en'])
-        except KeyError:
-            return ''
+    global _geo_reader
+    if _geo_reader is None:
+        _geo_reader = geolite2.reader()
+
+    return _geo_reader
 
 
-def parse_ip(df, api=False):
-    """Parses IP into country and city.
+def parse_ip(df, api=False, n=config.TOP_N):
+    """Parses IP into country and city. Every distinct IP, including every IP of a comma separated proxy chain, is
+    looked up only once
 
     Parameters
     ----------
@@ -71,66 +34,170 @@ def parse_ip(df, api=False):
         Dataframe that contains file rows without duplicates
     api : boolean
         Boolean flag used to prepare the data to be consumed by the api or not
+    n : int
+        number of countries and cities of the top lists
 
     Returns
     -------
     ip_df : pandas dataframe
         Two columns dataframe; country and city columns.
     top_countries_sorted_lst : list
-        The list of top 5 countries based on num of events
+        The list of top n countries based on num of events
     top_cities_sorted_lst : list
-        The list of top 5 cities based on num of events
+        The list of top n cities based on num of events
     """
     logging.info('Parsing IPs ...')
-    ip_df = df['ip'].to_frame()
+    codes, uniques = pd.factorize(df['ip'])
+    uniques = np.asarray(uniques, dtype=object)
+    if (codes == -1).any():
+        # Missing IPs get code -1, i.e. the last value, which is left empty
+        uniques = np.append(uniques, '')
+    logging.info('Parsing {} distinct IP rows ...'.format(len(uniques)))
 
-    ip_df['country_city'] = ip_df['ip'].parallel_apply(parse_ip_to_country_city)
-    ip_df[['country', 'city']] = ip_df.country_city.str.split("/", expand=True)
+    ip_table = dict()
+    parsed_uniques = np.array([parse_ip_chain(str(ip), ip_table) for ip in uniques], dtype=object).reshape(-1, 2)
+    logging.info('{} distinct IPs looked up.'.format(len(ip_table)))
 
-    ip_df.city.fillna(value=np.nan, inplace=True)
-    ip_df['city'].replace(np.nan, "", inplace=True)
+    ip_df = pd.DataFrame({'country': to_categorical(parsed_uniques[:, 0], codes),
+                          'city': to_categorical(parsed_uniques[:, 1], codes)}, index=df.index)
 
     if not api:
-        top_countries_sorted_lst, top_cities_sorted_lst = count_countries_cities(ip_df)
+        top_countries_sorted_lst, top_cities_sorted_lst = count_countries_cities(ip_df, n)
 
         return ip_df[['country', 'city']], top_countries_sorted_lst, top_cities_sorted_lst
     else:
         return ip_df[['country', 'city']]
 
 
-def count_countries_cities(df):
-    """Counts the number of countries and cities.
+def parse_ip_chain(ip, ip_table):
+    """Gets the countries and cities of an IP row, looking up in the geolite2 database only the IPs that are not in
+    ip_table yet
+
+    Parameters
+    ----------
+    ip : str
+        IP or IPs separated by comma
+    ip_table : dict
+        lookup table of the already parsed IPs, updated with the new ones
+
+    Returns
+    -------
+    country_city : tuple
+        countries and cities separated by comma, both empty if any IP is faulty
+    """
+    countries_lst = list()
+    cities_lst = list()
+    for i in ip.split(','):
+        i = i.strip()
+        try:
+            country_city = ip_table[i]
+        except KeyError:
+            country_city = ip_table[i] = lookup_ip(i)
+
+        if country_city is None:
+            return '', ''
+        if country_city[0]:
+            countries_lst.append(country_city[0])
+        if country_city[1]:
+            cities_lst.append(country_city[1])
+
+    return ','.join(countries_lst), ','.join(cities_lst)
+
+
+def lookup_ip(ip):
+    """Looks up an IP in the geolite2 database
+
+    Parameters
+    ----------
+    ip : str
+        IP
+
+    Returns
+    -------
+    country_city : tuple
+        country and city of the IP, empty if not found, or None if faulty IP
+    """
+    try:
+        x = get_geo_reader().get(ip)
+    except ValueError:
+        return None
+    if x is None:
+        return '', ''
+    try:
+        country = x['country']['names']['en'] if 'country' in x else ''
+        city = x['city']['names']['en'] if 'city' in x else ''
+    except KeyError:
+        return None
+
+    return country, city
+
+
+def count_countries_cities(df, n=config.TOP_N):
+    """Counts the number of countries and cities. Every country and city of a proxy chain row is counted
 
     Parameters
     ----------
     df : pandas dataframe
         Dataframe that contains countries column and cities column
+    n : int
+        number of countries and cities of the top lists
 
     Returns
     -------
     top_countries_sorted_lst : list
-        The list of top 5 countries based on num of events
+        The list of top n countries based on num of events
     top_cities_sorted_lst : list
-        The list of top 5 cities based on num of events
+        The list of top n cities based on num of events
     """
-    logging.info('Calculating Top 5 countries and cities ...')
-    countries_dct = dict()
-    cities_dct = dict()
-
-    for row in df.itertuples():
-        if ',' in row.country:
-            countries_dct[row.country.split(',')[0]] = countries_dct.get(row.country.split(',')[0], 0) + 1
-            countries_dct[row.country.split(',')[1]] = countries_dct.get(row.country.split(',')[1], 0) + 1
-        elif ',' in row.city:
-            cities_dct[row.city.split(',')[0]] = cities_dct.get(row.city.split(',')[0], 0) + 1
-            cities_dct[row.city.split(',')[1]] = cities_dct.get(row.city.split(',')[1], 0) + 1
-        elif row.city != "":
-            countries_dct[row.country] = countries_dct.get(row.country, 0) + 1
-            cities_dct[row.city] = cities_dct.get(row.city, 0) + 1
-        else:
-            countries_dct[row.country] = countries_dct.get(row.country, 0) + 1
-
-    top_countries_sorted_lst = sorted([(v, k) for k, v in countries_dct.items()], reverse=True)[:5]
-    top_cities_sorted_lst = sorted([(v, k) for k, v in cities_dct.items()], reverse=True)[:5]
+    logging.info('Calculating Top {} countries and cities ...'.format(n))
+    top_countries_sorted_lst = top_values(count_values(df, 'country'), n)
+    top_cities_sorted_lst = top_values(count_values(df, 'city'), n)
 
     return top_countries_sorted_lst, top_cities_sorted_lst
+
+
+def count_values(df, column):
+    """Counts the number of events of every value of a column of comma separated values. The distinct rows are counted
+    first, so only those are split
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        Dataframe that contains the column
+    column : str
+        name of the column
+
+    Returns
+    -------
+    counts : pandas series
+        number of events of every non empty value
+    """
+    if column not in df.columns:
+        return pd.Series(dtype='int64')
+
+    row_counts = df[column].value_counts()
+    row_counts = row_counts[row_counts > 0]
+    values = pd.DataFrame({'value': row_counts.index.astype(str).str.split(','), 'events': row_counts.values})
+    values = values.explode('value')
+    values['value'] = values['value'].str.strip()
+    values = values[values['value'] != '']
+
+    return values.groupby('value', sort=False)['events'].sum()
+
+
+def top_values(counts, n=config.TOP_N):
+    """Gets the n values with most events, ties broken by value in descending order
+
+    Parameters
+    ----------
+    counts : pandas series
+        number of events of every value
+    n : int
+        number of values
+
+    Returns
+    -------
+    top_sorted_lst : list
+        (events, value) tuples sorted by events
+    """
+    return heapq.nlargest(n, ((int(events), value) for value, events in counts.items()))
@@ -1,9 +1,111 @@
 from user_agents import parse
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import json
+import os
 import logging
+from docs import config
+from src.sketches import DistinctCounts
 
+_ua_cache = None
 
-def parse_user_agent_string(df, api=False):
-    """Parses user agent string into device, browser and os.
+
+class UserAgentCache:
+    """Bounded LRU cache of parsed user agent strings that can be persisted to disk, so later runs start warm
+
+    Parameters
+    ----------
+    maxsize : int
+        maximum number of user agent strings kept, the least recently used are evicted first
+    path : str
+        json file the cache is loaded from and saved to or None to keep it in memory only
+    """
+
+    def __init__(self, maxsize=config.UA_CACHE_SIZE, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self._parsed = OrderedDict()
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._parsed)
+
+    def get(self, user_agent_string):
+        """Gets the parsed user agent string, parsing it only if it is not cached yet
+
+        Parameters
+        ----------
+        user_agent_string : str
+            raw user agent string
+
+        Returns
+        -------
+        parsed : tuple
+            device, os and browser
+        """
+        try:
+            parsed = self._parsed[user_agent_string]
+            self._parsed.move_to_end(user_agent_string)
+        except KeyError:
+            parsed = parse_ua(user_agent_string)
+            self._parsed[user_agent_string] = parsed
+            if len(self._parsed) > self.maxsize:
+                self._parsed.popitem(last=False)
+            self._dirty = True
+
+        return parsed
+
+    def load(self):
+        """Loads the cache from its json file if it exists
+
+        Raises
+        ------
+        ValueError
+            If the json file is not valid.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as read_file:
+                for user_agent_string, device, os_family, browser in json.load(read_file)[-self.maxsize:]:
+                    self._parsed[user_agent_string] = (device, os_family, browser)
+        except (IOError, ValueError) as e:
+            logging.warning('Ignoring user agent cache {}: {}'.format(self.path, e))
+
+    def save(self):
+        """Saves the cache to its json file, from least to most recently used, if new entries were parsed
+        """
+        if self.path is None or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Every process writes its own temporary file, e.g. the etl worker processes
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as write_file:
+            json.dump([[k] + list(v) for k, v in self._parsed.items()], write_file)
+        # Replaces the previous cache file at once so concurrent runs never read it half written
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def get_ua_cache():
+    """Gets the process wide user agent cache, loading it from config.UA_CACHE_FILE the first time
+
+    Returns
+    -------
+    ua_cache : UserAgentCache
+        user agent cache
+    """
+    global _ua_cache
+    if _ua_cache is None:
+        _ua_cache = UserAgentCache(config.UA_CACHE_SIZE, config.UA_CACHE_FILE)
+        _ua_cache.load()
+
+    return _ua_cache
+
+
+def parse_user_agent_string(df, api=False, ua_cache=None, n=config.TOP_N):
+    """Parses user agent string into device, browser and os. Every distinct user agent string is parsed only once
 
     Parameters
     ----------
@@ -11,76 +113,106 @@ def parse_user_agent_string(df, api=False):
         Dataframe that contains file rows without duplicates
     api : boolean
         Boolean flag used to prepare the data to be consumed by the api or not
+    ua_cache : UserAgentCache
+        cache of parsed user agent strings or None to use the process wide one
+    n : int
+        number of browsers and OS of the top lists
 
     Returns
     -------
     user_agent_string_df : pandas dataframe
         Three columns dataframe; device, os and browser columns.
     top_browsers_sorted_lst : list
-        The list of top 5 browsers based on num of unique users
+        The list of top n browsers based on num of unique users
     top_os_sorted_lst : list
-        The list of top 5 OS based on num of unique users
+        The list of top n OS based on num of unique users
     """
     logging.info('Parsing user agent strings ...')
+    if ua_cache is None:
+        ua_cache = get_ua_cache()
+
     user_agent_string_df = df[['user_id', 'user_agent_string']]
-    user_agent_string_df['user_agent_string'] = user_agent_string_df['user_agent_string'].parallel_apply(
-        parse_ua_row)
+    codes, uniques = pd.factorize(user_agent_string_df['user_agent_string'])
+    uniques = np.asarray(uniques, dtype=object)
+    if (codes == -1).any():
+        # Missing user agent strings get code -1, i.e. the last value, an empty string parsed as Other/Other/Other
+        uniques = np.append(uniques, '')
+    logging.info('Parsing {} distinct user agent strings ...'.format(len(uniques)))
 
-    user_agent_string_df[['device', 'os', 'browser', 'na']] = user_agent_string_df.user_agent_string.str.split("/",
-                                                                                                               expand=True)
-    user_agent_string_df.drop(['user_agent_string', 'na'], axis=1, inplace=True)
+    parsed_uniques = np.array([ua_cache.get(ua) for ua in uniques], dtype=object).reshape(-1, 3)
+    ua_cache.save()
 
-    user_agent_string_df_no_user_duplicates = user_agent_string_df[['user_id', 'device', 'os', 'browser']]
-    user_agent_string_df_no_user_duplicates.sort_values('user_id', inplace=True)
-    logging.info('Total number of lines in the dataframe: {}'.format(user_agent_string_df_no_user_duplicates.shape[0]))
-    user_agent_string_df_no_user_duplicates.drop_duplicates(subset='user_id', keep=False, inplace=True)
-    logging.info('Total number of lines in the dataframe after removing user_id duplicates: {}'.format(
-        user_agent_string_df_no_user_duplicates.shape[0]))
+    for i, column in enumerate(['device', 'os', 'browser']):
+        user_agent_string_df[column] = to_categorical(parsed_uniques[:, i], codes)
+    user_agent_string_df.drop(['user_agent_string'], axis=1, inplace=True)
 
     if not api:
-        top_browsers_sorted_lst, top_os_sorted_lst = count_browsers_os(user_agent_string_df_no_user_duplicates)
+        top_browsers_sorted_lst, top_os_sorted_lst = count_users_browsers_os(user_agent_string_df, n)
 
         return user_agent_string_df[['device', 'os', 'browser']], top_browsers_sorted_lst, top_os_sorted_lst
     else:
         return user_agent_string_df[['device', 'os', 'browser']]
 
 
-def parse_ua_row(row):
-    """Applies user_agents.parse() function to each user agent string row
+def to_categorical(unique_values, codes):
+    """Builds a categorical column from the values of every distinct row and the code of every row
+
+    Parameters
+    ----------
+    unique_values : numpy array
+        value of every distinct row
+    codes : numpy array
+        position in unique_values of every row
+
+    Returns
+    -------
+    column : pandas categorical
+        value of every row, stored as integer codes of the distinct values
+    """
+    value_codes, categories = pd.factorize(unique_values)
+    return pd.Categorical.from_codes(value_codes[codes], categories)
+
+
+def parse_ua(user_agent_string):
+    """Applies user_agents.parse() function to a user agent string
 
     Parameters
     ----------
-    row : str
-        User agent string column row
+    user_agent_string : str
+        raw user agent string
 
     Returns
     -------
-    row : str
-        Parsed row into device, os and browser
+    parsed : tuple
+        device, os and browser
     """
-    return str(parse(row)).split('/')[0].strip() + '/' + parse(row).os.family + '/' + parse(row).browser.family
+    user_agent = parse(user_agent_string)
+    return str(user_agent).split('/')[0].strip(), user_agent.os.family, user_agent.browser.family
 
 
-def count_browsers_os(df):
-    """Counts the number of browsers and OSs.
+def count_users_browsers_os(df, n=config.TOP_N):
+    """Counts the number of unique users of every browser and OS with the distinct counters set in
+    config.DISTINCT_COUNT_MODE, the ones the chunked top lists are summarized with, so that both rank the same
 
     Parameters
     ----------
     df : pandas dataframe
-        Dataframe that contains unique number of users
+        Dataframe that contains user_id, browser and os columns
+    n : int
+        number of browsers and OS of the top lists
 
     Returns
     -------
     top_browsers_sorted_lst : list
-        The list of top 5 browsers based on num of unique users
+        The list of top n browsers based on num of unique users
     top_os_sorted_lst : list
-        The list of top 5 OS based on num of unique users
+        The list of top n OS based on num of unique users
     """
-    logging.info('Calculating Top 5 browsers and OS ...')
+    logging.info('Calculating Top {} browsers and OS ...'.format(n))
 
-    top_browsers_sorted_lst = df['browser'].value_counts()[
-                              :5].reset_index().values.tolist()
-    top_os_sorted_lst = df['os'].value_counts()[
-                        :5].reset_index().values.tolist()
+    browsers = DistinctCounts(config.DISTINCT_COUNT_MODE, config.HLL_PRECISION)
+    browsers.update(df['browser'], df['user_id'])
+    oses = DistinctCounts(config.DISTINCT_COUNT_MODE, config.HLL_PRECISION)
+    oses.update(df['os'], df['user_id'])
 
-    return top_browsers_sorted_lst, top_os_sorted_lst
+    return browsers.top(n), oses.top(n)
@@ -1,5 +1,21 @@
 import pytest
 import pandas as pd
+import gzip
+from docs import config
+from src import transform_ua
+
+
+@pytest.fixture(autouse=True)
+def no_checkpoints(monkeypatch):
+    # Runs never read checkpoints left by other tests nor write them into the data directory
+    monkeypatch.setattr(config, 'CHECKPOINT_DIR', None)
+
+
+@pytest.fixture(autouse=True)
+def isolated_ua_cache(monkeypatch, tmp_path):
+    # Runs start with an empty user agent cache, persisted to a temporary file instead of the data directory
+    monkeypatch.setattr(config, 'UA_CACHE_FILE', str(tmp_path / 'ua_cache.json'))
+    monkeypatch.setattr(transform_ua, '_ua_cache', None)
 
 
 @pytest.fixture()
@@ -21,6 +37,13 @@ def some_raw_df():
     yield df
 
 
+@pytest.fixture()
+def some_raw_tsv_gz(some_raw_df):
+    tsv_gz = gzip.compress(some_raw_df.to_csv(sep='\t', header=False, index=False).encode())
+
+    yield tsv_gz
+
+
 @pytest.fixture()
 def some_country_city_df():
     content = {'country': ['United Kingdom', 'United Kingdom', 'United Kingdom'],
@@ -53,10 +76,11 @@ def some_country_cities_df():
 
 @pytest.fixture()
 def some_browser_os_df():
-    content = {'browser': ['Mobile Safari', 'Mobile Safari', 'Mobile Safari', 'IE', 'IE', 'Chrome'],
+    content = {'user_id': ['a', 'b', 'c', 'd', 'e', 'f'],
+               'browser': ['Mobile Safari', 'Mobile Safari', 'Mobile Safari', 'IE', 'IE', 'Chrome'],
                'os': ['iOS', 'iOS', 'iOS', 'Mac OS X', 'Mac OS X', 'Windows']}
 
-    browser_os_df = pd.DataFrame(content, columns=['browser', 'os'])
+    browser_os_df = pd.DataFrame(content, columns=['user_id', 'browser', 'os'])
 
     yield browser_os_df
 
@@ -93,7 +117,7 @@ def some_empty_ip_list():
 
 @pytest.fixture()
 def some_invalid_ip_list():
-    invalid_ip_list = ['86.40.128', '86.40.128.3.344', '128.3']
+    invalid_ip_list = ['86.40.128.300', '86.40.128.3.344', '128.3.a']
 
     yield invalid_ip_list
 
@@ -1,8 +1,11 @@
 from unittest import TestCase
 from unittest.mock import patch
 import json
+import os
+import tempfile
+import pandas as pd
 
-from src import app
+from src import app, database_connection, parquet_store
 
 
 class TestApp(TestCase):
@@ -110,75 +113,233 @@ class TestApp(TestCase):
         response = api_client.get('/stats/device?alvaro=2014-10-12T17:01:01Z&collantes=2014-10-12T17:01:08Z')
         assert response.status_code == 400
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_browser_returns_not_found_response_when_events_db_returns_no_hits(self, mock):
-        mock.return_value = None
+        mock.return_value = iter([])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/browser?start_date=2014-10-12T17:01:01Z&end_date=2014-10-12T17:01:08Z')
         assert response.status_code == 404
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_os_returns_not_found_response_when_events_db_returns_no_hits(self, mock):
-        mock.return_value = None
+        mock.return_value = iter([])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/os?start_date=2014-10-12T17:01:01Z&end_date=2014-10-12T17:01:08Z')
         assert response.status_code == 404
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_device_returns_not_found_response_when_events_db_returns_no_hits(self, mock):
-        mock.return_value = None
+        mock.return_value = iter([])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/device?start_date=2014-10-12T17:01:01Z&end_date=2014-10-12T17:01:08Z')
         assert response.status_code == 404
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_browser_returns_browsers_breakdown_from_db_filtered_by_indicated_time_frame_as_json_payload(self, mock):
-        mock.return_value = [["Mobile Safari", "32.74%"], ["Safari", "22.12%"], ["IE", "14.16%"]]
+        rows = [["Mobile Safari", "32.74%"], ["Safari", "22.12%"], ["IE", "14.16%"]]
+        mock.return_value = iter([rows])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/browser?start_date=2014-10-12T17:01:01Z&end_date=2014-10-12T17:01:08Z')
-        assert json.loads(response.data) == mock.return_value
+        assert json.loads(response.data) == rows
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_os_returns_os_breakdown_from_db_filtered_by_indicated_time_frame_as_json_payload(self, mock):
-        mock.return_value = [["Windows", "32.74%"], ["iOS", "32.74%"], ["Mac OS X", "23.01%"]]
+        rows = [["Windows", "32.74%"], ["iOS", "32.74%"], ["Mac OS X", "23.01%"]]
+        mock.return_value = iter([rows])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/os?start_date=2014-10-12T17:01:01Z&end_date=2014-10-12T17:01:08Z')
-        assert json.loads(response.data) == mock.return_value
+        assert json.loads(response.data) == rows
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_device_returns_device_breakdown_from_db_filtered_by_indicated_time_frame_as_json_payload(self, mock):
-        mock.return_value = [["PC", "57.52%"], ["iPhone", "17.7%"], ["iPad", "15.04%"]]
+        rows = [["PC", "57.52%"], ["iPhone", "17.7%"], ["iPad", "15.04%"]]
+        mock.return_value = iter([rows])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/device?start_date=2014-10-12T17:01:01Z&end_date=2014-10-12T17:01:08Z')
-        assert json.loads(response.data) == mock.return_value
+        assert json.loads(response.data) == rows
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_browser_returns_browsers_breakdown_from_db_as_json_payload(self, mock):
-        mock.return_value = [["Mobile Safari", "32.74%"], ["Safari", "22.12%"], ["IE", "14.16%"]]
+        rows = [["Mobile Safari", "32.74%"], ["Safari", "22.12%"], ["IE", "14.16%"]]
+        mock.return_value = iter([rows])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/browser')
-        assert json.loads(response.data) == mock.return_value
+        assert json.loads(response.data) == rows
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_os_returns_os_breakdown_from_db_as_json_payload(self, mock):
-        mock.return_value = [["Windows", "32.74%"], ["iOS", "32.74%"], ["Mac OS X", "23.01%"]]
+        rows = [["Windows", "32.74%"], ["iOS", "32.74%"], ["Mac OS X", "23.01%"]]
+        mock.return_value = iter([rows])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/os')
-        assert json.loads(response.data) == mock.return_value
+        assert json.loads(response.data) == rows
 
-    @patch('src.database_connection.query_table')
+    @patch('src.database_connection.iter_query_table')
     def test_stats_device_returns_devices_breakdown_from_db_as_json_payload(self, mock):
-        mock.return_value = [["Mobile Safari", "32.74%"], ["Safari", "22.12%"], ["IE", "14.16%"]]
+        rows = [["Mobile Safari", "32.74%"], ["Safari", "22.12%"], ["IE", "14.16%"]]
+        mock.return_value = iter([rows])
 
         api_client = self.app.test_client()
         response = api_client.get('/stats/device')
-        assert json.loads(response.data) == mock.return_value
+        assert json.loads(response.data) == rows
 
+
+
+class TestAppWithDatabase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(self.tmp_dir.name, 'events.sqlite')
+        df = pd.DataFrame({'timestamp': ['2014-10-12 17:01:01', '2014-10-12 17:01:05', '2014-10-12 18:01:06'],
+                           'user_id': ['a', 'b', 'c'], 'url': ['u', 'u', 'u'], 'raw_event': ['1', '2', '3'],
+                           'device': ['iPad', 'iPad', 'PC'], 'os': ['iOS', 'iOS', 'Windows'],
+                           'browser': ['Mobile Safari', 'Mobile Safari', 'IE'], 'country': ['', '', ''],
+                           'city': ['', '', '']})
+        self.df = df
+        self.db_file = db_file
+        conn = database_connection.create_database_connection(db_file)
+        database_connection.create_table(conn, df)
+        conn.close()
+
+        self.app = app.create_app(db_file)
+        self.app.testing = True
+
+    def tearDown(self):
+        self.app.extensions['db_pool'].close()
+        self.tmp_dir.cleanup()
+
+    def test_stats_os_returns_os_breakdown_from_db_through_pooled_connection(self):
+        api_client = self.app.test_client()
+        response = api_client.get('/stats/os')
+        assert json.loads(response.data) == [['iOS', '66.67%'], ['Windows', '33.33%']]
+
+    def test_stats_browser_reuses_pooled_connection_across_requests(self):
+        api_client = self.app.test_client()
+        api_client.get('/stats/browser')
+        api_client.get('/stats/browser?start_date=2014-10-12T17:00:00Z&end_date=2014-10-12T18:00:00Z')
+        assert self.app.extensions['db_pool']._idle.qsize() == 1
+
+    def test_stats_browser_served_from_response_cache_while_data_does_not_change(self):
+        api_client = self.app.test_client()
+        first_response = api_client.get('/stats/browser')
+        with patch('src.database_connection.iter_query_table') as mock:
+            second_response = api_client.get('/stats/browser')
+            assert not mock.called
+        assert second_response.data == first_response.data
+
+    def test_stats_browser_response_cache_invalidated_when_new_events_loaded(self):
+        api_client = self.app.test_client()
+        api_client.get('/stats/browser')
+        conn = database_connection.create_database_connection(self.db_file)
+        database_connection.create_table(conn, self.df.assign(raw_event=['4', '5', '6'], browser='Chrome'))
+        conn.close()
+
+        response = api_client.get('/stats/browser')
+        assert json.loads(response.data)[0] == ['Chrome', '50.0%']
+
+    def test_stats_device_returns_not_modified_when_if_none_match_is_current_etag(self):
+        api_client = self.app.test_client()
+        etag = api_client.get('/stats/device').headers['ETag']
+        response = api_client.get('/stats/device', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_stats_batch_returns_every_dimension_from_a_single_scan(self):
+        api_client = self.app.test_client()
+        query_batch = database_connection.query_batch
+        with patch('src.database_connection.query_batch', side_effect=query_batch) as mock:
+            response = api_client.get('/stats?dimensions=os,browser,country')
+            assert mock.call_count == 1
+        breakdowns = json.loads(response.data)['breakdowns']
+        assert breakdowns['os'] == json.loads(api_client.get('/stats/os').data)
+        assert breakdowns['browser'] == json.loads(api_client.get('/stats/browser').data)
+        assert breakdowns['country'] == [['', '100.0%']]
+
+    def test_stats_batch_returns_pairs_of_dimensions_of_the_indicated_timeframe(self):
+        api_client = self.app.test_client()
+        response = api_client.get('/stats?group_by=os,browser&start_date=2014-10-12T17:00:00Z'
+                                  '&end_date=2014-10-12T19:00:00Z')
+        document = json.loads(response.data)
+        assert document['start_date'] == '2014-10-12 17:00:00'
+        assert document['breakdowns'] == {'os,browser': [['iOS', 'Mobile Safari', '66.67%'],
+                                                         ['Windows', 'IE', '33.33%']]}
+
+    def test_stats_batch_breaks_down_every_time_bucket(self):
+        api_client = self.app.test_client()
+        document = json.loads(api_client.get('/stats?dimensions=os&bucket=hour').data)
+        assert document['bucket'] == 'hour'
+        assert document['breakdowns']['os'] == {'2014-10-12 17:00:00': [['iOS', '100.0%']],
+                                                '2014-10-12 18:00:00': [['Windows', '100.0%']]}
+        document = json.loads(api_client.get('/stats?dimensions=os&bucket=day').data)
+        assert document['breakdowns']['os'] == {'2014-10-12': [['iOS', '66.67%'], ['Windows', '33.33%']]}
+
+    def test_stats_batch_returns_bad_request_response_when_arguments_are_not_valid(self):
+        api_client = self.app.test_client()
+        for query_string in ['', 'dimensions=url', 'dimensions=os&bucket=week', 'group_by=os',
+                             'group_by=os,os', 'dimensions=os&start_date=2014-10-12T17:00:00Z', 'dimension=os']:
+            assert api_client.get('/stats?' + query_string).status_code == 400
+
+    def test_stats_batch_returns_not_found_response_when_no_events_in_timeframe(self):
+        api_client = self.app.test_client()
+        response = api_client.get('/stats?dimensions=os&start_date=2015-10-12T17:00:00Z'
+                                  '&end_date=2015-10-12T18:00:00Z')
+        assert response.status_code == 404
+
+    def test_stats_os_returns_pages_of_the_breakdown_with_link_to_the_next_page(self):
+        api_client = self.app.test_client()
+        response = api_client.get('/stats/os?limit=1')
+        assert json.loads(response.data) == [['iOS', '66.67%']]
+        assert response.headers['Link'] == '</stats/os?limit=1&cursor=1>; rel="next"'
+        response = api_client.get('/stats/os?limit=1&cursor=1')
+        assert json.loads(response.data) == [['Windows', '33.33%']]
+        response = api_client.get('/stats/os?limit=1&cursor=2')
+        assert response.status_code == 200
+        assert json.loads(response.data) == []
+        assert 'Link' not in response.headers
+
+    def test_stats_os_last_page_shorter_than_limit_has_no_link_to_a_next_page(self):
+        api_client = self.app.test_client()
+        response = api_client.get('/stats/os?limit=5')
+        assert json.loads(response.data) == [['iOS', '66.67%'], ['Windows', '33.33%']]
+        assert 'Link' not in response.headers
+
+    def test_stats_os_returns_bad_request_response_when_page_is_not_valid(self):
+        api_client = self.app.test_client()
+        for query_string in ['limit=0', 'limit=a', 'cursor=-1', 'limit=100000', 'limit=1&start_date=2014-10-12T17:00:00Z']:
+            assert api_client.get('/stats/os?' + query_string).status_code == 400
+
+    def test_stats_os_returns_newline_delimited_json_when_accepted(self):
+        api_client = self.app.test_client()
+        response = api_client.get('/stats/os', headers={'Accept': 'application/x-ndjson'})
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line) for line in response.data.splitlines()] == [['iOS', '66.67%'], ['Windows', '33.33%']]
+
+    def test_stats_os_streams_breakdowns_larger_than_a_batch_and_caches_them_once_sent(self):
+        api_client = self.app.test_client()
+        with patch('docs.config.STREAM_BATCH_ROWS', 1):
+            response = api_client.get('/stats/os')
+            assert response.is_streamed
+            assert json.loads(response.data) == [['iOS', '66.67%'], ['Windows', '33.33%']]
+            assert self.app.extensions['db_pool']._idle.qsize() == 1
+            with patch('src.database_connection.iter_query_table') as mock:
+                cached_response = api_client.get('/stats/os')
+                assert not mock.called
+        assert cached_response.data == response.data
+        assert 'ETag' in cached_response.headers
+
+    def test_stats_endpoints_return_the_same_breakdowns_from_the_parquet_storage_backend(self):
+        directory = os.path.join(self.tmp_dir.name, 'events_parquet')
+        parquet_store.load_events(directory, self.df.assign(raw_event=[1, 2, 3]))
+        with patch('docs.config.STORAGE_BACKEND', 'parquet'):
+            parquet_app = app.create_app(directory)
+        parquet_app.testing = True
+        for path in ['/stats/browser', '/stats/os?start_date=2014-10-12T17:00:00Z&end_date=2014-10-12T18:00:00Z',
+                     '/stats/device?limit=1&cursor=1', '/stats?dimensions=os,city&group_by=os,browser&bucket=hour']:
+            assert parquet_app.test_client().get(path).data == self.app.test_client().get(path).data
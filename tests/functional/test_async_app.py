@@ -0,0 +1,185 @@
+from unittest import TestCase
+from unittest.mock import patch
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import pandas as pd
+
+from src import app, async_app, database_connection
+
+
+async def request(application, method, path, query_string=b'', headers=()):
+    messages = list()
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+             'headers': [(k.encode(), v.encode()) for k, v in headers]}
+    await application(scope, receive, send)
+    response_headers = {k.decode(): v.decode() for k, v in messages[0]['headers']}
+    return messages[0]['status'], response_headers, messages[1]['body']
+
+
+def get(application, path, query_string=b'', headers=()):
+    return asyncio.run(request(application, 'GET', path, query_string, headers))
+
+
+class TestSingleFlight(TestCase):
+    def test_single_flight_runs_identical_concurrent_calls_once(self):
+        calls = list()
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def run():
+            single_flight = async_app.SingleFlight()
+            results = await asyncio.gather(*[single_flight.do('key', call) for _ in range(10)])
+            assert len(single_flight) == 0
+            return results
+
+        assert asyncio.run(run()) == [1] * 10
+
+    def test_single_flight_raises_the_call_exception_to_every_caller(self):
+        async def call():
+            await asyncio.sleep(0.01)
+            raise ValueError('broken query')
+
+        async def run():
+            single_flight = async_app.SingleFlight()
+            return await asyncio.gather(*[single_flight.do('key', call) for _ in range(3)], return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+class TestAsyncApp(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(self.tmp_dir.name, 'events.sqlite')
+        df = pd.DataFrame({'timestamp': ['2014-10-12 17:01:01', '2014-10-12 17:01:05', '2014-10-12 18:01:06'],
+                           'user_id': ['a', 'b', 'c'], 'url': ['u', 'u', 'u'], 'raw_event': ['1', '2', '3'],
+                           'device': ['iPad', 'iPad', 'PC'], 'os': ['iOS', 'iOS', 'Windows'],
+                           'browser': ['Mobile Safari', 'Mobile Safari', 'IE'], 'country': ['', '', ''],
+                           'city': ['', '', '']})
+        conn = database_connection.create_database_connection(db_file)
+        database_connection.create_table(conn, df)
+        conn.close()
+
+        self.db_file = db_file
+        self.async_app = async_app.create_async_app(db_file)
+        self.app = app.create_app(db_file)
+        self.app.testing = True
+
+    def tearDown(self):
+        self.async_app.close()
+        self.app.extensions['db_pool'].close()
+        self.tmp_dir.cleanup()
+
+    def test_stats_endpoints_return_the_same_breakdowns_as_the_flask_app(self):
+        api_client = self.app.test_client()
+        for path in ['/stats/browser', '/stats/os', '/stats/device']:
+            status, headers, body = get(self.async_app, path)
+            assert status == 200
+            assert headers['Content-Type'] == 'application/json'
+            assert json.loads(body) == json.loads(api_client.get(path).data)
+
+    def test_stats_batch_returns_the_same_document_as_the_flask_app(self):
+        api_client = self.app.test_client()
+        query_string = 'dimensions=os,device&group_by=os,browser&bucket=day'
+        status, _, body = get(self.async_app, '/stats', query_string.encode())
+        assert status == 200
+        assert json.loads(body) == json.loads(api_client.get('/stats?' + query_string).data)
+
+    def test_stats_os_returns_breakdown_of_the_indicated_timeframe(self):
+        status, _, body = get(self.async_app, '/stats/os',
+                              b'start_date=2014-10-12T17:00:00Z&end_date=2014-10-12T17:30:00Z')
+        assert status == 200
+        assert json.loads(body) == [['iOS', '100.0%']]
+
+    def test_stats_browser_returns_bad_request_response_when_datetime_is_not_iso8601(self):
+        status, _, _ = get(self.async_app, '/stats/browser', b'start_date=T17:01:01Z&end_date=2014-10-12T17:01:08Z')
+        assert status == 400
+
+    def test_stats_browser_returns_not_found_response_when_no_events_in_timeframe(self):
+        status, _, _ = get(self.async_app, '/stats/browser',
+                           b'start_date=2015-10-12T17:00:00Z&end_date=2015-10-12T18:00:00Z')
+        assert status == 404
+
+    def test_unknown_path_returns_not_found_response(self):
+        status, _, _ = get(self.async_app, '/stats/city')
+        assert status == 404
+
+    def test_stats_browser_rejects_http_post_requests_with_allow_header_in_response(self):
+        status, headers, _ = asyncio.run(request(self.async_app, 'POST', '/stats/browser'))
+        assert status == 405
+        assert 'Allow' in headers
+
+    def test_stats_browser_returns_not_modified_when_etag_matches(self):
+        _, headers, _ = get(self.async_app, '/stats/browser')
+        status, _, body = get(self.async_app, '/stats/browser', headers=[('If-None-Match', headers['ETag'])])
+        assert status == 304
+        assert body == b''
+
+    def test_identical_concurrent_requests_run_one_query(self):
+        query_table = database_connection.query_table
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_query_table(*args):
+            started.set()
+            release.wait(1)
+            return query_table(*args)
+
+        async def run():
+            requests = [asyncio.ensure_future(request(self.async_app, 'GET', '/stats/os')) for _ in range(20)]
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 1)
+            release.set()
+            return await asyncio.gather(*requests)
+
+        with patch('src.database_connection.query_table', side_effect=slow_query_table) as mock:
+            responses = asyncio.run(run())
+            assert mock.call_count == 1
+        assert all(status == 200 for status, _, _ in responses)
+        assert len({body for _, _, body in responses}) == 1
+
+    def test_lifespan_opens_connections_on_startup_and_closes_them_on_shutdown(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = list()
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.async_app({'type': 'lifespan'}, receive, send))
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+        assert self.async_app.db_pool._idle.qsize() == 0
+
+    def test_stats_os_returns_pages_as_newline_delimited_json_when_accepted(self):
+        status, headers, body = get(self.async_app, '/stats/os', b'limit=1&cursor=1',
+                                    headers=[('Accept', 'application/x-ndjson')])
+        assert status == 200
+        assert headers['Content-Type'] == 'application/x-ndjson'
+        assert body == b'["Windows","33.33%"]\n'
+
+    def test_stats_os_pages_link_the_next_page_like_the_flask_app(self):
+        api_client = self.app.test_client()
+        for query_string in ['limit=1', 'limit=1&cursor=1', 'limit=1&cursor=2', 'limit=5',
+                             'start_date=2014-10-12T17:00:00Z&end_date=2014-10-12T19:00:00Z&limit=2']:
+            status, headers, body = get(self.async_app, '/stats/os', query_string.encode())
+            response = api_client.get('/stats/os?' + query_string)
+            assert status == 200
+            assert headers.get('Link') == response.headers.get('Link')
+            assert json.loads(body) == json.loads(response.data)
+        assert get(self.async_app, '/stats/os', b'limit=1')[1]['Link'] == '</stats/os?limit=1&cursor=1>; rel="next"'
+        assert 'Link' not in get(self.async_app, '/stats/os', b'limit=1&cursor=2')[1]
+        assert 'Link' not in get(self.async_app, '/stats/os', b'limit=5')[1]
+        assert 'Link' not in get(self.async_app, '/stats/os')[1]
@@ -0,0 +1,40 @@
+from benchmarks import synthetic_logs, run_benchmarks
+from src import extract_file
+
+
+def test_generate_rows_is_deterministic_for_a_given_seed():
+    assert list(synthetic_logs.generate_rows(50, seed=1)) == list(synthetic_logs.generate_rows(50, seed=1))
+    assert list(synthetic_logs.generate_rows(50, seed=1)) != list(synthetic_logs.generate_rows(50, seed=2))
+
+
+def test_generate_rows_respects_user_agent_and_ip_cardinality():
+    rows = list(synthetic_logs.generate_rows(2000, ua_cardinality=7, ip_cardinality=11, duplicate_rate=0))
+
+    assert len(set(row[5] for row in rows)) <= 7
+    assert len(set(row[4] for row in rows)) <= 11
+    assert len(set(rows)) == 2000
+
+
+def test_generate_rows_generates_duplicates_at_duplicate_rate():
+    rows = list(synthetic_logs.generate_rows(2000, duplicate_rate=0.5))
+
+    assert 800 < 2000 - len(set(rows)) < 1200
+
+
+def test_write_tsv_gz_writes_file_readable_by_get_file(tmp_path):
+    path = str(tmp_path / 'logs.tsv.gz')
+    synthetic_logs.write_tsv_gz(path, 100, duplicate_rate=0)
+    df = extract_file.get_file(path)
+
+    assert df.shape[0] == 100
+    assert list(df.columns) == ['timestamp', 'user_id', 'url', 'ip', 'user_agent_string', 'raw_event']
+
+
+def test_run_benchmarks_reports_every_stage(tmp_path):
+    path = str(tmp_path / 'logs.tsv.gz')
+    synthetic_logs.write_tsv_gz(path, 200, duplicate_rate=0)
+    results = run_benchmarks.run_benchmarks(path, str(tmp_path / 'events.sqlite'))
+
+    assert list(results) == ['get_file', 'parse_user_agent_string', 'parse_ip', 'count_countries_cities',
+                             'create_table', 'query_table']
+    assert all(stage['rows'] == 200 and stage['seconds'] >= 0 for stage in results.values())
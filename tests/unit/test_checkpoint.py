@@ -0,0 +1,89 @@
+from src import checkpoint, extract_file, etl
+from docs import config
+from click.testing import CliRunner
+from unittest.mock import patch
+import pandas as pd
+import pytest
+import os
+
+
+@pytest.fixture()
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CHECKPOINT_DIR', str(tmp_path / 'checkpoints'))
+
+    yield tmp_path / 'checkpoints'
+
+
+@pytest.fixture()
+def some_source(tmp_path, some_raw_tsv_gz):
+    path = tmp_path / 'logs' / 'a.tsv.gz'
+    path.parent.mkdir()
+    path.write_bytes(some_raw_tsv_gz)
+
+    yield path
+
+
+def test_source_digest_changes_only_with_the_content(some_source, some_raw_tsv_gz):
+    digest = checkpoint.source_digest(str(some_source))
+    assert checkpoint.source_digest(str(some_source.parent)) == digest
+    assert checkpoint.source_digest(content=some_raw_tsv_gz) == digest
+    some_source.write_bytes(some_raw_tsv_gz + b'\n')
+    assert checkpoint.source_digest(str(some_source)) != digest
+
+
+def test_source_digest_returns_none_when_the_source_cannot_be_hashed_before_being_read(tmp_path):
+    assert checkpoint.source_digest(extract_file.STDIN_SOURCE) is None
+    assert checkpoint.source_digest(str(tmp_path / 'missing.tsv.gz')) is None
+    assert checkpoint.source_digest() is None
+
+
+def test_save_checkpoint_round_trips_the_enriched_dataframe(checkpoint_dir, some_raw_df):
+    df = etl.transform_chunk(extract_file.prepare_events(some_raw_df))
+    checkpoint.save_checkpoint(df, 'abc')
+    loaded = checkpoint.load_checkpoint('abc')
+    pd.testing.assert_frame_equal(loaded, df.reset_index(drop=True))
+    assert isinstance(loaded['browser'].dtype, pd.CategoricalDtype)
+    assert list(checkpoint_dir.iterdir()) == [checkpoint_dir / 'abc.feather']
+
+
+def test_load_checkpoint_returns_none_when_not_checkpointed_or_disabled(checkpoint_dir, monkeypatch, some_raw_df):
+    assert checkpoint.load_checkpoint('abc') is None
+    checkpoint.save_checkpoint(extract_file.prepare_events(some_raw_df), 'abc')
+    monkeypatch.setattr(config, 'CHECKPOINT_DIR', None)
+    assert checkpoint.load_checkpoint('abc') is None
+
+
+def test_save_checkpoint_removes_the_least_recently_used_checkpoints(checkpoint_dir, monkeypatch, some_raw_df):
+    monkeypatch.setattr(config, 'CHECKPOINT_MAX_FILES', 2)
+    df = extract_file.prepare_events(some_raw_df)
+    for i, digest in enumerate(['a', 'b']):
+        checkpoint.save_checkpoint(df, digest)
+        os.utime(checkpoint_dir / '{}.feather'.format(digest), (i, i))
+    assert checkpoint.load_checkpoint('a') is not None
+    checkpoint.save_checkpoint(df, 'c')
+    assert sorted(path.name for path in checkpoint_dir.iterdir()) == ['a.feather', 'c.feather']
+    assert checkpoint.load_checkpoint('b') is None
+
+
+def test_stdout_and_api_reuse_the_checkpoint_of_the_same_source(checkpoint_dir, some_source):
+    runner = CliRunner()
+    first = runner.invoke(etl.main, ['--stdout', '--input', str(some_source)])
+    assert first.exit_code == 0
+    with patch('src.extract_file.get_file') as mock_get_file:
+        second = runner.invoke(etl.main, ['--stdout', '--input', str(some_source)])
+        assert second.exit_code == 0
+        assert not mock_get_file.called
+        with patch('src.database_connection.main') as mock_database_connection, patch('src.app.create_app'):
+            api = runner.invoke(etl.main, ['--api', '--input', str(some_source)])
+            assert api.exit_code == 0
+            assert not mock_get_file.called
+            assert mock_database_connection.call_args.args[0].shape[0] == 3
+    assert second.output.split('\n\n ')[0] == first.output.split('\n\n ')[0]
+
+
+def test_top_lists_match_the_parse_functions_top_lists(some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+    _, top_browsers_sorted_lst, top_os_sorted_lst = etl.parse_user_agent_string(df.copy())
+    _, top_countries_sorted_lst, top_cities_sorted_lst = etl.parse_ip(df.copy())
+    assert etl.top_lists(etl.transform_chunk(df)) == (top_browsers_sorted_lst, top_os_sorted_lst,
+                                                      top_countries_sorted_lst, top_cities_sorted_lst)
@@ -1,9 +1,12 @@
 from unittest import TestCase
 import sqlite3
+import tempfile
+import os
 from src import database_connection
 from unittest.mock import patch
 import pandas as pd
 import io
+from werkzeug.exceptions import InternalServerError
 
 
 class TestDB(TestCase):
@@ -32,6 +35,12 @@ class TestDB(TestCase):
     def tearDown(self):
         self.conn.close()
 
+    def copy(self):
+        # The queries close the connection they are given, they get a copy of the in-memory database instead
+        conn = sqlite3.connect(':memory:')
+        self.conn.backup(conn)
+        return conn
+
     def test_create_database_connection_returns_a_valid_sqlite3_connection_object(self):
         assert isinstance(database_connection.create_database_connection(":memory:"), sqlite3.Connection)
 
@@ -50,6 +59,77 @@ class TestDB(TestCase):
         result = c.fetchall()
         assert result[0] == ('Mobile Safari', '66.67%')
 
+    def test_create_table_inserts_only_new_events_when_if_exists_is_append(self):
+        database_connection.create_table(self.conn, self.df.iloc[:2])
+        inserted = database_connection.create_table(self.conn, self.df)
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM events_log")
+
+        assert inserted == 1
+        assert c.fetchone()[0] == 3
+
+    def test_create_table_reloads_table_with_df_when_if_exists_is_replace(self):
+        database_connection.create_table(self.conn, self.df)
+        database_connection.create_table(self.conn, self.df.iloc[:1], if_exists="replace")
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM events_log")
+
+        assert c.fetchone()[0] == 1
+
+    def test_create_table_stores_timestamps_as_sqlite_datetime_strings(self):
+        df = self.df.assign(timestamp=pd.to_datetime(self.df['timestamp']))
+        database_connection.create_table(self.conn, df)
+        c = self.conn.cursor()
+        c.execute("SELECT MIN(timestamp) FROM events_log")
+
+        assert c.fetchone()[0] == '2014-10-12 17:01:01'
+
+    def test_create_table_rolls_back_whole_load_when_an_insert_fails(self):
+        events_log_rows = database_connection.events_log_rows
+
+        def failing_rows(df):
+            yield next(events_log_rows(df))
+            raise sqlite3.Error('disk I/O error')
+
+        database_connection.create_table(self.conn, self.df.iloc[:1])
+        with patch('src.database_connection.events_log_rows', failing_rows):
+            database_connection.create_table(self.conn, self.df.iloc[1:])
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM events_log")
+
+        assert c.fetchone()[0] == 1
+
+    def test_create_table_creates_timestamp_breakdown_indexes(self):
+        database_connection.create_table(self.conn, self.df)
+        c = self.conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='events_log' AND sql IS NOT NULL")
+
+        assert sorted(i[0] for i in c.fetchall()) == ['events_log_timestamp_browser', 'events_log_timestamp_device',
+                                                      'events_log_timestamp_os']
+
+    def test_query_table_time_frame_query_is_a_covering_index_range_scan(self):
+        database_connection.create_table(self.conn, self.df)
+        c = self.conn.cursor()
+        c.execute("EXPLAIN QUERY PLAN SELECT os, COUNT(*) FROM events_log "
+                  "WHERE timestamp > '2014-10-12 17:01:01' AND timestamp < '2014-10-12 17:01:06' GROUP BY os")
+
+        assert any('COVERING INDEX events_log_timestamp_os' in row[3] for row in c.fetchall())
+
+    def test_query_table_percentages_add_up_to_one_hundred(self):
+        database_connection.create_table(self.conn, self.df)
+        result = database_connection.query_table(self.conn, 'os')
+
+        assert result == [('iOS', '66.67%'), ('Android', '33.33%')]
+
+    def test_format_percentage_rounds_like_the_breakdown_query(self):
+        conn = sqlite3.connect(':memory:')
+        for total in range(1, 200):
+            for events in range(total + 1):
+                expected = conn.execute("SELECT ROUND(? / CAST(? AS float) * 100.0, 2) || '%'",
+                                        (events, total)).fetchone()[0]
+                assert database_connection.format_percentage(events, total) == expected
+        conn.close()
+
     def test_query_table_queries_table_when_no_time_frame_indicated(self):
         database_connection.create_table(self.conn, self.df)
         result = database_connection.query_table(self.conn, 'browser')
@@ -68,6 +148,173 @@ class TestDB(TestCase):
 
         assert result is None
 
+    def test_query_table_returns_the_page_of_the_breakdown(self):
+        database_connection.create_table(self.conn, self.df)
+        result = database_connection.query_table(self.conn, 'os', limit=1, offset=1)
+
+        assert result == [('Android', '33.33%')]
+
+    def test_batch_breakdowns_return_the_same_percentages_and_order_as_query_table(self):
+        df = pd.concat([self.df[:1]] * 32, ignore_index=True).assign(raw_event=[str(i) for i in range(32)],
+                                                                     browser=['Safari', 'IE'] + ['Chrome'] * 30,
+                                                                     os=['Android', 'iOS'] + ['iOS'] * 30)
+        database_connection.create_table(self.conn, df)
+        # Counted by os first, so Safari comes before IE in the counts
+        counts = database_connection.query_batch(self.copy(), ['os', 'browser'])
+        expected = database_connection.query_table(self.conn, 'browser')
+
+        assert expected == [('Chrome', '93.75%'), ('IE', '3.13%'), ('Safari', '3.13%')]
+        assert database_connection.batch_breakdowns(counts, [['browser']])['browser'] == [list(row) for row in expected]
+
+    def test_iter_query_table_yields_the_rows_in_batches_and_closes_the_connection(self):
+        database_connection.create_table(self.conn, self.df)
+        batches = list(database_connection.iter_query_table(self.conn, 'browser', batch_rows=1))
+
+        assert batches == [[('Mobile Safari', '66.67%')], [('Chrome Mobile', '33.33%')]]
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.conn.cursor()
+
+    def test_create_table_replace_days_reloads_only_the_days_of_df(self):
+        other_day = self.df.assign(timestamp='2014-10-13 10:00:00', raw_event=['4', '5', '6'])
+        database_connection.create_table(self.conn, pd.concat([self.df, other_day]))
+        reprocessed = self.df[:1].assign(browser='Safari')
+        inserted = database_connection.create_table(self.conn, reprocessed, 'replace_days')
+
+        assert inserted == 1
+        assert self.conn.execute("SELECT COUNT(*) FROM events_log").fetchone()[0] == 4
+        assert self.conn.execute("SELECT browser, events FROM events_log_hourly_browser WHERE hour < '2014-10-13'"
+                                 ).fetchall() == [('Safari', 1)]
+
+    def test_create_table_drops_the_days_older_than_the_retention(self):
+        other_day = self.df.assign(timestamp='2014-10-14 10:00:00', raw_event=['4', '5', '6'])
+        database_connection.create_table(self.conn, self.df)
+        with patch('docs.config.RETENTION_DAYS', 2):
+            database_connection.create_table(self.conn, other_day)
+
+        assert self.conn.execute("SELECT COUNT(*) FROM events_log").fetchone()[0] == 3
+        assert self.conn.execute("SELECT MIN(hour) FROM events_log_hourly_os").fetchone()[0] == '2014-10-14 10:00:00'
+
+    def test_create_table_adds_only_new_events_to_hourly_rollups(self):
+        database_connection.create_table(self.conn, self.df.iloc[:2])
+        database_connection.create_table(self.conn, self.df)
+        c = self.conn.cursor()
+        c.execute("SELECT hour, browser, events FROM events_log_hourly_browser ORDER BY browser")
+
+        assert c.fetchall() == [('2014-10-12 17:00:00', 'Chrome Mobile', 1), ('2014-10-12 17:00:00', 'Mobile Safari', 2)]
+
+    def test_create_table_fills_hourly_rollups_with_events_loaded_before_them(self):
+        database_connection.create_table(self.conn, self.df.iloc[:2])
+        self.conn.execute("DROP TABLE events_log_hourly_os")
+        database_connection.create_table(self.conn, self.df)
+        c = self.conn.cursor()
+        c.execute("SELECT os, events FROM events_log_hourly_os ORDER BY os")
+
+        assert c.fetchall() == [('Android', 1), ('iOS', 2)]
+
+    def test_query_table_results_from_rollups_match_events_log_counts(self):
+        hours_df = pd.DataFrame({'timestamp': ['2014-10-12 {:02d}:{:02d}:{:02d}'.format(i % 24, (i * 7) % 60, i % 60)
+                                               for i in range(200)],
+                                 'user_id': 'u', 'url': 'http://url', 'raw_event': [str(i) for i in range(200)],
+                                 'device': 'PC', 'os': ['Windows', 'iOS', 'Android', 'iOS'] * 50,
+                                 'browser': 'IE', 'country': '', 'city': ''})
+        timeframes = [('2014-10-12 00:00:00', '2014-10-12 23:59:59'), ('2014-10-12 03:30:00', '2014-10-12 17:07:00'),
+                      ('2014-10-12 05:00:00', '2014-10-12 06:00:00'), ('2014-10-12 05:10:00', '2014-10-12 05:50:00')]
+
+        # query_table closes the connection, so the table is loaded again for every timeframe
+        for start_date, end_date in timeframes:
+            self.conn = sqlite3.connect(":memory:")
+            database_connection.create_table(self.conn, hours_df)
+            c = self.conn.cursor()
+            c.execute("SELECT os, ROUND(COUNT(*)/CAST(SUM(COUNT(*)) OVER () AS float) * 100.0, 2) || '%' FROM events_log "
+                      "WHERE timestamp > ? AND timestamp < ? GROUP BY os", (start_date, end_date))
+            expected = sorted(c.fetchall())
+            result = database_connection.query_table(self.conn, 'os', start_date, end_date)
+
+            assert sorted(result) == expected
+
+    def test_create_table_bumps_data_version_only_when_new_events_loaded(self):
+        database_connection.create_table(self.conn, self.df)
+        database_connection.create_table(self.conn, self.df)
+
+        assert database_connection.get_data_version(self.conn) == 1
+
+    def test_connection_pool_connections_are_read_only(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'events.sqlite')
+            conn = database_connection.create_database_connection(db_file)
+            database_connection.create_table(conn, self.df)
+            conn.close()
+            pool = database_connection.ConnectionPool(db_file)
+            pooled_conn = pool.connect()
+
+            with self.assertRaises(sqlite3.OperationalError):
+                pooled_conn.execute("DELETE FROM events_log")
+            pooled_conn.close()
+            pool.close()
+
+    def test_connection_pool_reuses_connection_returned_by_query_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'events.sqlite')
+            conn = database_connection.create_database_connection(db_file)
+            database_connection.create_table(conn, self.df)
+            conn.close()
+            pool = database_connection.ConnectionPool(db_file, size=1)
+            pooled_conn = pool.connect()
+            raw_conn = pooled_conn._conn
+
+            assert database_connection.query_table(pooled_conn, 'browser')[0] == ('Mobile Safari', '66.67%')
+            assert pool.connect()._conn is raw_conn
+            pool.close()
+
+    def test_connection_pool_returns_none_when_database_does_not_exist(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = database_connection.ConnectionPool(os.path.join(tmp_dir, 'missing.sqlite'))
+
+            assert pool.connect() is None
+
+    def test_connection_pool_warm_opens_idle_connections_up_to_its_size(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'events.sqlite')
+            conn = database_connection.create_database_connection(db_file)
+            database_connection.create_table(conn, self.df)
+            conn.close()
+            pool = database_connection.ConnectionPool(db_file, size=2)
+
+            assert pool.warm(1) == 1
+            assert pool.warm() == 1
+            assert pool.warm() == 0
+            pool.close()
+
+    def test_connection_pool_warm_opens_nothing_when_database_does_not_exist(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pool = database_connection.ConnectionPool(os.path.join(tmp_dir, 'missing.sqlite'))
+
+            assert pool.warm() == 0
+
+    def test_breakdown_statement_binds_the_timeframe_to_the_same_statement_whatever_the_dates(self):
+        statement, params = database_connection.breakdown_statement('os', '2014-10-12 17:01:01', '2014-10-12 19:30:00')
+        other_statement, _ = database_connection.breakdown_statement('os', '2015-01-01 00:00:00', '2015-02-01 00:00:00')
+
+        assert statement == other_statement
+        assert '2014' not in statement
+        assert params == ('2014-10-12 18:00:00', '2014-10-12 19:00:00', '2014-10-12 17:01:01', '2014-10-12 18:00:00',
+                          '2014-10-12 19:00:00', '2014-10-12 19:30:00', -1, 0)
+
+    def test_breakdown_statement_reads_only_events_log_when_timeframe_within_an_hour(self):
+        statement, params = database_connection.breakdown_statement('os', '2014-10-12 17:01:01', '2014-10-12 17:30:00')
+
+        assert 'events_log_hourly_os' not in statement
+        assert params == ('2014-10-12 17:01:01', '2014-10-12 17:30:00', -1, 0)
+
+    def test_query_table_raises_value_error_when_breakdown_is_not_whitelisted(self):
+        database_connection.create_table(self.conn, self.df)
+        with self.assertRaises(ValueError):
+            database_connection.query_table(self.conn, 'os FROM events_log; DROP TABLE events_log; --')
+
+    def test_query_table_raises_internal_server_error_when_connection_is_none(self):
+        with self.assertRaises(InternalServerError):
+            database_connection.query_table(None, 'browser')
+
     @patch('src.database_connection.create_table')
     def test_main_calls_create_table_when_connection_is_not_none(self, mock_create_table):
         with patch('src.database_connection.create_database_connection'):
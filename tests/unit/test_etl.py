@@ -1,13 +1,15 @@
-from src import etl
+import gzip
+from src import etl, extract_file
+from src.transform_ip import count_countries_cities
 from click.testing import CliRunner
 from unittest.mock import patch
 
 
 @patch('src.extract_file.get_file')
-@patch('src.transform_ua.parse_user_agent_string')
-@patch('src.transform_ip.parse_ip')
-def test_top_five_metrics_generated_when_stdout_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
-                                                                       mock_parse_ip):
+@patch('src.etl.transform_chunk')
+@patch('src.etl.top_lists', return_value=([], [], [], []))
+def test_top_five_metrics_generated_when_stdout_cli_argument_indicated(mock_get_file, mock_transform_chunk,
+                                                                       mock_top_lists):
     runner = CliRunner()
     result = runner.invoke(etl.main, ['--stdout', '-s'])
     assert result.exit_code == 0
@@ -32,8 +34,8 @@ def test_app_create_app_not_called_when_api_cli_argument_indicated_and_df_equal_
 
 
 @patch('src.extract_file.get_file')
-@patch('src.transform_ua.parse_user_agent_string')
-@patch('src.transform_ip.parse_ip')
+@patch('src.etl.parse_user_agent_string')
+@patch('src.etl.parse_ip')
 @patch('src.database_connection.main')
 @patch('src.app.create_app')
 def test_top_five_metrics_not_generated_when_api_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
@@ -46,11 +48,11 @@ def test_top_five_metrics_not_generated_when_api_cli_argument_indicated(mock_get
 
 
 @patch('src.extract_file.get_file')
-@patch('src.transform_ua.parse_user_agent_string')
-@patch('src.transform_ip.parse_ip')
+@patch('src.etl.transform_chunk')
+@patch('src.etl.top_lists', return_value=([], [], [], []))
 @patch('src.database_connection.main')
-def test_app_create_app_not_called_when_stdout_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
-                                                                      mock_parse_ip, mock_database_connection):
+def test_app_create_app_not_called_when_stdout_cli_argument_indicated(mock_get_file, mock_transform_chunk,
+                                                                      mock_top_lists, mock_database_connection):
     with patch('src.app.create_app') as mock_app_create_app:
         runner = CliRunner()
         result = runner.invoke(etl.main, ['--stdout', '-s'])
@@ -59,11 +61,11 @@ def test_app_create_app_not_called_when_stdout_cli_argument_indicated(mock_get_f
 
 
 @patch('src.extract_file.get_file')
-@patch('src.transform_ua.parse_user_agent_string')
-@patch('src.transform_ip.parse_ip')
+@patch('src.etl.transform_chunk')
+@patch('src.etl.top_lists', return_value=([], [], [], []))
 @patch('src.app.create_app')
-def test_database_connection_not_called_when_stdout_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
-                                                                           mock_parse_ip, mock_app_create_app):
+def test_database_connection_not_called_when_stdout_cli_argument_indicated(mock_get_file, mock_transform_chunk,
+                                                                           mock_top_lists, mock_app_create_app):
     with patch('src.database_connection.main') as mock_database_connection:
         runner = CliRunner()
         result = runner.invoke(etl.main, ['--stdout', '-s'])
@@ -72,8 +74,8 @@ def test_database_connection_not_called_when_stdout_cli_argument_indicated(mock_
 
 
 @patch('src.extract_file.get_file')
-@patch('src.transform_ua.parse_user_agent_string')
-@patch('src.transform_ip.parse_ip')
+@patch('src.etl.parse_user_agent_string')
+@patch('src.etl.parse_ip')
 @patch('src.app.create_app')
 def test_database_connection_called_when_api_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
                                                                     mock_parse_ip, mock_app_create_app):
@@ -85,13 +87,174 @@ def test_database_connection_called_when_api_cli_argument_indicated(mock_get_fil
 
 
 @patch('src.extract_file.get_file')
-@patch('src.transform_ua.parse_user_agent_string')
-@patch('src.transform_ip.parse_ip')
+@patch('src.etl.parse_user_agent_string')
+@patch('src.etl.parse_ip')
 @patch('src.database_connection.main')
-def test_app_create_app_called_when_api_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
-                                                               mock_parse_ip, mock_database_connection):
+def test_app_create_app_not_called_when_api_cli_argument_indicated(mock_get_file, mock_parse_user_agent_string,
+                                                                   mock_parse_ip, mock_database_connection):
     with patch('src.app.create_app') as mock_app_create_app:
         runner = CliRunner()
         result = runner.invoke(etl.main, ['--api', '-a'])
         assert result.exit_code == 0
-        mock_app_create_app.assert_called_once()
+        assert not mock_app_create_app.called
+
+
+@patch('src.extract_file.get_file_chunks', return_value=iter([]))
+def test_get_file_not_called_when_chunksize_cli_argument_indicated(mock_get_file_chunks):
+    with patch('src.extract_file.get_file') as mock_get_file:
+        runner = CliRunner()
+        result = runner.invoke(etl.main, ['--stdout', '--chunksize', '10'])
+        assert result.exit_code == 0
+        assert not mock_get_file.called
+        mock_get_file_chunks.assert_called_once_with(10, None)
+
+
+@patch('src.extract_file.get_file_chunks')
+@patch('src.etl.transform_chunk', side_effect=lambda df: df)
+@patch('src.app.create_app')
+def test_every_chunk_loaded_when_api_and_chunksize_cli_arguments_indicated(mock_app_create_app, mock_transform_chunk,
+                                                                          mock_get_file_chunks, some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+    mock_get_file_chunks.return_value = iter([df.iloc[:2], df.iloc[2:]])
+    with patch('src.database_connection.main') as mock_database_connection:
+        runner = CliRunner()
+        result = runner.invoke(etl.main, ['--api', '--chunksize', '2', '--replace'])
+        assert result.exit_code == 0
+        assert [c.args[1] for c in mock_database_connection.call_args_list] == ['replace', 'append']
+        assert not mock_app_create_app.called
+
+
+@patch('src.extract_file.get_file_chunks')
+@patch('src.etl.transform_chunk', side_effect=lambda df: df)
+def test_day_replaced_by_its_first_chunk_only_when_replace_days_and_chunksize_cli_arguments_indicated(
+        mock_transform_chunk, mock_get_file_chunks, some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+    mock_get_file_chunks.return_value = iter([df.iloc[:2], df.iloc[2:]])
+    with patch('src.database_connection.main') as mock_database_connection:
+        runner = CliRunner()
+        result = runner.invoke(etl.main, ['--api', '--chunksize', '2', '--replace-days'])
+        assert result.exit_code == 0
+        assert [c.args[1] for c in mock_database_connection.call_args_list] == ['replace_days', 'append']
+
+
+def test_replace_and_replace_days_cli_arguments_cannot_be_indicated_together():
+    runner = CliRunner()
+    result = runner.invoke(etl.main, ['--api', '--replace', '--replace-days'])
+    assert result.exit_code != 0
+
+
+@patch('src.extract_file.get_file', return_value=None)
+def test_get_file_called_with_input_cli_argument_when_indicated(mock_get_file):
+    runner = CliRunner()
+    result = runner.invoke(etl.main, ['--stdout', '--input', 'logs/*.tsv.gz'])
+    assert result.exit_code == 0
+    mock_get_file.assert_called_once_with('logs/*.tsv.gz')
+
+
+@patch('src.extract_file.get_file')
+@patch('src.etl.parse_user_agent_string')
+@patch('src.etl.parse_ip')
+@patch('src.app.create_app')
+def test_database_connection_appends_new_events_when_api_cli_argument_indicated(mock_app_create_app, mock_parse_ip,
+                                                                                mock_parse_user_agent_string,
+                                                                                mock_get_file):
+    with patch('src.database_connection.main') as mock_database_connection:
+        runner = CliRunner()
+        result = runner.invoke(etl.main, ['--api'])
+        assert result.exit_code == 0
+        assert mock_database_connection.call_args.args[1] == 'append'
+
+
+@patch('src.extract_file.get_file_chunks')
+def test_chunked_top_lists_match_whole_file_top_lists_when_stdout_top_and_chunksize_cli_arguments_indicated(
+        mock_get_file_chunks, some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+    top_countries_sorted_lst, top_cities_sorted_lst = count_countries_cities(etl.transform_chunk(df.copy()), 2)
+    mock_get_file_chunks.return_value = iter([df.iloc[:2].copy(), df.iloc[2:].copy()])
+    runner = CliRunner()
+    result = runner.invoke(etl.main, ['--stdout', '--chunksize', '2', '--top', '2'])
+    assert result.exit_code == 0
+    assert 'Top 2 cities based on num of events' in result.output
+    countries_output = result.output.split('Top 2 countries based on num of events:\n')[1].split('\nTop 2 cities')[0]
+    assert countries_output.split() == ' '.join(i[1] for i in top_countries_sorted_lst).split()
+
+
+def test_workers_print_the_same_top_lists_as_a_single_process(tmp_path, some_raw_tsv_gz):
+    path = tmp_path / 'logs.tsv.gz'
+    path.write_bytes(some_raw_tsv_gz)
+    runner = CliRunner()
+    single = runner.invoke(etl.main, ['--stdout', '--chunksize', '2', '--input', str(path)])
+    workers = runner.invoke(etl.main, ['--stdout', '--chunksize', '2', '--workers', '2', '--input', str(path)])
+    assert single.exit_code == 0
+    assert workers.exit_code == 0
+    assert workers.output.split('\n\n ')[0] == single.output.split('\n\n ')[0]
+
+
+def test_whole_file_prints_the_same_top_lists_as_chunks(tmp_path, some_raw_df):
+    # Users seen twice still count as unique users of their browser
+    raw_df = some_raw_df.iloc[[1, 1, 1, 1, 0, 2]].assign(user_id=['a', 'a', 'b', 'b', 'c', 'd'],
+                                                          time=['17:01:01', '17:02:01'] * 3)
+    path = tmp_path / 'logs.tsv.gz'
+    path.write_bytes(gzip.compress(raw_df.to_csv(sep='\t', header=False, index=False).encode()))
+    runner = CliRunner()
+    whole = runner.invoke(etl.main, ['--stdout', '--input', str(path)])
+    chunks = runner.invoke(etl.main, ['--stdout', '--chunksize', '2', '--input', str(path)])
+    assert whole.exit_code == 0
+    assert chunks.exit_code == 0
+    assert whole.output.split('based on num of unique users:\n\n')[1].split('\n')[0] == 'Firefox'
+    assert whole.output.split('\n\n ')[0] == chunks.output.split('\n\n ')[0]
+
+
+@patch('src.app.create_app')
+def test_workers_send_every_chunk_to_a_single_writer(mock_app_create_app, tmp_path, some_raw_tsv_gz):
+    path = tmp_path / 'logs.tsv.gz'
+    path.write_bytes(some_raw_tsv_gz)
+    runner = CliRunner()
+    with patch('src.database_connection.main') as mock_database_connection:
+        result = runner.invoke(etl.main, ['--api', '--chunksize', '2', '--input', str(path)])
+        assert result.exit_code == 0
+        single = [c.args[0] for c in mock_database_connection.call_args_list]
+    with patch('src.database_connection.main') as mock_database_connection:
+        result = runner.invoke(etl.main, ['--api', '--workers', '2', '--chunksize', '2', '--input', str(path)])
+        assert result.exit_code == 0
+        workers = [c.args[0] for c in mock_database_connection.call_args_list]
+    assert len(workers) == len(single)
+    for workers_df, single_df in zip(workers, single):
+        assert workers_df['raw_event'].tolist() == single_df['raw_event'].tolist()
+        assert workers_df['country'].tolist() == single_df['country'].tolist()
+        assert workers_df['browser'].tolist() == single_df['browser'].tolist()
+
+
+@patch('src.app.create_app')
+def test_file_extracted_and_enriched_once_when_stdout_and_api_cli_arguments_indicated(mock_app_create_app,
+                                                                                       some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+    with patch('src.extract_file.get_file', return_value=df) as mock_get_file, \
+            patch('src.etl.transform_chunk', side_effect=etl.transform_chunk) as mock_transform_chunk, \
+            patch('src.database_connection.main') as mock_database_connection:
+        runner = CliRunner()
+        result = runner.invoke(etl.main, ['--stdout', '--api'])
+        assert result.exit_code == 0
+        assert 'Top 5 cities based on num of events' in result.output
+        mock_get_file.assert_called_once()
+        mock_transform_chunk.assert_called_once()
+        mock_database_connection.assert_called_once()
+        assert not mock_app_create_app.called
+
+
+@patch('src.app.create_app')
+def test_every_chunk_transformed_once_when_stdout_api_and_chunksize_cli_arguments_indicated(mock_app_create_app,
+                                                                                             some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+    with patch('src.extract_file.get_file_chunks', return_value=iter([df.iloc[:2].copy(), df.iloc[2:].copy()])) \
+            as mock_get_file_chunks, \
+            patch('src.etl.transform_chunk', side_effect=etl.transform_chunk) as mock_transform_chunk, \
+            patch('src.database_connection.main') as mock_database_connection:
+        runner = CliRunner()
+        result = runner.invoke(etl.main, ['--stdout', '--api', '--chunksize', '2'])
+        assert result.exit_code == 0
+        assert 'Top 5 cities based on num of events' in result.output
+        mock_get_file_chunks.assert_called_once()
+        assert mock_transform_chunk.call_count == 2
+        assert mock_database_connection.call_count == 2
+        assert not mock_app_create_app.called
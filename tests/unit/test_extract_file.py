@@ -2,6 +2,8 @@ from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from src import extract_file
 import pandas as pd
+import gzip
+import io
 
 
 class Test(TestCase):
@@ -19,8 +21,123 @@ def test_get_file_returns_none_if_bad_download_url_provided():
 def test_get_file_returns_df_if_valid_file_in_drive(some_raw_df):
     mock_open_gz = MagicMock(name="df_generator")
     mock_open_gz.return_value = some_raw_df
-    extract_file.open_gzip_read_tsv = mock_open_gz
-    with patch('requests.get') as mock_request:
+    with patch('src.extract_file.open_gzip_read_tsv', mock_open_gz), patch('requests.get') as mock_request:
         mock_request.return_value.status_code = 200
         mock_request.return_value.content = "Fake content".encode()
         assert isinstance(extract_file.get_file(), pd.DataFrame)
+
+
+def test_get_file_chunks_yields_nothing_if_bad_download_url_provided():
+    with patch('requests.get') as mock_request:
+        mock_request.return_value.__enter__.return_value.status_code = 404
+        assert list(extract_file.get_file_chunks(2)) == []
+
+
+def test_get_file_chunks_yields_dataframes_of_at_most_chunksize_rows(some_raw_tsv_gz):
+    with patch('requests.get') as mock_request:
+        mock_request.return_value.__enter__.return_value.status_code = 200
+        mock_request.return_value.__enter__.return_value.raw = io.BytesIO(some_raw_tsv_gz)
+        chunks = list(extract_file.get_file_chunks(2))
+
+    assert [chunk.shape[0] for chunk in chunks] == [2, 1]
+    assert list(chunks[0].columns) == ['timestamp', 'user_id', 'url', 'ip', 'user_agent_string', 'raw_event']
+
+
+def test_open_gzip_read_tsv_chunks_reads_every_row_once(some_raw_tsv_gz):
+    chunks = list(extract_file.open_gzip_read_tsv_chunks(io.BytesIO(some_raw_tsv_gz), 2))
+
+    assert pd.concat(chunks).shape == (3, 6)
+
+
+def test_prepare_events_parses_date_and_time_into_timestamp(some_raw_df):
+    df = extract_file.prepare_events(some_raw_df)
+
+    assert 'time' not in df.columns
+    assert str(df['timestamp'][0]) == '2014-10-12 17:01:01'
+
+
+def test_get_file_reads_local_gzip_file_without_downloading(tmp_path, some_raw_tsv_gz):
+    path = tmp_path / 'events.tsv.gz'
+    path.write_bytes(some_raw_tsv_gz)
+    with patch('requests.get') as mock_request:
+        df = extract_file.get_file(str(path))
+        assert not mock_request.called
+
+    assert df.shape[0] == 3
+
+
+def test_get_file_reads_local_plain_file(tmp_path, some_raw_tsv_gz):
+    path = tmp_path / 'events.tsv'
+    path.write_bytes(gzip.decompress(some_raw_tsv_gz))
+
+    assert extract_file.get_file(str(path)).shape[0] == 3
+
+
+def test_get_file_reads_every_file_of_a_directory(tmp_path, some_raw_tsv_gz):
+    (tmp_path / 'a.tsv.gz').write_bytes(some_raw_tsv_gz)
+    (tmp_path / 'b.tsv').write_bytes(gzip.decompress(some_raw_tsv_gz).replace(b'2014-10-12', b'2014-10-13'))
+    (tmp_path / 'empty.tsv').write_bytes(b'')
+
+    assert extract_file.get_file(str(tmp_path)).shape[0] == 6
+
+
+def test_get_file_keeps_the_categories_of_files_with_different_ones(tmp_path, some_raw_df):
+    for name, rows in [('a.tsv', some_raw_df.iloc[:2]), ('b.tsv', some_raw_df.iloc[2:])]:
+        rows.to_csv(tmp_path / name, sep='\t', header=False, index=False)
+
+    df = extract_file.get_file(str(tmp_path))
+    assert isinstance(df['user_agent_string'].dtype, pd.CategoricalDtype)
+    assert isinstance(df['ip'].dtype, pd.CategoricalDtype)
+    assert list(df['user_agent_string']) == list(some_raw_df['user_agent_string'])
+
+
+def test_get_file_returns_none_if_no_local_file_matches(tmp_path):
+    assert extract_file.get_file(str(tmp_path / '*.tsv.gz')) is None
+
+
+def test_get_file_chunks_reads_local_files_matching_a_glob_pattern(tmp_path, some_raw_tsv_gz):
+    (tmp_path / 'a.tsv.gz').write_bytes(some_raw_tsv_gz)
+    (tmp_path / 'b.tsv.gz').write_bytes(some_raw_tsv_gz)
+    (tmp_path / 'c.txt').write_bytes(some_raw_tsv_gz)
+    chunks = list(extract_file.get_file_chunks(2, str(tmp_path / '*.tsv.gz')))
+
+    assert [chunk.shape[0] for chunk in chunks] == [2, 1, 2, 1]
+
+
+def test_get_file_reads_stdin_when_dash_indicated(some_raw_tsv_gz):
+    stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(some_raw_tsv_gz)))
+    with patch('sys.stdin', stdin):
+        assert extract_file.get_file('-').shape[0] == 3
+
+
+def test_is_gzip_does_not_consume_the_stream(some_raw_tsv_gz):
+    file_obj = io.BytesIO(some_raw_tsv_gz)
+
+    assert extract_file.is_gzip(file_obj)
+    assert file_obj.read() == some_raw_tsv_gz
+
+
+def test_prepare_events_drops_duplicated_events_by_raw_event_key(some_raw_df):
+    df = extract_file.prepare_events(pd.concat([some_raw_df, some_raw_df.iloc[[1]]], ignore_index=True))
+
+    assert df.shape[0] == 3
+    assert df['raw_event'].dtype == 'int64'
+    assert df['raw_event'].is_unique
+
+
+def test_event_keys_differ_when_any_column_differs(some_raw_df):
+    other_df = some_raw_df.assign(url=some_raw_df['url'][0])
+    keys = extract_file.event_keys(some_raw_df)
+
+    assert list(keys == extract_file.event_keys(some_raw_df.copy())) == [True, True, True]
+    assert list(keys == extract_file.event_keys(other_df)) == [True, False, False]
+
+
+def test_get_file_reads_low_cardinality_columns_as_categories(tmp_path, some_raw_tsv_gz):
+    path = tmp_path / 'events.tsv.gz'
+    path.write_bytes(some_raw_tsv_gz)
+    df = extract_file.get_file(str(path))
+
+    assert df['ip'].dtype == 'category'
+    assert df['user_agent_string'].dtype == 'category'
+    assert df['user_id'].dtype == extract_file.STRING_DTYPE
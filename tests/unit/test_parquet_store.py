@@ -0,0 +1,199 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+from src import database_connection, parquet_store
+from werkzeug.exceptions import InternalServerError
+
+
+def some_events(rows, seed=0, hours=4, first_event=0, start='2014-10-12 16:00:00'):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, hours * 3600, rows), unit='s')
+    return pd.DataFrame({'raw_event': np.arange(first_event, first_event + rows, dtype='int64'),
+                         'timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S'),
+                         'user_id': rng.choice(['a', 'b', 'c'], rows), 'url': 'u',
+                         'device': rng.choice(['iPad', 'PC', 'iPhone', None], rows),
+                         'os': rng.choice(['iOS', 'Windows', 'Mac OS X', 'Android'], rows),
+                         'browser': rng.choice(['Mobile Safari', 'IE', 'Chrome', 'Firefox', 'Safari'], rows),
+                         'country': rng.choice(['United Kingdom', 'Spain', ''], rows),
+                         'city': rng.choice(['Jarrow', 'Valladolid', 'Manchester'], rows)})
+
+
+class TestParquetStore(TestCase):
+    timeframes = [(None, None), ('2014-10-12 16:30:00', '2014-10-12 18:15:00'),
+                  ('2014-10-12 17:01:01', '2014-10-12 17:30:00'), ('2014-10-12 17:00:00', '2014-10-12 19:00:00')]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+        self.pool = parquet_store.SnapshotPool(self.directory)
+        self.conn = sqlite3.connect(':memory:')
+        self.df = some_events(2000)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+    def load(self, df, if_exists='append'):
+        database_connection.create_table(self.conn, df, if_exists)
+        return parquet_store.load_events(self.directory, df, if_exists)
+
+    def copy(self):
+        # The queries close the connection they are given, they get a copy of the in-memory database instead
+        conn = sqlite3.connect(':memory:')
+        self.conn.backup(conn)
+        return conn
+
+    def sqlite_query_table(self, *args):
+        return database_connection.query_table(self.copy(), *args)
+
+    def test_query_table_returns_the_same_breakdowns_as_sqlite(self):
+        self.load(self.df)
+        for breakdown in database_connection.BREAKDOWNS:
+            for start_date, end_date in self.timeframes:
+                expected = self.sqlite_query_table(breakdown, start_date, end_date)
+                result = parquet_store.query_table(self.pool.connect(), breakdown, start_date, end_date)
+                assert result == expected
+
+    def test_query_table_returns_the_same_pages_as_sqlite(self):
+        self.load(self.df)
+        for offset in range(5):
+            expected = self.sqlite_query_table('browser', None, None, 2, offset)
+            assert parquet_store.query_table(self.pool.connect(), 'browser', limit=2, offset=offset) == expected
+
+    def test_query_table_rounds_half_way_percentages_like_sqlite(self):
+        self.load(some_events(32).assign(browser=['A'] + ['B'] * 31))
+        expected = self.sqlite_query_table('browser', None, None)
+        assert expected == [('B', '96.88%'), ('A', '3.13%')]
+        assert parquet_store.query_table(self.pool.connect(), 'browser') == expected
+
+    def test_query_table_returns_none_when_no_events_inside_indicated_timeframe(self):
+        self.load(self.df)
+        assert parquet_store.query_table(self.pool.connect(), 'os', '2020-10-12 17:01:08', '2020-10-12 17:01:09') is None
+
+    def test_query_table_raises_value_error_when_breakdown_is_not_whitelisted(self):
+        self.load(self.df)
+        with self.assertRaises(ValueError):
+            parquet_store.query_table(self.pool.connect(), 'os FROM events_log; --')
+
+    def test_query_table_raises_internal_server_error_when_nothing_loaded(self):
+        assert self.pool.connect() is None
+        with self.assertRaises(InternalServerError):
+            parquet_store.query_table(self.pool.connect(), 'browser')
+
+    def test_iter_query_table_yields_the_rows_in_batches(self):
+        self.load(self.df)
+        batches = list(parquet_store.iter_query_table(self.pool.connect(), 'os', batch_rows=3))
+        assert [len(rows) for rows in batches] == [3, 1]
+        assert sum(batches, []) == parquet_store.query_table(self.pool.connect(), 'os')
+
+    def test_query_batch_returns_the_same_counts_as_sqlite(self):
+        self.load(self.df)
+        for bucket in [None, 'hour', 'day']:
+            for start_date, end_date in self.timeframes:
+                columns = ['os', 'country']
+                expected = database_connection.query_batch(self.copy(), columns, bucket, start_date, end_date)
+                result = parquet_store.query_batch(self.pool.connect(), columns, bucket, start_date, end_date)
+                keys = list(expected.columns[:-1])
+                pd.testing.assert_frame_equal(result.sort_values(keys).reset_index(drop=True),
+                                              expected.sort_values(keys).reset_index(drop=True), check_dtype=False)
+
+    def test_load_events_appends_only_new_events_and_bumps_the_data_version(self):
+        assert parquet_store.load_events(self.directory, self.df[:1500]) == 1500
+        version = parquet_store.get_data_version(self.pool.connect())
+        assert parquet_store.load_events(self.directory, self.df[1000:]) == 500
+        assert parquet_store.get_data_version(self.pool.connect()) == version + 1
+        assert parquet_store.load_events(self.directory, self.df) == 0
+        assert parquet_store.get_data_version(self.pool.connect()) == version + 1
+        assert self.pool.connect().dataset.count_rows() == 2000
+
+    def test_load_events_replace_reloads_the_store_and_removes_the_previous_files(self):
+        parquet_store.load_events(self.directory, self.df)
+        assert parquet_store.load_events(self.directory, self.df[:10], 'replace') == 10
+        snapshot = self.pool.connect()
+        assert snapshot.dataset.count_rows() == 10
+        assert len(snapshot.files) == 1
+
+    def test_snapshot_pool_reuses_the_snapshot_while_the_data_version_does_not_change(self):
+        parquet_store.load_events(self.directory, self.df[:10])
+        snapshot = self.pool.connect()
+        assert self.pool.connect() is snapshot
+        parquet_store.load_events(self.directory, self.df[10:20])
+        assert self.pool.connect() is not snapshot
+
+    def test_load_events_writes_a_partition_per_day(self):
+        parquet_store.load_events(self.directory, some_events(500, hours=72))
+        snapshot = self.pool.connect()
+        assert sorted(snapshot.partitions) == ['2014-10-12', '2014-10-13', '2014-10-14', '2014-10-15']
+        assert all(file.startswith('day={}/'.format(day)) for day, files in snapshot.partitions.items()
+                   for file in files)
+
+    def test_timeframe_filter_prunes_the_partitions_outside_the_timeframe(self):
+        parquet_store.load_events(self.directory, some_events(500, hours=72))
+        expression = parquet_store.timeframe_filter('2014-10-13 23:00:00', '2014-10-14 01:00:00')
+        fragments = list(self.pool.connect().dataset.get_fragments(filter=expression))
+        assert sorted(os.path.basename(os.path.dirname(fragment.path)) for fragment in fragments) == \
+            ['day=2014-10-13', 'day=2014-10-14']
+
+    def test_load_events_replace_days_rewrites_only_the_partitions_of_the_days_loaded(self):
+        df = some_events(500, hours=72)
+        self.load(df)
+        files = self.pool.connect().partitions
+        day = df[df['timestamp'].str.startswith('2014-10-13')].assign(browser='Chrome')
+        self.load(day, 'replace_days')
+        partitions = self.pool.connect().partitions
+        assert partitions['2014-10-13'] != files['2014-10-13']
+        assert all(partitions[other] == files[other] for other in ['2014-10-12', '2014-10-14', '2014-10-15'])
+        for start_date, end_date in [(None, None), ('2014-10-12 20:00:00', '2014-10-14 03:00:00')]:
+            expected = self.sqlite_query_table('browser', start_date, end_date)
+            assert parquet_store.query_table(self.pool.connect(), 'browser', start_date, end_date) == expected
+
+    def test_load_events_drops_the_days_older_than_the_retention(self):
+        with patch('docs.config.RETENTION_DAYS', 2):
+            self.load(some_events(500, hours=72))
+        assert sorted(self.pool.connect().partitions) == ['2014-10-14', '2014-10-15']
+        assert parquet_store.query_table(self.pool.connect(), 'os') == self.sqlite_query_table('os')
+
+    def test_load_events_compacts_a_partition_into_one_file_after_max_files_loads(self):
+        with patch('docs.config.PARTITION_MAX_FILES', 3):
+            for load in range(4):
+                parquet_store.load_events(self.directory, some_events(10, seed=load, first_event=10 * load))
+                assert len(self.pool.connect().partitions['2014-10-12']) == [1, 2, 3, 1][load]
+        assert self.pool.connect().dataset.count_rows() == 40
+
+    def test_load_events_removes_the_files_no_longer_used_on_the_next_load(self):
+        parquet_store.load_events(self.directory, self.df[:10])
+        first_files = self.pool.connect().files
+        parquet_store.load_events(self.directory, self.df[10:20], 'replace')
+        assert all(os.path.exists(os.path.join(self.directory, file)) for file in first_files)
+        parquet_store.load_events(self.directory, self.df[20:30])
+        assert not any(os.path.exists(os.path.join(self.directory, file)) for file in first_files)
+
+    def test_load_events_compacts_only_the_newest_files_no_larger_than_the_merged_ones(self):
+        with patch('docs.config.PARTITION_MAX_FILES', 3):
+            first_files = list()
+            for load in range(10):
+                parquet_store.load_events(self.directory, some_events(10, seed=load, first_event=10 * load))
+                files = self.pool.connect().partitions['2014-10-12']
+                assert len(files) == [1, 2, 3, 1, 2, 3, 2, 3, 3, 1][load]
+                first_files.append(files[0])
+        # The file compacted by the fourth load is kept as it is until the newer files merged add up to its size
+        assert len(set(first_files[3:9])) == 1
+        assert self.pool.connect().dataset.count_rows() == 100
+
+    def test_load_events_looks_up_the_loaded_events_in_the_files_of_their_timeframe_only(self):
+        first = some_events(100, hours=1)
+        second = some_events(100, hours=1, first_event=100, start='2014-10-12 18:00:00')
+        parquet_store.load_events(self.directory, first)
+        parquet_store.load_events(self.directory, second)
+        first_file, second_file = self.pool.connect().partitions['2014-10-12']
+        assert parquet_store.overlapping_files(self.directory, [first_file, second_file], '2014-10-12 18:10:00',
+                                               '2014-10-12 20:00:00') == [second_file]
+        with patch('src.parquet_store.partitions_dataset', wraps=parquet_store.partitions_dataset) as mock_dataset:
+            assert parquet_store.load_events(self.directory, pd.concat([second[:50], some_events(
+                10, first_event=200, start='2014-10-12 19:30:00')])) == 10
+            assert mock_dataset.call_args_list[0].args[1] == {'2014-10-12': [second_file]}
+        assert self.pool.connect().dataset.count_rows() == 210
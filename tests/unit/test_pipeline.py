@@ -0,0 +1,67 @@
+from src.pipeline import prefetch, Writer
+import threading
+import pytest
+
+
+def test_prefetch_yields_every_item_in_order():
+    assert list(prefetch(iter(range(10)), 2)) == list(range(10))
+
+
+def test_prefetch_reraises_the_producer_exception_after_the_previous_items():
+    def items():
+        yield 1
+        raise ValueError('broken chunk')
+
+    consumed = list()
+    with pytest.raises(ValueError):
+        for item in prefetch(items(), 2):
+            consumed.append(item)
+    assert consumed == [1]
+
+
+def test_prefetch_producer_stays_at_most_maxsize_items_ahead():
+    produced = list()
+
+    def items():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    prefetched = prefetch(items(), 2)
+    assert next(prefetched) == 0
+    threading.Event().wait(0.2)
+    # maxsize items queued plus the one the producer waits to queue
+    assert len(produced) <= 4
+    prefetched.close()
+    assert len(produced) < 100
+
+
+def test_writer_writes_every_item_in_order_from_a_single_thread():
+    written = list()
+    threads = set()
+
+    def write(item):
+        threads.add(threading.get_ident())
+        written.append(item)
+
+    with Writer(write, 2) as writer:
+        for i in range(10):
+            writer.put(i)
+    assert written == list(range(10))
+    assert len(threads) == 1
+    assert threading.get_ident() not in threads
+
+
+def test_writer_reraises_the_write_exception_and_stops_writing():
+    written = list()
+
+    def write(item):
+        if item == 1:
+            raise ValueError('cannot write')
+        written.append(item)
+
+    with pytest.raises(ValueError):
+        with Writer(write, 1) as writer:
+            for i in range(5):
+                writer.put(i)
+    assert written == [0]
@@ -0,0 +1,43 @@
+from src.response_cache import ResponseCache
+from unittest.mock import patch
+
+
+def test_get_returns_cached_response_when_data_version_is_the_same():
+    response_cache = ResponseCache()
+    cached_response = response_cache.set(('browser', None, None), 1, b'[]')
+
+    assert response_cache.get(('browser', None, None), 1) == cached_response
+
+
+def test_get_returns_none_when_data_version_changed():
+    response_cache = ResponseCache()
+    response_cache.set(('browser', None, None), 1, b'[]')
+
+    assert response_cache.get(('browser', None, None), 2) is None
+    assert len(response_cache) == 0
+
+
+def test_get_returns_none_when_response_expired():
+    response_cache = ResponseCache(ttl=10)
+    with patch('time.monotonic', return_value=100):
+        response_cache.set(('os', None, None), 1, b'[]')
+    with patch('time.monotonic', return_value=111):
+        assert response_cache.get(('os', None, None), 1) is None
+
+
+def test_set_evicts_least_recently_used_response():
+    response_cache = ResponseCache(maxsize=2)
+    response_cache.set('a', 1, b'a')
+    response_cache.set('b', 1, b'b')
+    response_cache.get('a', 1)
+    response_cache.set('c', 1, b'c')
+
+    assert response_cache.get('b', 1) is None
+    assert response_cache.get('a', 1).body == b'a'
+
+
+def test_set_builds_etag_from_data_version_and_body():
+    response_cache = ResponseCache()
+
+    assert response_cache.set('a', 1, b'a').etag != response_cache.set('a', 1, b'b').etag
+    assert response_cache.set('a', 1, b'a').etag != response_cache.set('a', 2, b'a').etag
@@ -0,0 +1,54 @@
+from src import serve
+from click.testing import CliRunner
+from unittest.mock import patch, MagicMock
+
+
+@patch('src.serve.run_waitress')
+@patch('src.app.create_app')
+def test_main_serves_the_app_with_the_indicated_threads(mock_create_app, mock_run_waitress):
+    runner = CliRunner()
+    result = runner.invoke(serve.main, ['--server', 'waitress', '--port', '8080', '--threads', '4'])
+    assert result.exit_code == 0
+    mock_create_app.assert_called_once_with(None)
+    mock_run_waitress.assert_called_once_with(mock_create_app.return_value, '127.0.0.1', 8080, 4)
+
+
+@patch('src.serve.run_gunicorn')
+@patch('src.serve.get_server', return_value='gunicorn')
+@patch('src.app.create_app')
+def test_main_serves_the_app_with_the_installed_server_and_indicated_workers(mock_create_app, mock_get_server,
+                                                                              mock_run_gunicorn):
+    runner = CliRunner()
+    result = runner.invoke(serve.main, ['--workers', '2', '--threads', '3', '--db-file', 'events.sqlite'])
+    assert result.exit_code == 0
+    mock_create_app.assert_called_once_with('events.sqlite')
+    mock_run_gunicorn.assert_called_once_with(mock_create_app.return_value, '127.0.0.1', 5000, 2, 3)
+
+
+def test_get_server_falls_back_on_werkzeug_when_no_production_server_installed():
+    with patch('importlib.util.find_spec', return_value=None):
+        assert serve.get_server() == 'werkzeug'
+    with patch('importlib.util.find_spec', side_effect=lambda name: None if name == 'gunicorn' else MagicMock()):
+        assert serve.get_server() == 'waitress'
+
+
+def test_run_werkzeug_warms_the_connections_before_serving():
+    application = MagicMock()
+    mock_storage = MagicMock()
+    application.extensions = {'storage': mock_storage}
+    with patch('werkzeug.serving.run_simple',
+               side_effect=lambda *args, **kwargs: mock_storage.warm.assert_called_once_with()) as mock_run_simple:
+        serve.run_werkzeug(application, 'localhost', 5000)
+        mock_storage.warm.assert_called_once_with()
+        mock_run_simple.assert_called_once_with('localhost', 5000, application, threaded=True)
+
+
+@patch('src.serve.run_uvicorn')
+@patch('src.async_app.create_async_app')
+def test_main_serves_the_async_app_when_async_indicated(mock_create_async_app, mock_run_uvicorn):
+    with patch('src.app.create_app') as mock_create_app:
+        runner = CliRunner()
+        result = runner.invoke(serve.main, ['--async', '--port', '8080'])
+        assert result.exit_code == 0
+        assert not mock_create_app.called
+        mock_run_uvicorn.assert_called_once_with(mock_create_async_app.return_value, '127.0.0.1', 8080)
@@ -0,0 +1,95 @@
+from src.sketches import SpaceSaving, HyperLogLog, ExactDistinct, DistinctCounts, hash_values, bit_length
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_space_saving_counts_are_exact_below_capacity():
+    sketch = SpaceSaving(10)
+    sketch.update(pd.Series({'Spain': 3, 'Ireland': 1}))
+    sketch.update(pd.Series({'Spain': 1, 'France': 2}))
+    assert sketch.top(5) == [(4, 'Spain'), (2, 'France'), (1, 'Ireland')]
+    assert sketch.min_count() == 0
+
+
+def test_space_saving_keeps_at_most_capacity_counters():
+    sketch = SpaceSaving(3)
+    for i in range(20):
+        sketch.update({'item{}'.format(i): 1, 'heavy': 5})
+    assert len(sketch) == 3
+    assert sketch.top(1) == [(100, 'heavy')]
+
+
+def test_space_saving_overestimates_untracked_items_by_at_most_their_error():
+    sketch = SpaceSaving(2)
+    sketch.update({'a': 5, 'b': 3})
+    sketch.update({'c': 1})
+    count, item = sketch.top(2)[1]
+    assert item in ('b', 'c')
+    assert count - sketch.errors.get(item, 0) <= {'b': 3, 'c': 1}[item]
+
+
+def test_space_saving_merge_matches_single_summary():
+    chunks = [{'Spain': 3, 'Ireland': 1}, {'Spain': 1, 'France': 2}, {'Ireland': 4}]
+    single = SpaceSaving(10)
+    merged = SpaceSaving(10)
+    for chunk in chunks:
+        single.update(chunk)
+        other = SpaceSaving(10)
+        other.update(chunk)
+        merged.merge(other)
+    assert merged.top(5) == single.top(5)
+
+
+def test_space_saving_top_returns_empty_list_when_nothing_counted():
+    assert SpaceSaving(10).top(5) == []
+
+
+def test_bit_length_matches_int_bit_length():
+    values = np.array([0, 1, 2, 3, 255, 256, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+    assert bit_length(values).tolist() == [int(v).bit_length() for v in values]
+
+
+@pytest.mark.parametrize('users', [10, 1000, 100000])
+def test_hyperloglog_estimates_distinct_users_within_its_error(users):
+    sketch = HyperLogLog(14)
+    sketch.update(hash_values(pd.Series(np.arange(users)).astype(str)))
+    sketch.update(hash_values(pd.Series(np.arange(users)).astype(str)))
+    assert abs(sketch.count() - users) <= max(1, 0.03 * users)
+
+
+def test_hyperloglog_merge_matches_single_sketch():
+    hashes = hash_values(pd.Series(np.arange(5000)).astype(str))
+    single = HyperLogLog(10)
+    single.update(hashes)
+    merged = HyperLogLog(10)
+    for chunk in np.array_split(hashes, 4):
+        other = HyperLogLog(10)
+        other.update(chunk)
+        merged.merge(other)
+    assert merged.count() == single.count()
+
+
+def test_exact_distinct_counts_every_user_once():
+    counter = ExactDistinct()
+    counter.update(hash_values(pd.Series(['a', 'b', 'a'])))
+    other = ExactDistinct()
+    other.update(hash_values(pd.Series(['b', 'c'])))
+    counter.merge(other)
+    assert counter.count() == 3
+
+
+@pytest.mark.parametrize('mode', ['hll', 'exact'])
+def test_distinct_counts_returns_unique_users_per_value_across_chunks(mode):
+    counts = DistinctCounts(mode, 12)
+    counts.update(pd.Series(['Chrome', 'Chrome', 'Firefox', None]), pd.Series(['u1', 'u2', 'u1', 'u3']))
+    other = DistinctCounts(mode, 12)
+    other.update(pd.Series(['Chrome', 'Safari']), pd.Series(['u1', 'u4']))
+    counts.merge(other)
+    assert counts.top(5) == [['Chrome', 2], ['Safari', 1], ['Firefox', 1]]
+    assert counts.top(1) == [['Chrome', 2]]
+
+
+def test_distinct_counts_raises_value_error_when_unknown_mode_indicated():
+    with pytest.raises(ValueError):
+        DistinctCounts('sampled', 12)
@@ -0,0 +1,30 @@
+from unittest.mock import patch
+import pytest
+from src import storage
+
+
+def test_get_storage_returns_the_configured_backend():
+    assert isinstance(storage.get_storage(), storage.SQLiteStorage)
+    with patch('docs.config.STORAGE_BACKEND', 'parquet'):
+        assert isinstance(storage.get_storage(), storage.ParquetStorage)
+
+
+def test_get_storage_raises_value_error_when_backend_is_unknown():
+    with pytest.raises(ValueError):
+        storage.get_storage('duckdb')
+
+
+def test_main_loads_the_events_into_the_configured_backend():
+    with patch('docs.config.STORAGE_BACKEND', 'parquet'), patch('src.parquet_store.load_events') as mock_load_events:
+        storage.main('df', 'replace')
+        mock_load_events.assert_called_once()
+        assert mock_load_events.call_args.args[1:] == ('df', 'replace')
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class IncompleteStorage(storage.Storage):
+        def create_pool(self, size):
+            return None
+
+    with pytest.raises(TypeError):
+        IncompleteStorage('events')
@@ -1,4 +1,6 @@
 from src import transform_ip
+import pandas as pd
+from unittest.mock import patch
 
 
 def test_count_countries_cities_returns_top_five_countries_and_cities_lists_when_dataframe_indicated(
@@ -25,48 +27,109 @@ def test_count_countries_cities_returns_top_five_countries_and_cities_empty_list
     assert transform_ip.count_countries_cities(some_empty_df)[1] == []
 
 
-def test_parse_ip_to_country_city_parses_ip_to_country_city(some_ip_list):
+def test_parse_ip_chain_parses_ip_to_country_city(some_ip_list):
     countries_cities_list = list()
     for ip in some_ip_list:
-        countries_cities_list.append(transform_ip.parse_ip_to_country_city(ip))
-    assert countries_cities_list == ['Ireland/Edgeworthstown', 'United Kingdom/Greenwich', 'Spain/Almuñécar']
+        countries_cities_list.append(transform_ip.parse_ip_chain(ip, dict()))
+    assert countries_cities_list == [('Ireland', 'Edgeworthstown'), ('United Kingdom', 'Greenwich'),
+                                     ('Spain', 'Almuñécar')]
 
 
-def test_parse_ip_to_country_city_parses_ip_to_country_city_when_more_than_one_ip_indicated_in_the_same_row(
+def test_parse_ip_chain_parses_ip_to_country_city_when_more_than_one_ip_indicated_in_the_same_row(
         some_more_than_one_ip_list):
     countries_cities_list = list()
     for ip in some_more_than_one_ip_list:
-        countries_cities_list.append(transform_ip.parse_ip_to_country_city(ip))
+        countries_cities_list.append('/'.join(transform_ip.parse_ip_chain(ip, dict())))
     assert countries_cities_list == ['Ireland/Edgeworthstown', 'United Kingdom/Greenwich',
                                      'Spain,Sweden/Almuñécar,Lindesberg']
 
 
-def test_parse_ip_to_country_city_parses_ip_to_country_city_when_more_than_one_ip_indicated_in_the_same_row_and_one_of_them_raises_value_error(
-        some_more_than_one_ip_list):
-    countries_cities_list = list()
+def test_parse_ip_chain_adds_every_ip_of_the_row_to_the_ip_table(some_more_than_one_ip_list):
+    ip_table = dict()
     for ip in some_more_than_one_ip_list:
-        countries_cities_list.append(transform_ip.parse_ip_to_country_city(ip))
-    assert countries_cities_list == ['Ireland/Edgeworthstown', 'United Kingdom/Greenwich',
-                                     'Spain,Sweden/Almuñécar,Lindesberg']
+        transform_ip.parse_ip_chain(ip, ip_table)
+    assert ip_table == {'86.40.128.3': ('Ireland', 'Edgeworthstown'), '94.14.226.156': ('United Kingdom', 'Greenwich'),
+                        '80.36.109.91': ('Spain', 'Almuñécar'), '78.72.108.136': ('Sweden', 'Lindesberg')}
 
 
-def test_parse_ip_to_country_city_returns_empty_country_city_if_empty_ip_indicated(some_empty_ip_list):
+def test_parse_ip_chain_returns_empty_country_city_if_empty_ip_indicated(some_empty_ip_list):
     countries_cities_list = list()
     for ip in some_empty_ip_list:
-        countries_cities_list.append(transform_ip.parse_ip_to_country_city(ip))
-    assert countries_cities_list == ['', '', '']
+        countries_cities_list.append(transform_ip.parse_ip_chain(ip, dict()))
+    assert countries_cities_list == [('', ''), ('', ''), ('', '')]
 
 
-def test_parse_ip_to_country_city_returns_empty_country_city_if_not_valid_ip_indicated(some_invalid_ip_list):
+def test_parse_ip_chain_returns_empty_country_city_if_not_valid_ip_indicated(some_invalid_ip_list):
     countries_cities_list = list()
     for ip in some_invalid_ip_list:
-        countries_cities_list.append(transform_ip.parse_ip_to_country_city(ip))
-    assert countries_cities_list == ['', '', '']
+        countries_cities_list.append(transform_ip.parse_ip_chain(ip, dict()))
+    assert countries_cities_list == [('', ''), ('', ''), ('', '')]
 
 
-def test_parse_ip_to_country_city_returns_empty_country_city_if_inappropriate_value_indicated(
+def test_parse_ip_chain_returns_empty_country_city_if_inappropriate_value_indicated(
         some_inappropriate_values_list):
     countries_cities_list = list()
     for ip in some_inappropriate_values_list:
-        countries_cities_list.append(transform_ip.parse_ip_to_country_city(ip))
-    assert countries_cities_list == ['', '', '']
+        countries_cities_list.append(transform_ip.parse_ip_chain(str(ip), dict()))
+    assert countries_cities_list == [('', ''), ('', ''), ('', '')]
+
+
+def test_lookup_ip_returns_country_and_city_of_the_ip():
+    assert transform_ip.lookup_ip('86.40.128.3') == ('Ireland', 'Edgeworthstown')
+
+
+def test_lookup_ip_returns_none_if_not_valid_ip_indicated(some_invalid_ip_list):
+    for ip in some_invalid_ip_list:
+        assert transform_ip.lookup_ip(ip) is None
+
+
+def test_parse_ip_writes_country_and_city_columns(some_raw_df):
+    ip_df = transform_ip.parse_ip(some_raw_df, True)
+
+    assert list(ip_df.columns) == ['country', 'city']
+    assert list(ip_df.index) == list(some_raw_df.index)
+    assert ip_df.loc[2].tolist() == list(transform_ip.parse_ip_chain(some_raw_df['ip'][2], dict()))
+
+
+def test_parse_ip_looks_up_every_distinct_ip_once(some_raw_df):
+    df = pd.concat([some_raw_df] * 3, ignore_index=True)
+    with patch('src.transform_ip.lookup_ip', wraps=transform_ip.lookup_ip) as mock_lookup_ip:
+        ip_df = transform_ip.parse_ip(df, True)
+        assert mock_lookup_ip.call_count == 4
+
+    assert ip_df.loc[0].tolist() == ip_df.loc[3].tolist() == ip_df.loc[6].tolist()
+
+
+def test_parse_ip_returns_top_five_countries_and_cities_when_api_is_false(some_raw_df):
+    ip_df, top_countries_sorted_lst, top_cities_sorted_lst = transform_ip.parse_ip(some_raw_df)
+
+    assert ip_df.shape == (3, 2)
+    assert isinstance(top_countries_sorted_lst, list)
+    assert isinstance(top_cities_sorted_lst, list)
+
+
+def test_parse_ip_chain_returns_empty_country_city_if_one_ip_of_the_chain_is_not_valid():
+    assert transform_ip.parse_ip_chain('86.40.128.3,Alvaro', dict()) == ('', '')
+    assert transform_ip.parse_ip_chain('', dict()) == ('', '')
+
+
+def test_parse_ip_returns_categorical_columns_and_empty_country_city_for_missing_ip(some_raw_df):
+    df = some_raw_df.assign(ip=pd.Categorical([None, '94.11.238.152', '94.11.238.152']))
+    ip_df = transform_ip.parse_ip(df, True)
+
+    assert list(ip_df.dtypes) == ['category', 'category']
+    assert ip_df.loc[0].tolist() == ['', '']
+
+
+def test_count_countries_cities_returns_top_n_lists_when_n_indicated(some_country_cities_df):
+    assert transform_ip.count_countries_cities(some_country_cities_df, 2)[1] == [(2, 'Valladolid'), (1, 'Wednesbury')]
+
+
+def test_count_values_ignores_empty_values():
+    df = pd.DataFrame({'country': ['Spain', '', 'Spain, ', 'Ireland']})
+    assert transform_ip.count_values(df, 'country').to_dict() == {'Spain': 2, 'Ireland': 1}
+
+
+def test_top_values_breaks_ties_by_value():
+    counts = pd.Series({'Jarrow': 1, 'Valladolid': 2, 'Wednesbury': 1})
+    assert transform_ip.top_values(counts, 5) == [(2, 'Valladolid'), (1, 'Wednesbury'), (1, 'Jarrow')]
@@ -1,15 +1,100 @@
 from src import transform_ua
+import pandas as pd
+from unittest.mock import patch
 
 
-def test_parse_ua_row_returns_parsed_user_agent_string(some_user_agent_string):
-    assert transform_ua.parse_ua_row(some_user_agent_string) == 'PC/Windows/IE'
+def test_parse_user_agent_string_returns_parsed_user_agent_string(some_user_agent_string):
+    df = pd.DataFrame({'user_id': pd.Series(['a']), 'user_agent_string': pd.Series([some_user_agent_string])})
+    assert list(transform_ua.parse_user_agent_string(df, True).loc[0]) == ['PC', 'Windows', 'IE']
 
 
-def test_parse_ua_row_returns_other_string_when_user_agent_string_is_empty():
-    assert transform_ua.parse_ua_row('') == 'Other/Other/Other'
+def test_parse_user_agent_string_returns_other_when_user_agent_string_is_empty():
+    df = pd.DataFrame({'user_id': pd.Series(['a']), 'user_agent_string': pd.Series([''])})
+    assert list(transform_ua.parse_user_agent_string(df, True).loc[0]) == ['Other', 'Other', 'Other']
+    assert transform_ua.parse_ua('') == ('Other', 'Other', 'Other')
 
 
-def test_count_browsers_os_returns_browser_and_os_lists_when_df_indicated(some_browser_os_df):
-    assert transform_ua.count_browsers_os(some_browser_os_df)[0] == [['Mobile Safari', 3], ['IE', 2], ['Chrome', 1]]
-    assert transform_ua.count_browsers_os(some_browser_os_df)[1] == [['iOS', 3], ['Mac OS X', 2], ['Windows', 1]]
+def test_count_users_browsers_os_returns_browser_and_os_lists_when_df_indicated(some_browser_os_df):
+    top_browsers_sorted_lst, top_os_sorted_lst = transform_ua.count_users_browsers_os(some_browser_os_df)
+    assert top_browsers_sorted_lst == [['Mobile Safari', 3], ['IE', 2], ['Chrome', 1]]
+    assert top_os_sorted_lst == [['iOS', 3], ['Mac OS X', 2], ['Windows', 1]]
 
+
+def test_count_users_browsers_os_counts_every_user_once(some_browser_os_df):
+    df = some_browser_os_df.assign(user_id=['a', 'a', 'a', 'b', 'c', 'd'])
+    assert transform_ua.count_users_browsers_os(df)[0] == [['IE', 2], ['Mobile Safari', 1], ['Chrome', 1]]
+
+
+
+def test_parse_ua_returns_device_os_and_browser(some_user_agent_string):
+    assert transform_ua.parse_ua(some_user_agent_string) == ('PC', 'Windows', 'IE')
+
+
+def test_parse_user_agent_string_parses_every_distinct_user_agent_string_once(some_raw_df):
+    df = pd.concat([some_raw_df] * 3, ignore_index=True)
+    with patch('src.transform_ua.parse_ua', wraps=transform_ua.parse_ua) as mock_parse_ua:
+        parsed_df = transform_ua.parse_user_agent_string(df, True, transform_ua.UserAgentCache())
+        assert mock_parse_ua.call_count == 3
+
+    assert parsed_df.shape == (9, 3)
+    assert list(parsed_df.loc[[0, 3, 6], 'browser']) == ['IE'] * 3
+    assert list(parsed_df.loc[2, ['os', 'browser']]) == ['Android', 'Chrome']
+
+
+def test_parse_user_agent_string_returns_top_five_browsers_and_os_when_api_is_false(some_raw_df):
+    parsed_df, top_browsers_sorted_lst, top_os_sorted_lst = transform_ua.parse_user_agent_string(
+        some_raw_df, False, transform_ua.UserAgentCache())
+
+    assert sorted(i[0] for i in top_browsers_sorted_lst) == ['Chrome', 'Firefox', 'IE']
+    assert sorted(i[0] for i in top_os_sorted_lst) == ['Android', 'Windows']
+
+
+def test_user_agent_cache_evicts_least_recently_used_user_agent_string():
+    ua_cache = transform_ua.UserAgentCache(maxsize=2)
+    ua_cache.get('a')
+    ua_cache.get('b')
+    ua_cache.get('a')
+    ua_cache.get('c')
+
+    assert list(ua_cache._parsed) == ['a', 'c']
+
+
+def test_user_agent_cache_starts_warm_when_loaded_from_saved_file(tmp_path, some_user_agent_string):
+    path = str(tmp_path / 'cache' / 'ua_cache.json')
+    ua_cache = transform_ua.UserAgentCache(path=path)
+    ua_cache.get(some_user_agent_string)
+    ua_cache.save()
+
+    warm_ua_cache = transform_ua.UserAgentCache(path=path)
+    warm_ua_cache.load()
+    with patch('src.transform_ua.parse_ua') as mock_parse_ua:
+        assert warm_ua_cache.get(some_user_agent_string) == ('PC', 'Windows', 'IE')
+        assert not mock_parse_ua.called
+
+
+def test_user_agent_cache_ignores_invalid_file(tmp_path):
+    path = tmp_path / 'ua_cache.json'
+    path.write_text('not json')
+    ua_cache = transform_ua.UserAgentCache(path=str(path))
+    ua_cache.load()
+
+    assert len(ua_cache) == 0
+
+
+def test_parse_user_agent_string_returns_categorical_columns(some_raw_df):
+    parsed_df = transform_ua.parse_user_agent_string(some_raw_df, True, transform_ua.UserAgentCache())
+
+    assert all(dtype == 'category' for dtype in parsed_df.dtypes)
+
+
+def test_parse_user_agent_string_parses_missing_user_agent_string_as_empty(some_raw_df):
+    df = some_raw_df.assign(user_agent_string=[None, some_raw_df['user_agent_string'][1], None])
+    parsed_df = transform_ua.parse_user_agent_string(df, True, transform_ua.UserAgentCache())
+
+    assert list(parsed_df.loc[0]) == list(parsed_df.loc[2]) == ['Other', 'Other', 'Other']
+
+
+def test_count_users_browsers_os_leaves_out_categories_without_users(some_browser_os_df):
+    df = some_browser_os_df.astype('category').iloc[:3]
+
+    assert transform_ua.count_users_browsers_os(df)[0] == [['Mobile Safari', 3]]